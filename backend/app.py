@@ -1,10 +1,16 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, Response
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
 import os
 from datetime import timedelta
 
+from models import db
+from models.routing import REPLICA_BIND, engine_options
+from config import DATABASE_REPLICA_URL
+from services import metrics
+from services import write_buffer
+
 # Import routes
 from routes.auth import auth_bp
 from routes.user import user_bp
@@ -28,10 +34,16 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
     f"mysql+pymysql://{os.environ.get('MYSQL_USER', 'root')}:{os.environ.get('MYSQL_PASSWORD', '')}@{os.environ.get('MYSQL_HOST', 'localhost')}/{os.environ.get('MYSQL_DATABASE', 'mi_health_tracker')}"
 )
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+if DATABASE_REPLICA_URL:
+    app.config['SQLALCHEMY_BINDS'] = {REPLICA_BIND: DATABASE_REPLICA_URL}
 
 # Initialize extensions
 CORS(app)
 jwt = JWTManager(app)
+db.init_app(app)
+metrics.init_app(app)
+write_buffer.init_app(app)
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -54,5 +66,10 @@ def internal_error(error):
 def health_check():
     return jsonify({"status": "ok"})
 
+# Prometheus metrics endpoint
+@app.route('/api/metrics')
+def prometheus_metrics():
+    return Response(metrics.render_latest(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=os.environ.get('FLASK_ENV') == 'development') 
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""
+Accuracy and latency benchmark for the weight forecasting engines
+
+Generates synthetic weigh-in series in the same style as the sample data in
+init_db.py (a base weight with uniform day-to-day noise) plus a slow trend,
+holds out the last ``horizon`` points, and reports mean absolute error and
+fit+forecast latency for every engine and series length.
+
+Usage:
+    python benchmarks/forecast_benchmark.py [--trials 40] [--seed 0] [--horizon 7] [--drift 0.1]
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.forecasting import ENGINES, get_engine, select_engine  # noqa: E402
+from config import FORECAST_LATENCY_BUDGET_MS  # noqa: E402
+
+
+def synthetic_weights(n, rng, base_weight=75.0, drift=0.1):
+    """
+    Generate ``n`` daily weigh-ins
+
+    The true weight follows a random slow trend plus a random walk with
+    ``drift`` kg/day standard deviation; readings add uniform scale noise.
+    """
+    trend = rng.uniform(-0.05, 0.05)  # kg per day
+    walk = np.cumsum(rng.normal(0, drift, size=n))
+    noise = rng.uniform(-1.0, 1.0, size=n)
+    return base_weight + trend * np.arange(n) + walk + noise
+
+
+def run(lengths, trials, horizon, seed, drift):
+    rng = np.random.default_rng(seed)
+    names = list(ENGINES) + ['auto']
+    print(f"{'points':>6} {'engine':>16} {'mae_kg':>8} {'p50_ms':>9} {'p95_ms':>9}")
+
+    for n in lengths:
+        series = [synthetic_weights(n + horizon, rng, drift=drift) for _ in range(trials)]
+        for name in names:
+            errors = []
+            latencies = []
+            for values in series:
+                train, test = values[:n], values[n:]
+                engine_name = select_engine(n, FORECAST_LATENCY_BUDGET_MS) if name == 'auto' else name
+                start = time.perf_counter()
+                try:
+                    forecast = get_engine(engine_name).fit(train).forecast(horizon)
+                except Exception as e:
+                    print(f"{n:>6} {name:>16} failed: {e}")
+                    break
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors.append(np.mean(np.abs(forecast - test)))
+            if latencies:
+                label = f'auto({engine_name})' if name == 'auto' else name
+                print(f"{n:>6} {label:>16} {np.mean(errors):>8.3f} "
+                      f"{np.percentile(latencies, 50):>9.2f} {np.percentile(latencies, 95):>9.2f}")
+        print()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[15, 30, 60, 90, 120, 180, 365])
+    parser.add_argument('--trials', type=int, default=40)
+    parser.add_argument('--horizon', type=int, default=7)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--drift', type=float, default=0.1, help='Random-walk std of the true weight (kg/day)')
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore')
+    run(args.lengths, args.trials, args.horizon, args.seed, args.drift)
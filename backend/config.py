@@ -15,9 +15,26 @@ MYSQL_USER = os.environ.get('MYSQL_USER', 'root')
 MYSQL_PASSWORD = os.environ.get('MYSQL_PASSWORD', '')
 MYSQL_DATABASE = os.environ.get('MYSQL_DATABASE', 'mi_health_tracker')
 DATABASE_URL = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}/{MYSQL_DATABASE}"
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')  # Optional read replica for GET handlers
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))  # seconds, below MySQL's wait_timeout
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '30000'))  # 0 disables
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_SECONDS = float(os.environ.get('REPLICA_LAG_CHECK_SECONDS', '10'))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))  # statements slower than this are logged with their route
+QUERY_BUDGET_DEFAULT = int(os.environ.get('QUERY_BUDGET_DEFAULT', '0'))  # statements per request without @query_budget; 0 disables
+QUERY_BUDGET_ASSERT = os.environ.get('QUERY_BUDGET_ASSERT', 'false').lower() == 'true'  # raise instead of log (for tests)
 
 # MongoDB configuration
 MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/mi_health_tracker')
+MONGO_TIMEOUT_MS = int(os.environ.get('MONGO_TIMEOUT_MS', '2000'))
+
+# Raw device payload archive: 'mongo', 'memory' (in-process, for development) or 'none'
+RAW_ARCHIVE_BACKEND = os.environ.get('RAW_ARCHIVE_BACKEND', 'mongo')
+RAW_ARCHIVE_RETRY_SECONDS = float(os.environ.get('RAW_ARCHIVE_RETRY_SECONDS', '60'))  # wait after a failed connect before retrying
 
 # Xiaomi API configuration
 XIAOMI_TOKEN = os.environ.get('XIAOMI_TOKEN')
@@ -25,12 +42,72 @@ XIAOMI_IP = os.environ.get('XIAOMI_IP')
 
 # ML model configuration
 MODEL_DIR = os.path.join(os.path.dirname(__file__), 'ml', 'models')
-WEIGHT_PREDICTION_MODEL = os.path.join(MODEL_DIR, 'weight_prediction.pkl')
-ANOMALY_DETECTION_MODEL = os.path.join(MODEL_DIR, 'anomaly_detection.pkl')
+# Per-user compact models: MODEL_DIR/user_<id>/<name>.json manifest + array directory
+WEIGHT_PREDICTION_MODEL = 'weight_prediction'
+ANOMALY_DETECTION_MODEL = 'anomaly_detection'  # suffixed with the metric
+
+# Forecasting configuration
+FORECAST_ENGINE = os.environ.get('FORECAST_ENGINE', 'auto')  # 'auto', 'holt', 'holt_exponential', 'robust_trend' or 'arima'
+FORECAST_LATENCY_BUDGET_MS = float(os.environ.get('FORECAST_LATENCY_BUDGET_MS', '50'))
+ARIMA_DEFAULT_ORDER = (5, 1, 0)  # Used until a user's order has been tuned
+ARIMA_MAX_P = int(os.environ.get('ARIMA_MAX_P', '5'))
+ARIMA_MAX_Q = int(os.environ.get('ARIMA_MAX_Q', '2'))
+ARIMA_TUNE_MIN_NEW_POINTS = int(os.environ.get('ARIMA_TUNE_MIN_NEW_POINTS', '14'))  # New weigh-ins before re-tuning
+BATCH_FORECAST_HORIZON_DAYS = int(os.environ.get('BATCH_FORECAST_HORIZON_DAYS', '30'))
+ARIMA_REFIT_MIN_NEW_POINTS = int(os.environ.get('ARIMA_REFIT_MIN_NEW_POINTS', '14'))  # new weigh-ins filtered with stored parameters before a full refit
+ARIMA_REFIT_MAX_AGE_DAYS = int(os.environ.get('ARIMA_REFIT_MAX_AGE_DAYS', '7'))  # full refit at least this often
+
+# Long-format (user_id, metric_id, ts, value) copy of health_data, used for single-metric reads
+METRIC_STORE_ENABLED = os.environ.get('METRIC_STORE_ENABLED', 'false').lower() == 'true'
+
+# Hot/cold tiering of health_data (jobs/archive_health_data.py); keep ARCHIVE_AFTER_DAYS above
+# the longest window the insights endpoints read (365 days) so they stay on the hot tier
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '730'))
+ARCHIVE_BACKEND = os.environ.get('ARCHIVE_BACKEND', 'table')  # 'table', 'parquet' or 'none'
+ARCHIVE_PARQUET_DIR = os.environ.get('ARCHIVE_PARQUET_DIR', os.path.join(os.path.dirname(__file__), 'data', 'archive', 'health_data'))
+
+# Delta sync (GET /api/health/changes)
+CHANGES_SETTLE_SECONDS = int(os.environ.get('CHANGES_SETTLE_SECONDS', '5'))  # rows newer than this wait for the next sync
+CHANGES_MAX_PAGE_SIZE = int(os.environ.get('CHANGES_MAX_PAGE_SIZE', '1000'))
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', '90'))  # older sync tokens need a full resync
+
+# Cohort percentiles (gender x age band binned counts)
+COHORT_SKETCH_SHARDS = int(os.environ.get('COHORT_SKETCH_SHARDS', '8'))
+COHORT_MIN_SIZE = int(os.environ.get('COHORT_MIN_SIZE', '20'))  # users before a cohort is reported
+
+# Write-behind buffer for high-frequency manual metrics (services/write_buffer.py)
+WRITE_BUFFER_ENABLED = os.environ.get('WRITE_BUFFER_ENABLED', 'false').lower() == 'true'
+WRITE_BUFFER_METRICS = os.environ.get('WRITE_BUFFER_METRICS', 'steps,water_intake,calories_consumed,calories_burned').split(',')
+WRITE_BUFFER_MAX_PENDING = int(os.environ.get('WRITE_BUFFER_MAX_PENDING', '500'))  # (user, day) entries before a flush
+WRITE_BUFFER_FLUSH_SECONDS = float(os.environ.get('WRITE_BUFFER_FLUSH_SECONDS', '5'))
+WRITE_BUFFER_LOG_DIR = os.environ.get('WRITE_BUFFER_LOG_DIR', os.path.join(os.path.dirname(__file__), 'data', 'write_buffer'))
+WRITE_BUFFER_FSYNC = os.environ.get('WRITE_BUFFER_FSYNC', 'true').lower() == 'true'  # fsync each update before acknowledging
+
+# Insight computation pool (0 workers runs jobs inline in the web process)
+INSIGHT_POOL_WORKERS = int(os.environ.get('INSIGHT_POOL_WORKERS', '2'))
+INSIGHT_POOL_START_METHOD = os.environ.get('INSIGHT_POOL_START_METHOD', 'spawn')
+INSIGHT_QUEUE_LIMIT = int(os.environ.get('INSIGHT_QUEUE_LIMIT', '32'))  # unfinished jobs before new ones are rejected
+INSIGHT_WAIT_TIMEOUT_SECONDS = float(os.environ.get('INSIGHT_WAIT_TIMEOUT_SECONDS', '10'))  # GET endpoints fall back to a job id
+INSIGHT_JOB_TTL_SECONDS = int(os.environ.get('INSIGHT_JOB_TTL_SECONDS', '600'))  # finished jobs kept for polling
+
+# Batch anomaly detection (isolation_forest, mad or seasonal; see services/anomaly_detectors.py)
+ANOMALY_DETECTOR = os.environ.get('ANOMALY_DETECTOR', 'isolation_forest')
+
+# Ingest-time anomaly scoring
+ANOMALY_EWMA_ALPHA = float(os.environ.get('ANOMALY_EWMA_ALPHA', '0.1'))
+ANOMALY_MAD_WINDOW = int(os.environ.get('ANOMALY_MAD_WINDOW', '15'))  # readings kept per user and metric
+ANOMALY_SCORE_THRESHOLD = float(os.environ.get('ANOMALY_SCORE_THRESHOLD', '3.5'))
+ANOMALY_WARMUP = int(os.environ.get('ANOMALY_WARMUP', '10'))  # readings before anything is flagged
+
+# Write-time derived metrics: rolling mean and slope windows in days
+TREND_WINDOWS_DAYS = [int(days) for days in os.environ.get('TREND_WINDOWS_DAYS', '7,30').split(',')]
 
 # API configuration
 API_PREFIX = '/api'
 CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*').split(',')
+ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'admin@example.com')
+USER_LIST_MAX_PAGE_SIZE = int(os.environ.get('USER_LIST_MAX_PAGE_SIZE', '500'))
+USER_COUNT_CACHE_SECONDS = int(os.environ.get('USER_COUNT_CACHE_SECONDS', '60'))
 
 # Logging configuration
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO') 
\ No newline at end of file
@@ -5,6 +5,14 @@ from dotenv import load_dotenv
 from models import db
 from models.user import User
 from models.health_data import HealthData
+from models.model_metadata import ModelMetadata
+from models.forecast import Forecast
+from models.anomaly_state import AnomalyState
+from models.recommendation import UserRecommendation
+from models.metric_series import Metric, MetricValue
+from models.health_data_archive import HealthDataArchive
+from models.cohort_sketch import CohortSketch
+from models.health_data_tombstone import HealthDataTombstone
 import datetime
 import random
 
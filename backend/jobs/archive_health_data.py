@@ -0,0 +1,181 @@
+"""
+Move old health data to the cold tier
+
+Moves health_data rows dated before the cutoff (ARCHIVE_AFTER_DAYS by
+default), oldest id first, into either the compressed health_data_archive
+table or monthly Parquet files under ARCHIVE_PARQUET_DIR. Each chunk is
+copied and then deleted, so a failed run can simply be rerun. On a monthly
+partitioned MySQL table, partitions left empty are dropped afterwards.
+
+The Parquet archive keeps a per-user (first_date, last_date) index, so
+reads only open the months a user has rows in. It is marked stale for the
+duration of a run, and rebuilt from the files if a run was interrupted.
+
+services/tiered_storage.py reads the cold tier back when a request's range
+reaches it. The long-format metric_values store is not touched and keeps the
+full history.
+
+Run from the backend directory:
+    python -m jobs.archive_health_data [--older-than-days 730] [--target table|parquet] [--chunk-size 5000]
+"""
+import argparse
+import glob
+import logging
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import text
+
+from app import app
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BACKEND, ARCHIVE_PARQUET_DIR
+from models import db
+from models.health_data import HealthData
+from models.health_data_archive import HealthDataArchive
+from services.tiered_storage import parquet_index_marker, parquet_index_path, parquet_index_stale, parquet_path
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [column.name for column in HealthData.__table__.columns]
+
+
+def load_chunk(cutoff, chunk_size):
+    """The next chunk of rows older than the cutoff, as plain dictionaries"""
+    rows = db.session.query(*[HealthData.__table__.c[name] for name in COLUMNS]).filter(
+        HealthData.date < cutoff
+    ).order_by(HealthData.id).limit(chunk_size).all()
+    return [dict(zip(COLUMNS, row)) for row in rows]
+
+
+def write_table(rows):
+    # Rows that a previous interrupted run already copied are replaced
+    ids = [row['id'] for row in rows]
+    HealthDataArchive.query.filter(HealthDataArchive.id.in_(ids)).delete(synchronize_session=False)
+    db.session.execute(HealthDataArchive.__table__.insert(), rows)
+
+
+def write_parquet(rows, parquet_dir):
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    months = df['date'].dt.to_period('M')
+    for period, month_rows in df.groupby(months):
+        directory = parquet_path(parquet_dir, period.year, period.month)
+        os.makedirs(directory, exist_ok=True)
+        # One file per chunk and month; the id range keeps reruns idempotent
+        filename = f"part-{int(month_rows['id'].min())}-{int(month_rows['id'].max())}.parquet"
+        month_rows.to_parquet(os.path.join(directory, filename), compression='zstd', index=False)
+
+
+def chunk_user_dates(rows):
+    """(user_id, first_date, last_date) of the users in a chunk"""
+    df = pd.DataFrame(rows, columns=['user_id', 'date'])
+    return df.groupby('user_id')['date'].agg(first_date='min', last_date='max').reset_index()
+
+
+def scan_user_dates(parquet_dir):
+    """(user_id, first_date, last_date) over every archived file"""
+    files = glob.glob(os.path.join(parquet_dir, 'year=*', 'month=*', '*.parquet'))
+    frames = [chunk_user_dates(pd.read_parquet(path, columns=['user_id', 'date'])) for path in files]
+    return pd.concat(frames, ignore_index=True) if frames else chunk_user_dates([])
+
+
+def write_parquet_index(parquet_dir, user_dates, rebuild=False):
+    """Merge new per-user ranges into the index (or replace it), then clear the stale marker"""
+    path = parquet_index_path(parquet_dir)
+    frames = list(user_dates)
+    if rebuild:
+        frames = [scan_user_dates(parquet_dir)]
+    elif os.path.exists(path):
+        frames.append(pd.read_parquet(path))
+    if frames:
+        index = pd.concat(frames, ignore_index=True).groupby('user_id').agg(
+            first_date=('first_date', 'min'), last_date=('last_date', 'max')
+        ).reset_index().sort_values('user_id')
+        # Readers filter on user_id; small row groups let them skip most of the file
+        index.to_parquet(path + '.tmp', index=False, row_group_size=10000)
+        os.replace(path + '.tmp', path)
+    marker = parquet_index_marker(parquet_dir)
+    if os.path.exists(marker):
+        os.remove(marker)
+
+
+def drop_empty_partitions(cutoff):
+    """Drop monthly partitions that end before the cutoff and no longer hold rows (MySQL)"""
+    if db.engine.dialect.name != 'mysql':
+        return []
+
+    rows = db.session.execute(text(
+        'SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS '
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'health_data' AND PARTITION_NAME IS NOT NULL"
+    )).fetchall()
+
+    dropped = []
+    for name, description in rows:
+        if name == 'pmax':
+            continue
+        upper_days = int(description)
+        ends_before_cutoff = db.session.execute(
+            text('SELECT TO_DAYS(:cutoff) >= :upper'), {'cutoff': cutoff, 'upper': upper_days}
+        ).scalar()
+        if not ends_before_cutoff:
+            continue
+        empty = db.session.execute(text(f'SELECT COUNT(*) FROM health_data PARTITION ({name})')).scalar() == 0
+        if empty:
+            db.session.execute(text(f'ALTER TABLE health_data DROP PARTITION {name}'))
+            dropped.append(name)
+    return dropped
+
+
+def archive(older_than_days=ARCHIVE_AFTER_DAYS, target=ARCHIVE_BACKEND, chunk_size=5000, parquet_dir=ARCHIVE_PARQUET_DIR):
+    if target not in ('table', 'parquet'):
+        raise ValueError(f'Unknown archive target: {target}')
+    if older_than_days < ARCHIVE_AFTER_DAYS:
+        # Reads only look at the cold tier for ranges older than ARCHIVE_AFTER_DAYS
+        raise ValueError(f'older_than_days must be at least ARCHIVE_AFTER_DAYS ({ARCHIVE_AFTER_DAYS})')
+
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    moved = 0
+    user_dates = []
+    if target == 'parquet':
+        # An earlier run that died mid-way left files the index doesn't cover
+        rebuild_index = parquet_index_stale(parquet_dir)
+        os.makedirs(parquet_dir, exist_ok=True)
+        open(parquet_index_marker(parquet_dir), 'w').close()
+    with app.app_context():
+        while True:
+            rows = load_chunk(cutoff, chunk_size)
+            if not rows:
+                break
+
+            if target == 'table':
+                write_table(rows)
+            else:
+                write_parquet(rows, parquet_dir)
+                user_dates.append(chunk_user_dates(rows))
+
+            # Bulk delete: no per-row ORM hooks, so metric_values keeps these readings
+            HealthData.query.filter(HealthData.id.in_([row['id'] for row in rows])).delete(synchronize_session=False)
+            db.session.commit()
+
+            moved += len(rows)
+            logger.info(f"Archive: {moved} rows moved (through id {rows[-1]['id']})")
+
+        if target == 'parquet':
+            write_parquet_index(parquet_dir, user_dates, rebuild=rebuild_index)
+
+        dropped = drop_empty_partitions(cutoff)
+        if dropped:
+            logger.info(f"Archive: dropped empty partitions {', '.join(dropped)}")
+        db.session.commit()
+    return moved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move old health data to the cold tier')
+    parser.add_argument('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument('--target', choices=['table', 'parquet'], default=ARCHIVE_BACKEND if ARCHIVE_BACKEND in ('table', 'parquet') else 'table')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--parquet-dir', default=ARCHIVE_PARQUET_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(f"Archived {archive(args.older_than_days, args.target, args.chunk_size, args.parquet_dir)} health data rows")
@@ -0,0 +1,63 @@
+"""
+Replay existing health data through the streaming anomaly scorer
+
+Rebuilds every user's detector state and the stored anomaly flags, e.g. after
+enabling ingest-time scoring on an existing database or changing thresholds.
+
+Run from the backend directory:
+    python -m jobs.backfill_anomaly_scores [--chunk-size 1000]
+"""
+import argparse
+import logging
+
+from app import app
+from models import db
+from models.anomaly_state import AnomalyState
+from models.health_data import HealthData
+from models.user import User
+from services.streaming_anomaly import scorer
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_user(user_id, chunk_size=1000):
+    """Rebuild one user's anomaly state and flags, oldest reading first"""
+    AnomalyState.query.filter_by(user_id=user_id).delete()
+
+    last_date, last_id = None, 0
+    while True:
+        query = HealthData.query.filter(HealthData.user_id == user_id)
+        if last_date is not None:
+            query = query.filter(db.or_(
+                HealthData.date > last_date,
+                db.and_(HealthData.date == last_date, HealthData.id > last_id)
+            ))
+        entries = query.order_by(HealthData.date, HealthData.id).limit(chunk_size).all()
+        if not entries:
+            break
+        scorer.score_entries(db.session, user_id, entries)
+        db.session.flush()
+        last_date, last_id = entries[-1].date, entries[-1].id
+
+    db.session.commit()
+
+
+def backfill_all(chunk_size=1000):
+    with app.app_context():
+        user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+        for user_id in user_ids:
+            try:
+                backfill_user(user_id, chunk_size)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Anomaly backfill failed for user {user_id}: {e}")
+        return len(user_ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild streaming anomaly state from history')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(f"Backfilled anomaly scores for {backfill_all(args.chunk_size)} users")
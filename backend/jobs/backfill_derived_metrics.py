@@ -0,0 +1,80 @@
+"""
+Fill in write-time derived metrics for existing health data
+
+Derives BMI from the user's height on weigh-ins that have none and
+recomputes every row's stored rolling means and slopes, e.g. after enabling
+derived metrics on an existing database or changing TREND_WINDOWS_DAYS.
+Each user's history is processed in date spans of ``--span-days`` so memory
+stays bounded however long the history is.
+
+Run from the backend directory:
+    python -m jobs.backfill_derived_metrics [--span-days 180]
+"""
+import argparse
+import logging
+from datetime import timedelta
+
+from sqlalchemy import func
+
+from app import app
+from models import db
+from models.health_data import HealthData
+from models.user import User
+from services.derived_metrics import derive_bmi, recompute_trends
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_user(user_id, height, span_days=180):
+    """Derive missing BMIs and recompute trends for one user, one date span per commit"""
+    first, last = db.session.query(func.min(HealthData.date), func.max(HealthData.date)).filter(
+        HealthData.user_id == user_id
+    ).one()
+    if first is None:
+        return 0
+
+    updated = 0
+    span = timedelta(days=span_days)
+    start = first
+    while start <= last:
+        end = start + span
+        if height:
+            missing = HealthData.query.filter(
+                HealthData.user_id == user_id,
+                HealthData.date >= start,
+                HealthData.date < end,
+                HealthData.weight.isnot(None),
+                db.or_(HealthData.bmi.is_(None), HealthData.bmi == 0)
+            )
+            for entry in missing:
+                derive_bmi(entry, height)
+
+        # recompute_trends takes an inclusive end; the next span starts at end
+        updated += recompute_trends(db.session, user_id, start, end - timedelta(microseconds=1))
+        db.session.commit()
+        db.session.expunge_all()
+        start = end
+    return updated
+
+
+def backfill_all(span_days=180):
+    with app.app_context():
+        users = db.session.query(User.id, User.height).order_by(User.id).all()
+        rows = 0
+        for user_id, height in users:
+            try:
+                rows += backfill_user(user_id, height, span_days)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Derived metric backfill failed for user {user_id}: {e}")
+        return len(users), rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Derive BMI and rolling trends for existing health data')
+    parser.add_argument('--span-days', type=int, default=180, help='Days of history loaded per user at a time')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    users, rows = backfill_all(args.span_days)
+    print(f"Backfilled derived metrics for {rows} rows of {users} users")
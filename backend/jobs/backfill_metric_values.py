@@ -0,0 +1,54 @@
+"""
+Copy health data into the long-format metric_values store
+
+Rebuilds metric_values from health_data in id-ordered chunks, e.g. after
+enabling METRIC_STORE_ENABLED on an existing database or after bulk writes
+that bypassed the ORM hooks in services/metric_store.py.
+
+Run from the backend directory:
+    python -m jobs.backfill_metric_values [--chunk-size 5000]
+"""
+import argparse
+import logging
+
+from app import app
+from models import db
+from models.health_data import HealthData
+from models.metric_series import MetricValue
+from services.metric_store import rows_for_entry
+
+logger = logging.getLogger(__name__)
+
+
+def backfill_all(chunk_size=5000):
+    with app.app_context():
+        MetricValue.query.delete()
+        db.session.commit()
+
+        copied, last_id = 0, 0
+        while True:
+            entries = HealthData.query.options(HealthData.load_only(HealthData.METRICS + ['user_id'])).filter(
+                HealthData.id > last_id
+            ).order_by(HealthData.id).limit(chunk_size).all()
+            if not entries:
+                break
+
+            connection = db.session.connection()
+            rows = [row for entry in entries for row in rows_for_entry(connection, entry)]
+            if rows:
+                connection.execute(MetricValue.__table__.insert(), rows)
+            db.session.commit()
+
+            copied += len(rows)
+            last_id = entries[-1].id
+            logger.info(f"Metric values: {copied} values copied through health_data id {last_id}")
+        return copied
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the long-format metric store from health_data')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(f"Copied {backfill_all(args.chunk_size)} metric values")
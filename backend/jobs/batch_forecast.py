@@ -0,0 +1,191 @@
+"""
+Nightly batch forecasting for all users
+
+Streams users in id-ordered chunks, fits weight forecasts and anomaly scores in
+a process pool spanning all cores, and upserts the results into the forecasts
+table. The insights endpoints serve these rows until a user's data changes.
+
+This is also the scheduled full ARIMA refit: every user's model is re-estimated
+(warm-started from the stored parameters) and the new fit is stored, so the
+request path can keep filtering new weigh-ins with it.
+
+Run from the backend directory:
+    python -m jobs.batch_forecast [--chunk-size 500] [--processes N]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+from datetime import datetime
+
+from app import app
+from config import BATCH_FORECAST_HORIZON_DAYS, FORECAST_ENGINE
+from models import db
+from models.forecast import Forecast
+from models.health_data import HealthData
+from models.model_metadata import ModelMetadata
+from models.user import User
+from services.arima_tuner import FIT_MODEL_TYPE as ARIMA_FIT_MODEL_TYPE, MODEL_TYPE as ARIMA_MODEL_TYPE, save_fit_state
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_METRICS = ['weight', 'body_fat', 'muscle_mass']
+
+_ml_service = None
+
+
+def _init_worker():
+    # One service instance per worker process. Results go to the forecasts
+    # table; saving each user's fitted models would only rewrite model files
+    # once per user per night.
+    global _ml_service
+    from services.ml_service import HealthMLService
+    _ml_service = HealthMLService(persist_models=False)
+
+
+def compute_user_insights(task):
+    """
+    Fit the forecast and anomaly scores for one user (runs in a pool worker)
+
+    Args:
+        task (tuple): (user_id, health_data, arima_order, arima_state, horizon_days)
+
+    Returns:
+        tuple: (user_id, prediction dict, {metric: anomaly dict})
+    """
+    user_id, health_data, arima_order, arima_state, horizon_days = task
+    prediction = _ml_service.predict_weight(health_data, horizon_days, FORECAST_ENGINE, arima_order, arima_state)
+    anomalies = {
+        metric: _ml_service.detect_anomalies(health_data, metric)
+        for metric in ANOMALY_METRICS
+    }
+    return user_id, prediction, anomalies
+
+
+def iter_user_chunks(chunk_size):
+    """Yield lists of user ids using keyset pagination, so no chunk holds the whole table"""
+    last_id = 0
+    while True:
+        user_ids = [
+            user_id for (user_id,) in db.session.query(User.id)
+            .filter(User.id > last_id, User.is_active.is_(True))
+            .order_by(User.id)
+            .limit(chunk_size)
+        ]
+        if not user_ids:
+            return
+        yield user_ids
+        last_id = user_ids[-1]
+
+
+def load_chunk(user_ids, horizon_days):
+    """
+    Load the health data of a chunk of users with one query
+
+    Returns:
+        tuple: (list of worker tasks, {user_id: newest updated_at})
+    """
+    columns = [HealthData.user_id, HealthData.date, HealthData.updated_at] + \
+        [getattr(HealthData, metric) for metric in ANOMALY_METRICS]
+    rows = db.session.query(*columns).filter(
+        HealthData.user_id.in_(user_ids)
+    ).order_by(HealthData.user_id, HealthData.date).all()
+
+    health_data = {user_id: [] for user_id in user_ids}
+    data_through = {}
+    for row in rows:
+        record = {'date': row.date.isoformat()}
+        for metric in ANOMALY_METRICS:
+            record[metric] = getattr(row, metric)
+        health_data[row.user_id].append(record)
+        if row.updated_at and (row.user_id not in data_through or row.updated_at > data_through[row.user_id]):
+            data_through[row.user_id] = row.updated_at
+
+    orders, fit_states = {}, {}
+    for metadata in ModelMetadata.query.filter(
+        ModelMetadata.user_id.in_(user_ids),
+        ModelMetadata.model_type.in_([ARIMA_MODEL_TYPE, ARIMA_FIT_MODEL_TYPE])
+    ):
+        if metadata.model_type == ARIMA_MODEL_TYPE:
+            orders[metadata.user_id] = metadata.get_params().get('order')
+        else:
+            # Force the scheduled full refit, starting from the stored parameters
+            fit_states[metadata.user_id] = dict(metadata.get_params(), refit=True)
+
+    tasks = [
+        (user_id, records, tuple(orders[user_id]) if orders.get(user_id) else None, fit_states.get(user_id), horizon_days)
+        for user_id, records in health_data.items() if records
+    ]
+    return tasks, data_through
+
+
+def save_results(results, data_through, horizon_days):
+    """Upsert one chunk of results into the forecasts table"""
+    user_ids = [user_id for user_id, _, _ in results]
+    existing = {
+        forecast.user_id: forecast
+        for forecast in Forecast.query.filter(Forecast.user_id.in_(user_ids))
+    }
+
+    now = datetime.utcnow()
+    for user_id, prediction, anomalies in results:
+        arima_state = prediction.pop('arima_state', None)
+        if arima_state:
+            save_fit_state(user_id, arima_state)
+
+        forecast = existing.get(user_id)
+        if forecast is None:
+            forecast = Forecast(user_id=user_id)
+            db.session.add(forecast)
+        forecast.data_through = data_through[user_id]
+        forecast.generated_at = now
+        forecast.horizon_days = horizon_days
+        forecast.prediction = json.dumps(prediction)
+        forecast.anomalies = json.dumps(anomalies)
+    db.session.commit()
+
+
+def run_batch(chunk_size=500, processes=None, horizon_days=BATCH_FORECAST_HORIZON_DAYS):
+    """
+    Compute forecasts for all active users
+
+    Args:
+        chunk_size (int): Users loaded and written per database round trip
+        processes (int): Pool size, defaults to the number of cores
+        horizon_days (int): Days to forecast
+
+    Returns:
+        int: Number of users processed
+    """
+    processes = processes or os.cpu_count()
+    processed = 0
+
+    # Start the pool before any database connection exists so forked workers
+    # don't inherit open sockets
+    with multiprocessing.Pool(processes=processes, initializer=_init_worker) as pool:
+        with app.app_context():
+            for user_ids in iter_user_chunks(chunk_size):
+                tasks, data_through = load_chunk(user_ids, horizon_days)
+                if not tasks:
+                    continue
+                results = list(pool.imap_unordered(
+                    compute_user_insights, tasks,
+                    chunksize=max(1, len(tasks) // (processes * 4))
+                ))
+                save_results(results, data_through, horizon_days)
+                processed += len(results)
+                logger.info(f"Batch forecast: {processed} users processed")
+    return processed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute forecasts and anomaly scores for all users')
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--horizon-days', type=int, default=BATCH_FORECAST_HORIZON_DAYS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    count = run_batch(args.chunk_size, args.processes, args.horizon_days)
+    print(f"Computed forecasts for {count} users")
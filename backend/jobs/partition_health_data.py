@@ -0,0 +1,139 @@
+"""
+Range-partition health_data by month on MySQL
+
+MySQL requires the partitioning column in every unique key and does not
+allow foreign keys on partitioned InnoDB tables, so the conversion:
+
+  1. drops the health_data -> users foreign key (user deletion already
+     goes through the application),
+  2. widens the primary key to (id, date),
+  3. partitions by RANGE (TO_DAYS(date)) with one partition per month and a
+     catch-all pmax.
+
+Queries filtered on date (every insights window) then only touch the
+partitions they need, and whole archived months can be dropped instantly.
+Run with --extend monthly (e.g. from cron) to split next months out of pmax.
+
+SQLite has no table partitioning; there the (user_id, date) index is the
+fallback and this job only reports that.
+
+Run from the backend directory:
+    python -m jobs.partition_health_data [--months-ahead 3] [--dry-run]
+    python -m jobs.partition_health_data --extend [--months-ahead 3]
+"""
+import argparse
+import logging
+from datetime import date
+
+from sqlalchemy import text
+
+from app import app
+from models import db
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'health_data'
+
+
+def add_months(day, months):
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month_start):
+    return f'p{month_start.year:04d}{month_start.month:02d}'
+
+
+def partition_clause(month_start):
+    """Partition holding the month that starts at month_start"""
+    upper = add_months(month_start, 1)
+    return f"PARTITION {partition_name(month_start)} VALUES LESS THAN (TO_DAYS('{upper.isoformat()}'))"
+
+
+def month_range(first_month, last_month):
+    month = first_month
+    while month <= last_month:
+        yield month
+        month = add_months(month, 1)
+
+
+def existing_partitions(connection):
+    rows = connection.execute(text(
+        'SELECT PARTITION_NAME FROM information_schema.PARTITIONS '
+        'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL'
+    ), {'table': TABLE}).fetchall()
+    return [row[0] for row in rows]
+
+
+def conversion_ddl(connection, months_ahead):
+    """Statements that convert the unpartitioned table"""
+    statements = []
+
+    foreign_keys = connection.execute(text(
+        'SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS '
+        'WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = :table'
+    ), {'table': TABLE}).fetchall()
+    for (name,) in foreign_keys:
+        statements.append(f'ALTER TABLE {TABLE} DROP FOREIGN KEY `{name}`')
+
+    statements.append(f'ALTER TABLE {TABLE} DROP PRIMARY KEY, ADD PRIMARY KEY (id, date)')
+
+    oldest = connection.execute(text(f'SELECT MIN(date) FROM {TABLE}')).scalar()
+    today = date.today().replace(day=1)
+    first = oldest.date().replace(day=1) if oldest else today
+    clauses = [partition_clause(month) for month in month_range(first, add_months(today, months_ahead))]
+    clauses.append('PARTITION pmax VALUES LESS THAN MAXVALUE')
+    statements.append(
+        f'ALTER TABLE {TABLE} PARTITION BY RANGE (TO_DAYS(date)) (\n    ' + ',\n    '.join(clauses) + '\n)'
+    )
+    return statements
+
+
+def extension_ddl(connection, months_ahead):
+    """Statement that splits upcoming months out of pmax, or None if they exist"""
+    existing = set(existing_partitions(connection))
+    today = date.today().replace(day=1)
+    missing = [
+        month for month in month_range(today, add_months(today, months_ahead))
+        if partition_name(month) not in existing
+    ]
+    if not missing:
+        return None
+    clauses = [partition_clause(month) for month in missing] + ['PARTITION pmax VALUES LESS THAN MAXVALUE']
+    return f'ALTER TABLE {TABLE} REORGANIZE PARTITION pmax INTO (\n    ' + ',\n    '.join(clauses) + '\n)'
+
+
+def run(months_ahead=3, extend=False, dry_run=False):
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        if dialect != 'mysql':
+            print(f"{dialect} has no table partitioning; health_data stays a single table "
+                  f"served by ix_health_data_user_date")
+            return []
+
+        with db.engine.begin() as connection:
+            partitioned = bool(existing_partitions(connection))
+            if extend or partitioned:
+                if not partitioned:
+                    raise RuntimeError(f'{TABLE} is not partitioned yet; run without --extend first')
+                statement = extension_ddl(connection, months_ahead)
+                statements = [statement] if statement else []
+            else:
+                statements = conversion_ddl(connection, months_ahead)
+
+            for statement in statements:
+                print(statement + ';')
+                if not dry_run:
+                    connection.execute(text(statement))
+        return statements
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Partition health_data by month (MySQL)')
+    parser.add_argument('--months-ahead', type=int, default=3)
+    parser.add_argument('--extend', action='store_true', help='Only add upcoming monthly partitions')
+    parser.add_argument('--dry-run', action='store_true', help='Print the DDL without executing it')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run(args.months_ahead, args.extend, args.dry_run)
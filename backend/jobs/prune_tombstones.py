@@ -0,0 +1,32 @@
+"""
+Prune health data tombstones older than TOMBSTONE_RETENTION_DAYS
+
+GET /api/health/changes answers 410 for sync tokens older than the
+retention window, so clients that far behind resync from scratch and the
+older tombstones are no longer needed.
+
+Run from the backend directory:
+    python -m jobs.prune_tombstones
+"""
+import logging
+from datetime import datetime, timedelta
+
+from app import app
+from config import TOMBSTONE_RETENTION_DAYS
+from models import db
+from models.health_data_tombstone import HealthDataTombstone
+
+logger = logging.getLogger(__name__)
+
+
+def prune(retention_days=TOMBSTONE_RETENTION_DAYS):
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    with app.app_context():
+        pruned = HealthDataTombstone.query.filter(HealthDataTombstone.deleted_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+    return pruned
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    print(f"Pruned {prune()} tombstones")
@@ -0,0 +1,148 @@
+"""
+Rebuild the cohort percentile counts from health_data
+
+Finds every user's latest reading of each metric, then replaces
+cohort_members and cohort_sketches with one value per user in one
+transaction. Run it after bulk imports that skipped the ingest routes, and
+periodically (e.g. monthly) so users follow into their current age band and
+deletions of latest readings are applied.
+
+--verify rebuilds nothing; it checks every stored cohort against the exact
+quantiles of its cohort_members values and exits non-zero when a cohort's
+size differs or a quantile is off by more than half a bin.
+
+Run from the backend directory:
+    python -m jobs.rebuild_cohort_sketches [--chunk-size 5000] [--verify]
+"""
+import argparse
+import logging
+import math
+import sys
+from collections import defaultdict
+
+from sqlalchemy.orm import load_only
+
+from app import app
+from models import db
+from models.user import User
+from models.health_data import HealthData
+from models.cohort_sketch import CohortMember, CohortSketch
+from services.cohorts import (
+    BIN_WIDTHS, COHORT_METRICS, REPORTED_QUANTILES, cohort_of, load_cohort, new_counts, shard_of
+)
+
+logger = logging.getLogger(__name__)
+
+
+def rebuild(chunk_size=5000):
+    with app.app_context():
+        # Cohort and shard of every user, keyed by internal id
+        users = {
+            user.id: cohort_of(user) + (shard_of(user.id),)
+            for user in User.query.options(load_only(User.id, User.gender, User.date_of_birth))
+        }
+
+        # Latest (date, value) of every user and metric; one entry per user, not per reading
+        latest = {}
+        replayed, last_id = 0, 0
+        while True:
+            entries = HealthData.query.options(HealthData.load_only(COHORT_METRICS + ['user_id'])).filter(
+                HealthData.id > last_id
+            ).order_by(HealthData.id).limit(chunk_size).all()
+            if not entries:
+                break
+
+            for entry in entries:
+                for metric in COHORT_METRICS:
+                    value = getattr(entry, metric)
+                    if value is None:
+                        continue
+                    key = (entry.user_id, metric)
+                    if key not in latest or entry.date >= latest[key][0]:
+                        latest[key] = (entry.date, float(value))
+
+            replayed += len(entries)
+            last_id = entries[-1].id
+            db.session.expunge_all()
+            logger.info(f"Cohort sketches: {replayed} readings scanned through health_data id {last_id}")
+
+        CohortMember.query.delete()
+        CohortSketch.query.delete()
+
+        sketches = {}
+        for (user_id, metric), (day, value) in latest.items():
+            gender, band, shard = users[user_id]
+            db.session.add(CohortMember(
+                user_id=user_id, metric=metric, gender=gender, age_band=band, value=value, date=day
+            ))
+            key = (gender, band, metric, shard)
+            if key not in sketches:
+                sketches[key] = new_counts(metric)
+            sketches[key].add(value)
+
+        for (gender, band, metric, shard), sketch in sketches.items():
+            row = CohortSketch(gender=gender, age_band=band, metric=metric, shard=shard, count=sketch.n)
+            row.set_sketch(sketch.to_dict())
+            db.session.add(row)
+        db.session.commit()
+        return len(sketches)
+
+
+def exact_quantiles(values, fractions):
+    """Smallest value whose rank reaches each fraction, the definition BinnedCounts approximates"""
+    values = sorted(values)
+    return [values[max(0, math.ceil(fraction * len(values)) - 1)] for fraction in fractions]
+
+
+def verify():
+    """
+    Compare every stored cohort with the exact quantiles of its members
+
+    Returns:
+        list: (gender, age band, metric, problem) for each cohort that differs
+    """
+    with app.app_context():
+        members = defaultdict(list)
+        for gender, band, metric, value in db.session.query(
+            CohortMember.gender, CohortMember.age_band, CohortMember.metric, CohortMember.value
+        ):
+            members[(gender, band, metric)].append(value)
+
+        stored = {
+            (gender, band, metric)
+            for gender, band, metric in db.session.query(CohortSketch.gender, CohortSketch.age_band, CohortSketch.metric).distinct()
+        }
+
+        problems = []
+        for gender, band, metric in sorted(stored | set(members)):
+            values = members.get((gender, band, metric), [])
+            counts = load_cohort(db.session, gender, band, metric)
+            if counts.n != len(values):
+                problems.append((gender, band, metric, f'{counts.n} counted, {len(values)} members'))
+                continue
+            if not values:
+                continue
+            tolerance = BIN_WIDTHS[metric] / 2 + 1e-9
+            for fraction, estimate, exact in zip(
+                REPORTED_QUANTILES, counts.quantiles(REPORTED_QUANTILES), exact_quantiles(values, REPORTED_QUANTILES)
+            ):
+                if abs(estimate - exact) > tolerance:
+                    problems.append((gender, band, metric, f'p{int(fraction * 100)} {estimate} != {exact}'))
+        logger.info(f"Verified {len(stored | set(members))} cohorts")
+        return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild cohort percentile counts from health_data')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--verify', action='store_true', help='Compare stored cohorts with exact quantiles instead')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.verify:
+        problems = verify()
+        for gender, band, metric, problem in problems:
+            print(f"{gender}/{band}/{metric}: {problem}")
+        print('Cohorts match their members' if not problems else f"{len(problems)} cohort problems")
+        sys.exit(1 if problems else 0)
+    print(f"Rebuilt {rebuild(args.chunk_size)} cohort sketches")
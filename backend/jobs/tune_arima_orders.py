@@ -0,0 +1,39 @@
+"""
+Tune the ARIMA order of every user with enough new weight data
+
+Run from the backend directory, e.g. from a nightly cron job:
+    python -m jobs.tune_arima_orders [--force]
+"""
+import argparse
+import logging
+
+from app import app
+from models import db
+from models.user import User
+from services.arima_tuner import tune_user
+
+logger = logging.getLogger(__name__)
+
+
+def tune_all_users(force=False):
+    """Tune every user, skipping those without enough new observations"""
+    tuned = 0
+    with app.app_context():
+        user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+        for user_id in user_ids:
+            try:
+                if tune_user(user_id, force=force):
+                    tuned += 1
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"ARIMA order tuning failed for user {user_id}: {e}")
+    return tuned
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tune per-user ARIMA orders')
+    parser.add_argument('--force', action='store_true', help='Re-tune users even without new data')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print(f"Tuned {tune_all_users(force=args.force)} users")
@@ -0,0 +1,108 @@
+"""
+Bring an existing database up to the current models
+
+``db.create_all()`` (init_db.py) only creates missing tables; it never
+alters a table that already exists. Databases created before ingest-time
+anomaly scoring, derived trends or the composite indexes therefore lack
+columns such as health_data.is_anomaly, anomaly_score, anomaly_scores and
+trends and indexes such as ix_health_data_user_date,
+ix_health_data_user_anomaly, ix_health_data_user_updated and
+ix_users_created_at, and fail on the first query that touches them.
+
+This job is idempotent: it creates missing tables, then compares every
+existing table with its model and adds the missing columns and indexes.
+Existing columns are never changed or dropped. Afterwards run
+jobs.backfill_anomaly_scores and jobs.backfill_derived_metrics to fill in
+the new columns for old rows.
+
+Run from the backend directory:
+    python -m jobs.upgrade_schema [--dry-run]
+"""
+import argparse
+import logging
+
+from sqlalchemy import inspect, literal, text
+from sqlalchemy.schema import CreateIndex
+
+from app import app
+from models import db
+# Register every model's table, including ones only jobs use
+from models.user import User  # noqa: F401
+from models.health_data import HealthData  # noqa: F401
+from models.model_metadata import ModelMetadata  # noqa: F401
+from models.forecast import Forecast  # noqa: F401
+from models.anomaly_state import AnomalyState  # noqa: F401
+from models.recommendation import UserRecommendation  # noqa: F401
+from models.metric_series import Metric, MetricValue  # noqa: F401
+from models.health_data_archive import HealthDataArchive  # noqa: F401
+from models.cohort_sketch import CohortSketch  # noqa: F401
+from models.health_data_tombstone import HealthDataTombstone  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+
+def column_ddl(dialect, table, column):
+    """ALTER TABLE statement that adds one model column to an existing table"""
+    quote = dialect.identifier_preparer.quote
+    ddl = f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(dialect=dialect)}'
+
+    # Existing rows need a value for a NOT NULL column, e.g. is_anomaly -> false
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        rendered = literal(default, column.type).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+        ddl += f' DEFAULT {rendered}'
+    if not column.nullable and default is not None:
+        ddl += ' NOT NULL'
+    return ddl
+
+
+def upgrade_statements(connection):
+    """DDL for the columns and indexes the existing tables are missing"""
+    dialect = connection.dialect
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+
+    statements = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                statements.append(column_ddl(dialect, table, column))
+
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in indexes:
+                statements.append(str(CreateIndex(index).compile(dialect=dialect)))
+    return statements
+
+
+def run(dry_run=False):
+    with app.app_context():
+        with db.engine.begin() as connection:
+            existing_tables = set(inspect(connection).get_table_names())
+            missing_tables = [table for table in db.metadata.sorted_tables if table.name not in existing_tables]
+            for table in missing_tables:
+                print(f'-- create table {table.name}')
+            if not dry_run:
+                db.metadata.create_all(connection, tables=missing_tables)
+
+            statements = upgrade_statements(connection)
+            for statement in statements:
+                print(statement.strip() + ';')
+                if not dry_run:
+                    connection.execute(text(statement))
+
+        if not missing_tables and not statements:
+            print('Schema is up to date')
+        return [table.name for table in missing_tables], statements
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Add missing tables, columns and indexes to an existing database')
+    parser.add_argument('--dry-run', action='store_true', help='Print the DDL without executing it')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run(args.dry_run)
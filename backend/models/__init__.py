@@ -1,14 +1,17 @@
-from flask_sqlalchemy import SQLAlchemy
 from pymongo import MongoClient
 import os
 from dotenv import load_dotenv
+from .routing import RoutingSQLAlchemy
 
 # Load environment variables
 load_dotenv()
 
-# Initialize SQLAlchemy
-db = SQLAlchemy()
+# Initialize SQLAlchemy (reads in read_replica handlers may go to the replica)
+db = RoutingSQLAlchemy()
 
 # Initialize MongoDB connection
-mongo_client = MongoClient(os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'))
+mongo_client = MongoClient(
+    os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'),
+    serverSelectionTimeoutMS=int(os.environ.get('MONGO_TIMEOUT_MS', '2000'))
+)
 mongo_db = mongo_client[os.environ.get('MONGO_DATABASE', 'mi_health_tracker')] 
\ No newline at end of file
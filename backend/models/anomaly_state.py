@@ -0,0 +1,30 @@
+from . import db
+from datetime import datetime
+import json
+
+class AnomalyState(db.Model):
+    """Streaming anomaly detector state for one user and metric"""
+    __tablename__ = 'anomaly_states'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    metric = db.Column(db.String(50), primary_key=True)
+    
+    # Detector state as JSON: EWMA mean/variance/count and the rolling MAD window
+    state = db.Column(db.Text, nullable=False, default='{}')
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def get_state(self):
+        return json.loads(self.state) if self.state else {}
+    
+    def set_state(self, state):
+        self.state = json.dumps(state)
+    
+    def summary(self):
+        """Current baseline for the metric"""
+        ewma = self.get_state().get('ewma', {})
+        return {
+            'mean': ewma.get('mean'),
+            'std': ewma.get('var', 0.0) ** 0.5 if ewma else None,
+            'count': ewma.get('n', 0)
+        }
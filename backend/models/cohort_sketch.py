@@ -0,0 +1,48 @@
+from . import db
+from datetime import datetime
+import json
+
+class CohortSketch(db.Model):
+    """
+    Binned counts of one metric for one cohort (gender x age band)
+
+    Each cohort is split over a few shards (user_id % COHORT_SKETCH_SHARDS)
+    so concurrent ingests for the same cohort don't all lock one row; the
+    shards are merged when the cohort is queried.
+    
+    A cohort counts each user's latest reading once: when a newer reading
+    replaces it, the old value's bin is decremented and the new one's
+    incremented.
+    """
+    __tablename__ = 'cohort_sketches'
+    
+    gender = db.Column(db.String(10), primary_key=True)
+    age_band = db.Column(db.String(10), primary_key=True)
+    metric = db.Column(db.String(50), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    
+    # BinnedCounts as JSON (services/quantile_sketch.py)
+    sketch = db.Column(db.Text, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)  # users
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def get_sketch(self):
+        return json.loads(self.sketch)
+    
+    def set_sketch(self, sketch):
+        self.sketch = json.dumps(sketch)
+
+class CohortMember(db.Model):
+    """Latest reading of one user and metric, as counted in the cohort sketches"""
+    __tablename__ = 'cohort_members'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    metric = db.Column(db.String(50), primary_key=True)
+    
+    # Cohort the value was added to, so a replacement removes it from the same one
+    gender = db.Column(db.String(10), nullable=False)
+    age_band = db.Column(db.String(10), nullable=False)
+    
+    value = db.Column(db.Float, nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
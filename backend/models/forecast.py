@@ -0,0 +1,44 @@
+from . import db
+from datetime import datetime
+import json
+
+class Forecast(db.Model):
+    """Precomputed insights for a user, written by the nightly batch job"""
+    __tablename__ = 'forecasts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True)
+    
+    # Newest health_data.updated_at seen by the batch; newer rows make the forecast stale
+    data_through = db.Column(db.DateTime, nullable=False)
+    generated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    horizon_days = db.Column(db.Integer, nullable=False)
+    
+    # Result of HealthMLService.predict_weight as JSON
+    prediction = db.Column(db.Text)
+    
+    # {metric: result of HealthMLService.detect_anomalies} as JSON
+    anomalies = db.Column(db.Text)
+    
+    def get_prediction(self):
+        return json.loads(self.prediction) if self.prediction else None
+    
+    def get_anomalies(self):
+        return json.loads(self.anomalies) if self.anomalies else {}
+    
+    def upcoming_predictions(self, days, now=None):
+        """
+        Stored predictions that are still in the future, truncated to ``days``
+        
+        Returns:
+            list: Prediction points, or None if fewer than ``days`` remain
+        """
+        prediction = self.get_prediction()
+        if not prediction or not prediction.get('success'):
+            return None
+        
+        now = (now or datetime.now()).isoformat()
+        upcoming = [point for point in prediction['predictions'] if point['date'] > now]
+        if len(upcoming) < days:
+            return None
+        return upcoming[:days]
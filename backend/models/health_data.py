@@ -1,8 +1,17 @@
 from . import db
 from datetime import datetime
+import json
+from sqlalchemy.orm import load_only
 
 class HealthData(db.Model):
     __tablename__ = 'health_data'
+    __table_args__ = (
+        db.Index('ix_health_data_user_date', 'user_id', 'date'),
+        db.Index('ix_health_data_user_anomaly', 'user_id', 'is_anomaly', 'date'),
+        db.Index('ix_health_data_user_updated', 'user_id', 'updated_at', 'id'),
+        # One write-buffer row per user and day; date is included for partitioned MySQL tables
+        db.Index('ix_health_data_user_buffer_day', 'user_id', 'buffer_day', 'date', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -26,12 +35,86 @@ class HealthData(db.Model):
     sleep_hours = db.Column(db.Float)
     water_intake = db.Column(db.Float)  # in liters
     
+    # Ingest-time anomaly scoring (services/streaming_anomaly.py)
+    is_anomaly = db.Column(db.Boolean, nullable=False, default=False)
+    anomaly_score = db.Column(db.Float)  # highest score across metrics
+    anomaly_scores = db.Column(db.Text)  # JSON {metric: score} of flagged metrics
+    
+    # Write-time rolling statistics (services/derived_metrics.py)
+    trends = db.Column(db.Text)  # JSON {metric: {'mean_7d', 'slope_7d', 'mean_30d', 'slope_30d'}}
+    
+    # Write-behind buffer rows (services/write_buffer.py); NULL on every other row
+    buffer_day = db.Column(db.Date)
+    buffered_at = db.Column(db.Text)  # JSON {metric: epoch seconds the applied value was received}
+    
     # Meta information
     source = db.Column(db.String(50))  # 'xiaomi', 'manual', etc.
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    def to_dict(self):
+    # Health metric columns
+    METRICS = [
+        'weight', 'bmi', 'body_fat', 'muscle_mass', 'water', 
+        'visceral_fat', 'bone_mass', 'basal_metabolism', 'protein',
+        'calories_consumed', 'calories_burned', 'steps', 'sleep_hours', 'water_intake'
+    ]
+    
+    # Fields a client may select with ?fields=; id and date are always returned
+    SELECTABLE_FIELDS = METRICS + ['is_anomaly', 'anomaly_score', 'trends', 'source', 'created_at', 'updated_at']
+    
+    @classmethod
+    def parse_fields(cls, value):
+        """
+        Parse a comma-separated fields parameter
+        
+        Args:
+            value (str): e.g. 'weight,body_fat'; empty or None selects everything
+            
+        Returns:
+            list: Field names, or None for all fields
+            
+        Raises:
+            ValueError: If a field is unknown
+        """
+        if not value:
+            return None
+        fields = [field.strip() for field in value.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in cls.SELECTABLE_FIELDS]
+        if unknown:
+            raise ValueError(f'Invalid fields: {", ".join(unknown)}. Must be among: {", ".join(cls.SELECTABLE_FIELDS)}')
+        return list(dict.fromkeys(fields))
+    
+    def get_buffered_at(self):
+        return json.loads(self.buffered_at) if self.buffered_at else {}
+    
+    def set_buffered_at(self, buffered_at):
+        self.buffered_at = json.dumps(buffered_at) if buffered_at else None
+    
+    def get_trends(self):
+        return json.loads(self.trends) if self.trends else {}
+    
+    def set_trends(self, trends):
+        self.trends = json.dumps(trends) if trends else None
+    
+    @classmethod
+    def load_only(cls, fields):
+        """Loader option that selects only id, date and the given fields; other columns stay deferred"""
+        return load_only(*[getattr(cls, field) for field in ['id', 'date'] + list(fields)])
+    
+    def to_dict(self, fields=None):
+        if fields is not None:
+            data = {'id': self.id, 'date': self.date.isoformat()}
+            for field in fields:
+                value = getattr(self, field)
+                if field in ('created_at', 'updated_at'):
+                    value = value.isoformat() if value else None
+                elif field == 'is_anomaly':
+                    value = bool(value)
+                elif field == 'trends':
+                    value = json.loads(value) if value else {}
+                data[field] = value
+            return data
+        
         return {
             'id': self.id,
             'date': self.date.isoformat(),
@@ -49,6 +132,9 @@ class HealthData(db.Model):
             'steps': self.steps,
             'sleep_hours': self.sleep_hours,
             'water_intake': self.water_intake,
+            'is_anomaly': bool(self.is_anomaly),
+            'anomaly_score': self.anomaly_score,
+            'trends': self.get_trends(),
             'source': self.source,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
@@ -0,0 +1,28 @@
+from . import db
+from .health_data import HealthData
+
+# Same columns as health_data. The copied indexes are replaced because SQLite
+# index names are database-wide.
+_archive_table = HealthData.__table__.to_metadata(db.metadata, name='health_data_archive')
+for _index in list(_archive_table.indexes):
+    _archive_table.indexes.discard(_index)
+db.Index('ix_health_data_archive_user_date', _archive_table.c.user_id, _archive_table.c.date)
+
+# Cold rows are rarely read, so trade CPU for space on MySQL
+_archive_table.dialect_kwargs['mysql_row_format'] = 'COMPRESSED'
+_archive_table.dialect_kwargs['mysql_key_block_size'] = '8'
+
+class HealthDataArchive(db.Model):
+    """
+    Cold tier for health data older than ARCHIVE_AFTER_DAYS
+
+    Rows keep their health_data id. jobs/archive_health_data.py moves rows
+    here, and services/tiered_storage.py reads both tiers as one.
+    """
+    __table__ = _archive_table
+
+    METRICS = HealthData.METRICS
+    SELECTABLE_FIELDS = HealthData.SELECTABLE_FIELDS
+
+    load_only = classmethod(HealthData.load_only.__func__)
+    to_dict = HealthData.to_dict
@@ -0,0 +1,14 @@
+from . import db
+from datetime import datetime
+
+class HealthDataTombstone(db.Model):
+    """Record of a deleted health data entry, so delta sync can tell clients to drop it"""
+    __tablename__ = 'health_data_tombstones'
+    __table_args__ = (
+        db.Index('ix_health_data_tombstones_user_deleted', 'user_id', 'deleted_at', 'id'),
+    )
+    
+    # Id of the deleted health_data row
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
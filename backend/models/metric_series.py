@@ -0,0 +1,39 @@
+from . import db
+from datetime import datetime
+
+class Metric(db.Model):
+    """Registry of metrics stored in long format; adding a metric is a row, not a column"""
+    __tablename__ = 'metrics'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    unit = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'unit': self.unit
+        }
+
+class MetricValue(db.Model):
+    """
+    One metric reading in long format
+
+    The primary key leads with (user_id, metric_id, ts), so on InnoDB a
+    user's series for one metric is stored contiguously and read with a
+    single range scan. health_data_id links back to the wide row the value
+    was copied from.
+    """
+    __tablename__ = 'metric_values'
+    __table_args__ = (
+        db.Index('ix_metric_values_health_data', 'health_data_id'),
+    )
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True, autoincrement=False)
+    metric_id = db.Column(db.Integer, db.ForeignKey('metrics.id'), primary_key=True, autoincrement=False)
+    ts = db.Column(db.DateTime, primary_key=True)
+    # Part of the key so two readings at the same timestamp can coexist
+    health_data_id = db.Column(db.Integer, primary_key=True, autoincrement=False, default=0)
+    value = db.Column(db.Float, nullable=False)
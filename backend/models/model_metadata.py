@@ -0,0 +1,37 @@
+from . import db
+from datetime import datetime
+import json
+
+class ModelMetadata(db.Model):
+    __tablename__ = 'model_metadata'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'model_type', name='uq_model_metadata_user_type'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    model_type = db.Column(db.String(50), nullable=False)  # 'weight_arima', etc.
+    
+    # Model parameters as JSON, e.g. {"order": [2, 1, 1], "aic": 123.4}
+    params = db.Column(db.Text)
+    
+    # Number of observations the parameters were derived from
+    n_observations = db.Column(db.Integer, default=0)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def get_params(self):
+        return json.loads(self.params) if self.params else {}
+    
+    def set_params(self, params):
+        self.params = json.dumps(params)
+    
+    def to_dict(self):
+        return {
+            'model_type': self.model_type,
+            'params': self.get_params(),
+            'n_observations': self.n_observations,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
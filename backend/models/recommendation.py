@@ -0,0 +1,18 @@
+from . import db
+from datetime import datetime
+
+class UserRecommendation(db.Model):
+    """Recommendation rules that fired for a user, written by the bulk recompute job"""
+    __tablename__ = 'user_recommendations'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    
+    # Comma-separated ids from services.recommendations.RULES, e.g. "2,3,8"
+    rule_ids = db.Column(db.String(255), nullable=False, default='')
+    bmi = db.Column(db.Float)
+    weight_trend = db.Column(db.String(20))
+    
+    generated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def get_rule_ids(self):
+        return [int(rule_id) for rule_id in self.rule_ids.split(',') if rule_id]
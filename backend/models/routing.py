@@ -0,0 +1,185 @@
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm, text
+from sqlalchemy.engine import Engine
+
+from config import (
+    DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE, DB_POOL_SIZE, DB_POOL_TIMEOUT,
+    DB_STATEMENT_TIMEOUT_MS, REPLICA_LAG_CHECK_SECONDS, REPLICA_MAX_LAG_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'
+
+
+def engine_options(url):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for a database URL
+
+    SQLite's default pools take no sizing arguments, so only pre-ping is set there.
+    """
+    options = {'pool_pre_ping': DB_POOL_PRE_PING}
+    if not url.startswith('sqlite'):
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_timeout=DB_POOL_TIMEOUT
+        )
+    return options
+
+
+@event.listens_for(Engine, 'connect')
+def _set_statement_timeout(dbapi_connection, connection_record):
+    """Apply DB_STATEMENT_TIMEOUT_MS to every new MySQL or PostgreSQL connection"""
+    if not DB_STATEMENT_TIMEOUT_MS:
+        return
+    module = type(dbapi_connection).__module__
+    if module.startswith(('pymysql', 'MySQLdb', 'mysql')):
+        # Only limits SELECTs, which is what runaway reads are
+        statement = f'SET SESSION MAX_EXECUTION_TIME = {int(DB_STATEMENT_TIMEOUT_MS)}'
+    elif module.startswith(('psycopg2', 'psycopg')):
+        statement = f'SET statement_timeout = {int(DB_STATEMENT_TIMEOUT_MS)}'
+    else:
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(statement)
+    finally:
+        cursor.close()
+
+
+def measure_replica_lag(engine):
+    """
+    Replication lag of a replica in seconds
+
+    Returns:
+        float: Lag in seconds (0 when the server is not replicating), or
+            None when replication is broken
+    """
+    with engine.connect() as connection:
+        dialect = engine.dialect.name
+        if dialect == 'mysql':
+            try:
+                row = connection.execute(text('SHOW REPLICA STATUS')).mappings().first()
+            except Exception:
+                # Servers before 8.0.22 only know the old spelling
+                row = connection.execute(text('SHOW SLAVE STATUS')).mappings().first()
+            if row is None:
+                return 0.0
+            lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+            return None if lag is None else float(lag)
+        if dialect == 'postgresql':
+            lag = connection.execute(text(
+                'SELECT CASE WHEN pg_is_in_recovery() '
+                'THEN EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) ELSE 0 END'
+            )).scalar()
+            return None if lag is None else float(lag)
+    return 0.0
+
+
+class ReplicaMonitor:
+    """
+    Cached replica health
+
+    Lag is measured at most once every ``check_interval`` seconds per
+    process; a replica that lags past ``max_lag`` or cannot be reached is
+    skipped until the next check.
+    """
+
+    def __init__(self, max_lag=REPLICA_MAX_LAG_SECONDS, check_interval=REPLICA_LAG_CHECK_SECONDS):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def is_usable(self, engine):
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is None or now - self._checked_at >= self.check_interval:
+                try:
+                    self.lag = measure_replica_lag(engine)
+                except Exception as e:
+                    logger.warning(f"Replica lag check failed: {str(e)}")
+                    self.lag = None
+                self._checked_at = now
+                if self.lag is None or self.lag > self.max_lag:
+                    logger.warning(f"Replica unavailable or lagging ({self.lag}s), reading from primary")
+            return self.lag is not None and self.lag <= self.max_lag
+
+
+replica_monitor = ReplicaMonitor()
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that sends reads to the replica inside read_replica handlers
+
+    Everything else, and any statement issued while the session is flushing,
+    goes to the primary. Models with their own __bind_key__ keep their bind.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._use_replica() and not self._flushing:
+            if mapper is None or getattr(mapper.persist_selectable, 'info', {}).get('bind_key') is None:
+                return self.replica_engine()
+        return super().get_bind(mapper=mapper, clause=clause)
+
+    def replica_engine(self):
+        return self.app.extensions['sqlalchemy'].db.get_engine(self.app, bind=REPLICA_BIND)
+
+    def _use_replica(self):
+        if not has_app_context() or not g.get('use_replica'):
+            return False
+        if REPLICA_BIND not in (self.app.config.get('SQLALCHEMY_BINDS') or {}):
+            return False
+        return replica_monitor.is_usable(self.replica_engine())
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension whose sessions route reads with RoutingSession"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def read_replica(f):
+    """
+    Route the handler's reads to the replica when one is configured and
+    within REPLICA_MAX_LAG_SECONDS; writes still go to the primary
+    """
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        previous = g.get('use_replica', False)
+        g.use_replica = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.use_replica = previous
+    return decorated
+
+
+@contextmanager
+def on_primary():
+    """
+    Send every statement in the block to the primary, inside a read_replica handler
+
+    For reads that must see the latest writes and for Core statements
+    (e.g. upserts) that write without going through a flush.
+    """
+    previous = g.get('use_replica', False) if has_app_context() else False
+    if has_app_context():
+        g.use_replica = False
+    try:
+        yield
+    finally:
+        if has_app_context():
+            g.use_replica = previous
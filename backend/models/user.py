@@ -5,6 +5,10 @@ import uuid
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Created-range filters on the admin user listing
+        db.Index('ix_users_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     public_id = db.Column(db.String(50), unique=True, nullable=False, default=lambda: str(uuid.uuid4()))
@@ -1,15 +1,36 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db
+from models.routing import read_replica
 from models.user import User
 from models.health_data import HealthData
-from datetime import datetime, timedelta
+from models.forecast import Forecast
+from models.recommendation import UserRecommendation
+from services.metrics import query_budget, timed
+from services.streaming_anomaly import scorer
+from services import metric_store
+from services import tiered_storage
+from services import cohorts
+from services.derived_metrics import derive_bmi, refresh_trends
+from services.write_buffer import write_buffer
+from services.change_feed import SyncTokenExpired, changes_since
+from services.downsampling import METHODS as DOWNSAMPLING_METHODS, downsample_records
+from services.aggregation import AGGREGATES, BUCKETS as AGGREGATION_BUCKETS, aggregate_health_data as aggregate_health_data_in_db
+from config import CHANGES_MAX_PAGE_SIZE
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 
 health_data_bp = Blueprint('health_data', __name__)
 
+def parse_entry_date(value):
+    """Parse a date sent by a client (entry or filter); offsets become naive UTC like the stored dates"""
+    date = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return date.astimezone(timezone.utc).replace(tzinfo=None) if date.tzinfo else date
+
 @health_data_bp.route('/', methods=['GET'])
 @jwt_required()
+@read_replica
+@query_budget(6)
 def get_health_data():
     """Get user health data with optional filtering"""
     current_user_id = get_jwt_identity()
@@ -23,30 +44,128 @@ def get_health_data():
     end_date = request.args.get('end_date')
     metric = request.args.get('metric')
     limit = request.args.get('limit', default=30, type=int)
+    max_points = request.args.get('max_points', type=int)
+    downsample = request.args.get('downsample', default='lttb', type=str)
+    
+    if max_points is not None and max_points < 3:
+        return jsonify({'message': 'max_points must be at least 3'}), 400
+    
+    if downsample not in DOWNSAMPLING_METHODS:
+        return jsonify({'message': f'Invalid downsample method. Must be one of: {", ".join(DOWNSAMPLING_METHODS)}'}), 400
+    
+    # Column projection: ?fields=weight,body_fat returns only those plus id and date
+    try:
+        fields = HealthData.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    if metric and metric not in HealthData.METRICS:
+        return jsonify({'message': f'Invalid metric. Must be one of: {", ".join(HealthData.METRICS)}'}), 400
+    
+    # Parse date filters
+    try:
+        start_date = parse_entry_date(start_date) if start_date else None
+    except ValueError:
+        return jsonify({'message': 'Invalid start_date format. Use ISO format.'}), 400
+    
+    try:
+        end_date = parse_entry_date(end_date) if end_date else None
+    except ValueError:
+        return jsonify({'message': 'Invalid end_date format. Use ISO format.'}), 400
+    
+    # Single-metric views read the metric's contiguous range in the long-format store
+    if metric and metric_store.is_enabled() and fields in (None, [metric]):
+        with timed('serialize'):
+            result = metric_store.series_records(
+                db.session, user.id, metric, start=start_date, end=end_date, limit=limit, newest_first=True
+            )
+        
+        if max_points is not None:
+            # Flag the anomalies from the (user_id, is_anomaly, date) index so they survive downsampling
+            flagged = {row_id for (row_id,) in db.session.query(HealthData.id).filter_by(user_id=user.id, is_anomaly=True)}
+            for record in result:
+                record['is_anomaly'] = record['id'] in flagged
+            with timed('downsample'):
+                result = downsample_records(result, max_points, [metric], downsample)
+        
+        return jsonify(result), 200
     
     # Base query
     query = HealthData.query.filter_by(user_id=user.id)
     
+    # A single-metric view only needs rows with that metric, and by default only that column
+    if metric:
+        query = query.filter(getattr(HealthData, metric).isnot(None))
+        if fields is None:
+            fields = [metric]
+    
+    if fields is not None:
+        # Downsampling keeps anomaly points, so it needs the flag
+        if max_points is not None and 'is_anomaly' not in fields:
+            fields = fields + ['is_anomaly']
+        query = query.options(HealthData.load_only(fields))
+    
     # Apply filters
     if start_date:
-        try:
-            start_date = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-            query = query.filter(HealthData.date >= start_date)
-        except ValueError:
-            return jsonify({'message': 'Invalid start_date format. Use ISO format.'}), 400
+        query = query.filter(HealthData.date >= start_date)
     
     if end_date:
-        try:
-            end_date = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-            query = query.filter(HealthData.date <= end_date)
-        except ValueError:
-            return jsonify({'message': 'Invalid end_date format. Use ISO format.'}), 400
+        query = query.filter(HealthData.date <= end_date)
     
     # Order by date (newest first) and apply limit
     health_data = query.order_by(HealthData.date.desc()).limit(limit).all()
     
     # Convert to dictionaries
-    result = [data.to_dict() for data in health_data]
+    with timed('serialize'):
+        result = [data.to_dict(fields) for data in health_data]
+    
+    # Ranges reaching past the hot tier also read the archive
+    if len(result) < limit and tiered_storage.needs_cold(db.session, user.id, start_date):
+        with timed('archive'):
+            result += tiered_storage.read_cold(db.session, user.id, start_date, end_date, metric, fields, limit)
+        result = sorted(result, key=lambda data: data['date'], reverse=True)[:limit]
+    
+    # Downsample long ranges for charting, keeping anomalies exact
+    if max_points is not None:
+        charted = [field for field in fields if field in HealthData.METRICS] if fields else HealthData.METRICS
+        with timed('downsample'):
+            result = downsample_records(result, max_points, charted, downsample)
+    
+    return jsonify(result), 200
+
+@health_data_bp.route('/changes', methods=['GET'])
+@jwt_required()
+@query_budget(5)
+def get_health_data_changes():
+    """
+    Delta sync: entries changed or deleted since a sync token
+    
+    Query: since (token from the previous response; omit for a full sync),
+    limit, fields. Clients apply `deleted` before `changes` and repeat with
+    `next_token` while `has_more` is true. Always reads the primary, since a
+    lagging replica could skip rows behind the watermark.
+    """
+    current_user_id = get_jwt_identity()
+    user_id = db.session.query(User.id).filter_by(public_id=current_user_id).scalar()
+    
+    if not user_id:
+        return jsonify({'message': 'User not found'}), 404
+    
+    limit = request.args.get('limit', default=CHANGES_MAX_PAGE_SIZE, type=int)
+    if limit < 1 or limit > CHANGES_MAX_PAGE_SIZE:
+        return jsonify({'message': f'limit must be between 1 and {CHANGES_MAX_PAGE_SIZE}'}), 400
+    
+    try:
+        fields = HealthData.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    try:
+        result = changes_since(user_id, request.args.get('since'), limit, fields)
+    except SyncTokenExpired as e:
+        return jsonify({'message': str(e)}), 410
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
     
     return jsonify(result), 200
 
@@ -75,11 +194,24 @@ def add_health_data():
     if not any(metric in data for metric in health_metrics):
         return jsonify({'message': 'At least one health metric is required'}), 400
     
+    date = parse_entry_date(data['date']) if data.get('date') else datetime.utcnow()
+    
+    # Coalesce frequent step/water updates into one daily row instead of committing each
+    if write_buffer.accepts(data):
+        values = {metric: data[metric] for metric in health_metrics if metric in data}
+        write_buffer.add(user.id, date.date(), values, data.get('source', 'manual'))
+        return jsonify({
+            'message': 'Health data accepted',
+            'buffered': True,
+            'date': date.date().isoformat(),
+            'data': values
+        }), 202
+    
     # Create new health data entry
     new_entry = HealthData(
         user_id=user.id,
         source=data.get('source', 'manual'),
-        date=datetime.fromisoformat(data['date'].replace('Z', '+00:00')) if data.get('date') else datetime.utcnow()
+        date=date
     )
     
     # Add all provided metrics
@@ -87,8 +219,18 @@ def add_health_data():
         if metric in data:
             setattr(new_entry, metric, data[metric])
     
-    # Save to database
+    # Derive BMI from the user's height when the client didn't send one
+    derive_bmi(new_entry, user.height)
+    
+    # Score against the user's streaming anomaly state
+    scorer.score_entries(db.session, user.id, [new_entry])
+    
+    # Feed the cohort percentile sketches
+    cohorts.record_entries(db.session, user, [new_entry])
+    
+    # Save to database, with the rolling trends this reading changes
     db.session.add(new_entry)
+    refresh_trends(db.session, user.id, [new_entry.date])
     db.session.commit()
     
     return jsonify({
@@ -96,6 +238,64 @@ def add_health_data():
         'data': new_entry.to_dict()
     }), 201
 
+@health_data_bp.route('/batch', methods=['POST'])
+@jwt_required()
+def add_health_data_batch():
+    """Add multiple health data entries in one transaction"""
+    current_user_id = get_jwt_identity()
+    user = User.query.filter_by(public_id=current_user_id).first()
+    
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+    
+    data = request.get_json()
+    entries = data.get('entries') if isinstance(data, dict) else data
+    
+    if not entries or not isinstance(entries, list):
+        return jsonify({'message': 'No entries provided'}), 400
+    
+    if len(entries) > 1000:
+        return jsonify({'message': 'At most 1000 entries per batch'}), 400
+    
+    health_metrics = [
+        'weight', 'bmi', 'body_fat', 'muscle_mass', 'water', 
+        'visceral_fat', 'bone_mass', 'basal_metabolism', 'protein',
+        'calories_consumed', 'calories_burned', 'steps', 'sleep_hours', 'water_intake'
+    ]
+    
+    new_entries = []
+    for index, item in enumerate(entries):
+        if not isinstance(item, dict) or not any(metric in item for metric in health_metrics):
+            return jsonify({'message': f'Entry {index}: at least one health metric is required'}), 400
+        
+        try:
+            date = parse_entry_date(item['date']) if item.get('date') else datetime.utcnow()
+        except ValueError:
+            return jsonify({'message': f'Entry {index}: invalid date format. Use ISO format.'}), 400
+        
+        new_entry = HealthData(user_id=user.id, source=item.get('source', 'manual'), date=date)
+        for metric in health_metrics:
+            if metric in item:
+                setattr(new_entry, metric, item[metric])
+        derive_bmi(new_entry, user.height)
+        new_entries.append(new_entry)
+    
+    # Score oldest first so the streaming state sees readings in time order
+    new_entries.sort(key=lambda entry: entry.date)
+    scorer.score_entries(db.session, user.id, new_entries)
+    cohorts.record_entries(db.session, user, new_entries)
+    
+    # Save to database
+    db.session.add_all(new_entries)
+    refresh_trends(db.session, user.id, [entry.date for entry in new_entries])
+    db.session.commit()
+    
+    return jsonify({
+        'message': f'{len(new_entries)} health data entries added successfully',
+        'count': len(new_entries),
+        'ids': [entry.id for entry in new_entries]
+    }), 201
+
 @health_data_bp.route('/<int:data_id>', methods=['PUT'])
 @jwt_required()
 def update_health_data(data_id):
@@ -128,11 +328,23 @@ def update_health_data(data_id):
         if metric in data:
             setattr(entry, metric, data[metric])
     
+    # Ingest-time flags scored the previous values
+    scorer.discard_scores(entry, [metric for metric in health_metrics if metric in data])
+    
+    # A new weight makes the stored BMI stale unless the client sent one too
+    if 'weight' in data and 'bmi' not in data:
+        derive_bmi(entry, user.height, overwrite=True)
+    
     # Update date if provided
+    previous_date = entry.date
     if 'date' in data:
-        entry.date = datetime.fromisoformat(data['date'].replace('Z', '+00:00'))
+        entry.date = parse_entry_date(data['date'])
+    
+    # An edited latest reading replaces the user's value in the cohort sketches
+    cohorts.record_entries(db.session, user, [entry])
     
-    # Save changes
+    # Save changes, with the trends around both the old and new date
+    refresh_trends(db.session, user.id, [previous_date, entry.date])
     db.session.commit()
     
     return jsonify({
@@ -156,8 +368,11 @@ def delete_health_data(data_id):
     if not entry:
         return jsonify({'message': 'Health data entry not found'}), 404
     
-    # Delete entry
+    # Delete entry; deletions don't bump updated_at, so drop the precomputed results too
     db.session.delete(entry)
+    Forecast.query.filter_by(user_id=user.id).delete()
+    UserRecommendation.query.filter_by(user_id=user.id).delete()
+    refresh_trends(db.session, user.id, [entry.date])
     db.session.commit()
     
     return jsonify({
@@ -166,6 +381,8 @@ def delete_health_data(data_id):
 
 @health_data_bp.route('/summary', methods=['GET'])
 @jwt_required()
+@read_replica
+@query_budget(4)
 def get_health_summary():
     """Get summary statistics of user health data"""
     current_user_id = get_jwt_identity()
@@ -190,7 +407,8 @@ def get_health_summary():
         }), 200
     
     # Convert to DataFrame for easier analysis
-    df = pd.DataFrame([data.to_dict() for data in health_data])
+    with timed('serialize'):
+        df = pd.DataFrame([data.to_dict() for data in health_data])
     
     # Calculate summary statistics
     summary = {}
@@ -202,6 +420,9 @@ def get_health_summary():
         'calories_consumed', 'calories_burned', 'steps', 'sleep_hours', 'water_intake'
     ]
     
+    # Rolling means and slopes as of the latest reading, maintained at write time
+    latest_trends = health_data[-1].get_trends()
+    
     for metric in metrics:
         if metric in df.columns and not df[metric].empty and df[metric].notna().any():
             current = df[metric].iloc[-1] if len(df) > 0 else None
@@ -214,6 +435,7 @@ def get_health_summary():
                 'change': float(df[metric].iloc[-1] - df[metric].iloc[0]) if len(df) > 1 and metric in df.columns else None,
                 'change_percent': float((df[metric].iloc[-1] - df[metric].iloc[0]) / df[metric].iloc[0] * 100) if len(df) > 1 and df[metric].iloc[0] != 0 and metric in df.columns else None
             }
+            metric_summary['trends'] = latest_trends.get(metric)
             
             summary[metric] = metric_summary
     
@@ -227,4 +449,59 @@ def get_health_summary():
     return jsonify({
         'message': 'Health summary generated successfully',
         'summary': summary
-    }), 200 
\ No newline at end of file
+    }), 200 
+
+@health_data_bp.route('/aggregate', methods=['GET'])
+@jwt_required()
+@read_replica
+@query_budget(4)
+def aggregate_health_data():
+    """Get health metrics aggregated per day, week or month"""
+    current_user_id = get_jwt_identity()
+    user = User.query.filter_by(public_id=current_user_id).first()
+    
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+    
+    # Parse query parameters
+    bucket = request.args.get('bucket', default='day', type=str)
+    metrics = [m for m in request.args.get('metrics', default='weight', type=str).split(',') if m]
+    aggregates = [a for a in request.args.get('agg', default='avg', type=str).split(',') if a]
+    
+    health_metrics = [
+        'weight', 'bmi', 'body_fat', 'muscle_mass', 'water', 
+        'visceral_fat', 'bone_mass', 'basal_metabolism', 'protein',
+        'calories_consumed', 'calories_burned', 'steps', 'sleep_hours', 'water_intake'
+    ]
+    
+    if bucket not in AGGREGATION_BUCKETS:
+        return jsonify({'message': f'Invalid bucket. Must be one of: {", ".join(AGGREGATION_BUCKETS)}'}), 400
+    
+    invalid_metrics = [m for m in metrics if m not in health_metrics]
+    if not metrics or invalid_metrics:
+        return jsonify({'message': f'Invalid metrics. Must be among: {", ".join(health_metrics)}'}), 400
+    
+    invalid_aggregates = [a for a in aggregates if a not in AGGREGATES]
+    if not aggregates or invalid_aggregates:
+        return jsonify({'message': f'Invalid agg. Must be among: {", ".join(AGGREGATES)}'}), 400
+    
+    # Default to the last year
+    try:
+        end_date = parse_entry_date(request.args['end_date']) if request.args.get('end_date') else datetime.utcnow()
+        start_date = parse_entry_date(request.args['start_date']) if request.args.get('start_date') else end_date - timedelta(days=365)
+    except ValueError:
+        return jsonify({'message': 'Invalid date format. Use ISO format.'}), 400
+    
+    try:
+        data = aggregate_health_data_in_db(db.session, user.id, bucket, metrics, aggregates, start_date, end_date)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    return jsonify({
+        'bucket': bucket,
+        'metrics': metrics,
+        'agg': aggregates,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'data': data
+    }), 200
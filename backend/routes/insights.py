@@ -1,16 +1,135 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db
+from models.routing import on_primary, read_replica
 from models.user import User
 from models.health_data import HealthData
-from services.ml_service import HealthMLService
+from models.forecast import Forecast
+from models.anomaly_state import AnomalyState
+from models.recommendation import UserRecommendation
+from services.insight_jobs import job_queue, InsightJobFailed, QueueFullError
+from services import metric_store
+from services import tiered_storage
+from services import cohorts
+from services.anomaly_detectors import DETECTORS
+from services.forecasting import ENGINES
+from services.arima_tuner import load_fit_state, save_fit_state, tuner
+from services.metrics import query_budget, timed
+from services.downsampling import METHODS as DOWNSAMPLING_METHODS, downsample_records
+from services.recommendations import to_recommendations
+from config import FORECAST_ENGINE, INSIGHT_WAIT_TIMEOUT_SECONDS, COHORT_MIN_SIZE
 from datetime import datetime, timedelta
+import json
+from sqlalchemy import func
 
 insights_bp = Blueprint('insights', __name__)
-ml_service = HealthMLService()
+
+# Valid metrics for anomaly detection
+ANOMALY_METRICS = [
+    'weight', 'bmi', 'body_fat', 'muscle_mass', 'water', 
+    'visceral_fat', 'bone_mass', 'basal_metabolism', 'protein'
+]
+
+# Columns the dashboard's models read (anomalies, prediction, recommendations, chart downsampling)
+DASHBOARD_MODEL_FIELDS = ['weight', 'bmi', 'body_fat', 'muscle_mass', 'is_anomaly']
+
+# Job types clients may enqueue through POST /jobs
+JOB_TYPES = ['weight_prediction', 'anomaly_detection', 'recommendations']
+
+def _get_batch_forecast(user_id):
+    """Get the user's precomputed forecast, or None if their data changed since the batch ran"""
+    forecast = Forecast.query.filter_by(user_id=user_id).first()
+    if not forecast:
+        return None
+    
+    latest_update = db.session.query(func.max(HealthData.updated_at)).filter(
+        HealthData.user_id == user_id
+    ).scalar()
+    if latest_update is None or latest_update > forecast.data_through:
+        return None
+    
+    return forecast
+
+def _get_stored_recommendations(user):
+    """Get the user's recommendations from the recompute job, or None if their data or profile changed since"""
+    stored = UserRecommendation.query.get(user.id)
+    if not stored or (user.updated_at and user.updated_at > stored.generated_at):
+        return None
+    
+    latest_update = db.session.query(func.max(HealthData.updated_at)).filter(
+        HealthData.user_id == user.id
+    ).scalar()
+    if latest_update is None or latest_update > stored.generated_at:
+        return None
+    
+    return stored
+
+def _run_insight(kind, user_id, *args):
+    """
+    Run an insight computation on the insight pool and wait for it
+    
+    Args:
+        kind (str): Job type
+        user_id (int): Internal user id
+        *args: Task arguments
+        
+    Returns:
+        tuple: (result, None), or (None, response) if the queue is full, the
+            job failed, or it outlived INSIGHT_WAIT_TIMEOUT_SECONDS and must be polled
+    """
+    try:
+        with timed('insight_pool'):
+            job, result, timed_out = job_queue.run(kind, user_id, *args, timeout=INSIGHT_WAIT_TIMEOUT_SECONDS)
+    except QueueFullError as e:
+        return None, (jsonify({'message': str(e)}), 503)
+    except InsightJobFailed as e:
+        return None, (jsonify({'message': 'Insight computation failed', 'error': str(e)}), 500)
+    
+    if timed_out:
+        return None, (jsonify({
+            'message': 'Insight computation is still running',
+            'job_id': job.id,
+            'status_url': url_for('insights.get_insight_job', job_id=job.id)
+        }), 202)
+    
+    return result, None
+
+def _load_metric_history(user_id, metric):
+    """
+    A user's full history of one metric, newest first, as health data dictionaries
+    
+    Reads the long-format store when it is enabled (one primary-key range
+    scan, which still holds archived readings), otherwise the wide
+    health_data rows plus any archived ones.
+    """
+    if metric_store.is_enabled():
+        return metric_store.series_records(db.session, user_id, metric, newest_first=True)
+    
+    health_data = HealthData.query.filter_by(user_id=user_id).order_by(HealthData.date.desc()).all()
+    records = [data.to_dict() for data in health_data]
+    if tiered_storage.needs_cold(db.session, user_id):
+        records = sorted(records + tiered_storage.read_cold(db.session, user_id), key=lambda data: data['date'], reverse=True)
+    return records
+
+def _arima_order(user_id):
+    """Use the user's tuned ARIMA order; tuning itself runs on the insight pool"""
+    return tuner.order_for_user(current_app._get_current_object(), user_id)
+
+def _store_arima_state(user_id, prediction):
+    """
+    Keep the ARIMA fit a full-history prediction returned, so the next one
+    filters new weigh-ins instead of refitting
+    """
+    state = prediction.pop('arima_state', None) if prediction else None
+    if state:
+        with on_primary():
+            save_fit_state(user_id, state)
+            db.session.commit()
 
 @insights_bp.route('/weight-prediction', methods=['GET'])
 @jwt_required()
+@read_replica
+@query_budget(10)
 def predict_weight():
     """Predict future weight based on historical data"""
     current_user_id = get_jwt_identity()
@@ -24,17 +143,49 @@ def predict_weight():
     if days < 1 or days > 365:
         return jsonify({'message': 'Days parameter must be between 1 and 365'}), 400
     
+    # Get forecasting engine parameter (default from config)
+    engine = request.args.get('engine', default=FORECAST_ENGINE, type=str)
+    valid_engines = ['auto'] + list(ENGINES)
+    if engine not in valid_engines:
+        return jsonify({
+            'message': f'Invalid engine. Must be one of: {", ".join(valid_engines)}'
+        }), 400
+    
+    # Serve the nightly batch result if the user's data hasn't changed since
+    forecast = _get_batch_forecast(user.id) if engine == FORECAST_ENGINE else None
+    upcoming = forecast.upcoming_predictions(days) if forecast else None
+    if upcoming:
+        prediction = forecast.get_prediction()
+        prediction.update({
+            'predictions': upcoming,
+            'prediction_end_weight': upcoming[-1]['weight'],
+            'weight_change': upcoming[-1]['weight'] - prediction['current_weight'],
+            'generated_at': forecast.generated_at.isoformat()
+        })
+        return jsonify({
+            'message': 'Weight prediction generated successfully',
+            'prediction': prediction
+        }), 200
+    
     # Get user's historical weight data
-    health_data = HealthData.query.filter_by(user_id=user.id).order_by(HealthData.date.desc()).all()
+    with timed('serialize'):
+        health_data_list = _load_metric_history(user.id, 'weight')
     
-    if not health_data:
+    if not health_data_list:
         return jsonify({'message': 'No health data available for prediction'}), 404
     
-    # Convert to list of dictionaries
-    health_data_list = [data.to_dict() for data in health_data]
+    # The last fit of the full history, read where it was written
+    with on_primary():
+        fit_state = load_fit_state(user.id)
     
     # Make prediction
-    prediction_result = ml_service.predict_weight(health_data_list, days)
+    prediction_result, response = _run_insight(
+        'weight_prediction', user.id, health_data_list, days, engine,
+        _arima_order(user.id), fit_state, user.id
+    )
+    if response:
+        return response
+    _store_arima_state(user.id, prediction_result)
     
     if not prediction_result.get('success'):
         return jsonify({
@@ -49,6 +200,8 @@ def predict_weight():
 
 @insights_bp.route('/anomaly-detection', methods=['GET'])
 @jwt_required()
+@read_replica
+@query_budget(6)
 def detect_anomalies():
     """Detect anomalies in health metrics"""
     current_user_id = get_jwt_identity()
@@ -60,28 +213,66 @@ def detect_anomalies():
     # Get metric parameter (default weight)
     metric = request.args.get('metric', default='weight', type=str)
     
-    # Valid metrics for anomaly detection
-    valid_metrics = [
-        'weight', 'bmi', 'body_fat', 'muscle_mass', 'water', 
-        'visceral_fat', 'bone_mass', 'basal_metabolism', 'protein'
-    ]
+    if metric not in ANOMALY_METRICS:
+        return jsonify({
+            'message': f'Invalid metric. Must be one of: {", ".join(ANOMALY_METRICS)}'
+        }), 400
     
-    if metric not in valid_metrics:
+    # Get detector parameter; naming one always runs it on the full history
+    detector = request.args.get('detector', type=str)
+    if detector is not None and detector not in DETECTORS:
         return jsonify({
-            'message': f'Invalid metric. Must be one of: {", ".join(valid_metrics)}'
+            'message': f'Invalid detector. Must be one of: {", ".join(DETECTORS)}'
         }), 400
     
+    # Read the flags stored at ingest time once the metric has streaming state
+    state = AnomalyState.query.get((user.id, metric)) if detector is None else None
+    if state:
+        flagged = HealthData.query.filter_by(user_id=user.id, is_anomaly=True).order_by(HealthData.date).all()
+        anomaly_points = []
+        for row in flagged:
+            scores = json.loads(row.anomaly_scores) if row.anomaly_scores else {}
+            # The reading may have been cleared since it was flagged
+            if metric in scores and getattr(row, metric) is not None:
+                anomaly_points.append({
+                    'date': row.date.isoformat(),
+                    metric: float(getattr(row, metric)),
+                    'deviation': scores[metric]
+                })
+        
+        summary = state.summary()
+        return jsonify({
+            'message': 'Anomaly detection completed successfully',
+            'result': {
+                'success': True,
+                'anomalies': anomaly_points,
+                'anomaly_count': len(anomaly_points),
+                'total_records': summary['count'],
+                'metric_mean': summary['mean'],
+                'metric_std': summary['std']
+            }
+        }), 200
+    
+    # Serve the nightly batch result if the user's data hasn't changed since
+    forecast = _get_batch_forecast(user.id) if detector is None else None
+    stored_result = forecast.get_anomalies().get(metric) if forecast else None
+    if stored_result and stored_result.get('success'):
+        return jsonify({
+            'message': 'Anomaly detection completed successfully',
+            'result': dict(stored_result, generated_at=forecast.generated_at.isoformat())
+        }), 200
+    
     # Get user's historical health data
-    health_data = HealthData.query.filter_by(user_id=user.id).order_by(HealthData.date.desc()).all()
+    with timed('serialize'):
+        health_data_list = _load_metric_history(user.id, metric)
     
-    if not health_data:
+    if not health_data_list:
         return jsonify({'message': 'No health data available for anomaly detection'}), 404
     
-    # Convert to list of dictionaries
-    health_data_list = [data.to_dict() for data in health_data]
-    
     # Detect anomalies
-    anomaly_result = ml_service.detect_anomalies(health_data_list, metric)
+    anomaly_result, response = _run_insight('anomaly_detection', user.id, health_data_list, metric, detector, user.id)
+    if response:
+        return response
     
     if not anomaly_result.get('success'):
         return jsonify({
@@ -96,6 +287,8 @@ def detect_anomalies():
 
 @insights_bp.route('/recommendations', methods=['GET'])
 @jwt_required()
+@read_replica
+@query_budget(4)
 def get_recommendations():
     """Get personalized health recommendations"""
     current_user_id = get_jwt_identity()
@@ -104,6 +297,20 @@ def get_recommendations():
     if not user:
         return jsonify({'message': 'User not found'}), 404
     
+    # Serve the recompute job's result if nothing changed since it ran
+    stored = _get_stored_recommendations(user)
+    if stored:
+        return jsonify({
+            'message': 'Health recommendations generated successfully',
+            'recommendations': {
+                'success': True,
+                'recommendations': to_recommendations(stored.get_rule_ids()),
+                'bmi': stored.bmi,
+                'weight_trend': stored.weight_trend,
+                'generated_at': stored.generated_at.isoformat()
+            }
+        }), 200
+    
     # Get user's profile data
     user_data = user.to_dict()
     
@@ -114,10 +321,13 @@ def get_recommendations():
         return jsonify({'message': 'No health data available for recommendations'}), 404
     
     # Convert to list of dictionaries
-    health_data_list = [data.to_dict() for data in health_data]
+    with timed('serialize'):
+        health_data_list = [data.to_dict() for data in health_data]
     
     # Generate recommendations
-    recommendations = ml_service.get_health_recommendations(user_data, health_data_list)
+    recommendations, response = _run_insight('recommendations', user.id, user_data, health_data_list)
+    if response:
+        return response
     
     if not recommendations.get('success'):
         return jsonify({
@@ -132,6 +342,8 @@ def get_recommendations():
 
 @insights_bp.route('/dashboard-data', methods=['GET'])
 @jwt_required()
+@read_replica
+@query_budget(10)
 def get_dashboard_data():
     """Get aggregated data for the user dashboard"""
     current_user_id = get_jwt_identity()
@@ -145,21 +357,44 @@ def get_dashboard_data():
     if days < 1 or days > 365:
         return jsonify({'message': 'Days parameter must be between 1 and 365'}), 400
     
+    # Optional chart downsampling parameters
+    max_points = request.args.get('max_points', type=int)
+    downsample = request.args.get('downsample', default='lttb', type=str)
+    if max_points is not None and max_points < 3:
+        return jsonify({'message': 'max_points must be at least 3'}), 400
+    if downsample not in DOWNSAMPLING_METHODS:
+        return jsonify({'message': f'Invalid downsample method. Must be one of: {", ".join(DOWNSAMPLING_METHODS)}'}), 400
+    
+    # Optional column projection for the returned series
+    try:
+        fields = HealthData.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
     # Calculate date range
     end_date = datetime.now()
     start_date = end_date - timedelta(days=days)
     
     # Get user's health data in range
-    health_data = HealthData.query.filter_by(user_id=user.id).filter(
+    query = HealthData.query.filter_by(user_id=user.id).filter(
         HealthData.date >= start_date,
         HealthData.date <= end_date
-    ).order_by(HealthData.date).all()
+    )
+    
+    # With a projection, load only the requested columns plus what the models use
+    loaded_fields = None
+    if fields is not None:
+        loaded_fields = list(dict.fromkeys(DASHBOARD_MODEL_FIELDS + fields))
+        query = query.options(HealthData.load_only(loaded_fields))
+    
+    health_data = query.order_by(HealthData.date).all()
     
     if not health_data:
         return jsonify({'message': 'No health data available in the specified range'}), 404
     
     # Convert to list of dictionaries
-    health_data_list = [data.to_dict() for data in health_data]
+    with timed('serialize'):
+        health_data_list = [data.to_dict(loaded_fields) for data in health_data]
     
     # Get profile data
     user_data = user.to_dict()
@@ -172,18 +407,58 @@ def get_dashboard_data():
     if len(health_data_list) > 1 and 'weight' in health_data_list[0] and 'weight' in health_data_list[-1]:
         weight_change = health_data_list[0]['weight'] - health_data_list[-1]['weight']
     
+    # Use the nightly batch results if the user's data hasn't changed since
+    forecast = _get_batch_forecast(user.id)
+    stored_anomalies = forecast.get_anomalies() if forecast else {}
+    upcoming = forecast.upcoming_predictions(7) if forecast else None
+    
+    # Fit whatever the batch didn't cover (anomalies, 7-day weight prediction, recommendations) as one job.
+    # The stored ARIMA fit state belongs to the full history, so this windowed series fits from scratch
+    dashboard_metrics = ['weight', 'body_fat', 'muscle_mass']
+    prediction_args = None if upcoming else (
+        7, FORECAST_ENGINE, _arima_order(user.id), None
+    )
+    computed, response = _run_insight(
+        'dashboard', user.id, user_data, health_data_list,
+        [metric for metric in dashboard_metrics if metric not in stored_anomalies], prediction_args
+    )
+    if response:
+        return response
+    if computed['prediction']:
+        computed['prediction'].pop('arima_state', None)
+    
     # Get anomalies for main metrics
     anomalies = {}
-    for metric in ['weight', 'body_fat', 'muscle_mass']:
-        anomaly_result = ml_service.detect_anomalies(health_data_list, metric)
+    for metric in dashboard_metrics:
+        if metric in stored_anomalies:
+            anomaly_result = stored_anomalies[metric]
+            if anomaly_result.get('success'):
+                start = start_date.isoformat()
+                anomalies[metric] = [point for point in anomaly_result.get('anomalies', []) if point['date'] >= start]
+            continue
+        anomaly_result = computed['anomalies'][metric]
         if anomaly_result.get('success'):
             anomalies[metric] = anomaly_result.get('anomalies', [])
     
     # Get weight prediction (next 7 days)
-    prediction = ml_service.predict_weight(health_data_list, 7)
+    prediction = {'success': True, 'predictions': upcoming} if upcoming else computed['prediction']
     
     # Get recommendations
-    recommendations = ml_service.get_health_recommendations(user_data, health_data_list)
+    recommendations = computed['recommendations']
+    
+    # Downsample the chart series, keeping every anomaly point exact
+    chart_data = health_data_list
+    if max_points is not None:
+        anomaly_dates = {point['date'] for points in anomalies.values() for point in points}
+        keep = {i for i, data in enumerate(health_data_list) if data['date'] in anomaly_dates}
+        with timed('downsample'):
+            chart_data = downsample_records(health_data_list, max_points, ['weight', 'body_fat', 'muscle_mass'], downsample, keep)
+    
+    # Return only the requested fields of the series
+    if fields is not None:
+        returned_keys = ['id', 'date'] + fields
+        chart_data = [{key: data[key] for key in returned_keys} for data in chart_data]
+        latest_metrics = {key: latest_metrics[key] for key in returned_keys} if latest_metrics else {}
     
     # Compile dashboard data
     dashboard_data = {
@@ -191,7 +466,8 @@ def get_dashboard_data():
         'latest_metrics': latest_metrics,
         'weight_change': weight_change,
         'data_points': len(health_data_list),
-        'health_data': health_data_list,
+        'returned_points': len(chart_data),
+        'health_data': chart_data,
         'anomalies': anomalies,
         'prediction': prediction.get('predictions', []) if prediction.get('success') else [],
         'recommendations': recommendations.get('recommendations', []) if recommendations.get('success') else []
@@ -200,4 +476,142 @@ def get_dashboard_data():
     return jsonify({
         'message': 'Dashboard data retrieved successfully',
         'dashboard': dashboard_data
-    }), 200 
\ No newline at end of file
+    }), 200 
+
+@insights_bp.route('/cohort-percentile', methods=['GET'])
+@jwt_required()
+@read_replica
+@query_budget(5)
+def get_cohort_percentile():
+    """
+    Where a value sits among users of the same gender and age band
+    
+    Query: metric (default weight), value (defaults to the user's latest reading)
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.filter_by(public_id=current_user_id).first()
+    
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+    
+    metric = request.args.get('metric', default='weight', type=str)
+    
+    if metric not in cohorts.COHORT_METRICS:
+        return jsonify({
+            'message': f'Invalid metric. Must be one of: {", ".join(cohorts.COHORT_METRICS)}'
+        }), 400
+    
+    value = request.args.get('value', type=float)
+    if value is None:
+        # Get user's latest reading of the metric
+        value = db.session.query(getattr(HealthData, metric)).filter(
+            HealthData.user_id == user.id,
+            getattr(HealthData, metric).isnot(None)
+        ).order_by(HealthData.date.desc()).limit(1).scalar()
+        if value is None:
+            return jsonify({'message': f'No {metric} data available; pass a value'}), 404
+        value = float(value)
+    
+    gender, band = cohorts.cohort_of(user)
+    sketch = cohorts.load_cohort(db.session, gender, band, metric)
+    
+    # Cohorts count each user once, so the size is a user count
+    if sketch.n < COHORT_MIN_SIZE:
+        return jsonify({'message': 'Not enough users in this cohort yet'}), 404
+    
+    return jsonify(dict(
+        cohorts.percentile_summary(sketch, value),
+        metric=metric,
+        value=value,
+        cohort={'gender': gender, 'age_band': band}
+    )), 200
+
+@insights_bp.route('/jobs', methods=['POST'])
+@jwt_required()
+def create_insight_job():
+    """
+    Enqueue an insight computation on the insight pool
+    
+    Body: {"type": "weight_prediction" | "anomaly_detection" | "recommendations",
+           "params": {"days": 30, "engine": "auto", "metric": "weight", "detector": "mad"}}
+    """
+    current_user_id = get_jwt_identity()
+    user = User.query.filter_by(public_id=current_user_id).first()
+    
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+    
+    data = request.get_json() or {}
+    kind = data.get('type')
+    params = data.get('params') or {}
+    
+    if kind not in JOB_TYPES:
+        return jsonify({'message': f'Invalid job type. Must be one of: {", ".join(JOB_TYPES)}'}), 400
+    
+    # Validate parameters before loading any data
+    if kind == 'weight_prediction':
+        days = params.get('days', 30)
+        engine = params.get('engine', FORECAST_ENGINE)
+        if not isinstance(days, int) or days < 1 or days > 365:
+            return jsonify({'message': 'Days parameter must be between 1 and 365'}), 400
+        valid_engines = ['auto'] + list(ENGINES)
+        if engine not in valid_engines:
+            return jsonify({'message': f'Invalid engine. Must be one of: {", ".join(valid_engines)}'}), 400
+    elif kind == 'anomaly_detection':
+        metric = params.get('metric', 'weight')
+        if metric not in ANOMALY_METRICS:
+            return jsonify({'message': f'Invalid metric. Must be one of: {", ".join(ANOMALY_METRICS)}'}), 400
+        detector = params.get('detector')
+        if detector is not None and detector not in DETECTORS:
+            return jsonify({'message': f'Invalid detector. Must be one of: {", ".join(DETECTORS)}'}), 400
+    
+    # Get user's health data (recommendations only look at the latest 30 records)
+    query = HealthData.query.filter_by(user_id=user.id).order_by(HealthData.date.desc())
+    if kind == 'recommendations':
+        query = query.limit(30)
+    health_data = query.all()
+    
+    if not health_data:
+        return jsonify({'message': 'No health data available'}), 404
+    
+    with timed('serialize'):
+        health_data_list = [data.to_dict() for data in health_data]
+    
+    if kind == 'weight_prediction':
+        args = (health_data_list, days, engine, _arima_order(user.id), load_fit_state(user.id), user.id)
+    elif kind == 'anomaly_detection':
+        args = (health_data_list, metric, detector, user.id)
+    else:
+        args = (user.to_dict(), health_data_list)
+    
+    try:
+        job = job_queue.submit(kind, user.id, *args)
+    except QueueFullError as e:
+        return jsonify({'message': str(e)}), 503
+    
+    return jsonify({
+        'message': 'Insight job queued',
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('insights.get_insight_job', job_id=job.id)
+    }), 202
+
+@insights_bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_insight_job(job_id):
+    """Get the status, and once finished the result, of an insight job"""
+    current_user_id = get_jwt_identity()
+    user_id = db.session.query(User.id).filter_by(public_id=current_user_id).scalar()
+    
+    job = job_queue.get(job_id)
+    
+    # Other users' jobs look the same as unknown ones
+    if not job or job.user_id != user_id:
+        return jsonify({'message': 'Job not found'}), 404
+    
+    data = job.to_dict()
+    if data['status'] == 'succeeded' and job.kind == 'weight_prediction':
+        # Polling never writes; only GET /weight-prediction keeps the fit state
+        data['result'].pop('arima_state', None)
+    
+    return jsonify(data), 200
@@ -1,13 +1,18 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db
 from models.user import User
-from datetime import datetime
+from services import user_directory
+from services.metrics import query_budget, timed
+from config import ADMIN_EMAIL, USER_LIST_MAX_PAGE_SIZE
+from datetime import datetime, timedelta
+import json
 
 user_bp = Blueprint('user', __name__)
 
 @user_bp.route('/profile', methods=['GET'])
 @jwt_required()
+@query_budget(3)
 def get_user_profile():
     """Get current user's profile"""
     current_user_id = get_jwt_identity()
@@ -60,15 +65,56 @@ def update_user_profile():
         'user': user.to_dict()
     }), 200
 
+def _is_admin(public_id):
+    """Admin check that reads only the caller's email column"""
+    # Simple admin check - in a real app, you'd have proper role management
+    email = db.session.query(User.email).filter_by(public_id=public_id).scalar()
+    return email is not None and email == ADMIN_EMAIL
+
+def _parse_bool(value):
+    if value is None:
+        return None
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f'Invalid boolean: {value}')
+
+def _parse_user_filters(args):
+    """
+    Parse listing filters from query parameters
+
+    Args:
+        args: request.args with optional active, has_xiaomi,
+            created_from and created_to (YYYY-MM-DD)
+
+    Returns:
+        dict: Filters for services.user_directory
+
+    Raises:
+        ValueError: If a parameter is malformed
+    """
+    filters = {
+        'is_active': _parse_bool(args.get('active')),
+        'has_xiaomi': _parse_bool(args.get('has_xiaomi')),
+        'created_from': None,
+        'created_to': None
+    }
+    try:
+        if args.get('created_from'):
+            filters['created_from'] = datetime.strptime(args['created_from'], '%Y-%m-%d')
+        if args.get('created_to'):
+            # Inclusive end date
+            filters['created_to'] = datetime.strptime(args['created_to'], '%Y-%m-%d') + timedelta(days=1)
+    except ValueError:
+        raise ValueError('Invalid date format. Use YYYY-MM-DD')
+    return filters
+
 @user_bp.route('/<user_id>', methods=['GET'])
 @jwt_required()
 def get_user_by_id(user_id):
     """Get a user by ID (admin only)"""
-    current_user_id = get_jwt_identity()
-    current_user = User.query.filter_by(public_id=current_user_id).first()
-    
-    # Simple admin check - in a real app, you'd have proper role management
-    if not current_user or current_user.email != 'admin@example.com':
+    if not _is_admin(get_jwt_identity()):
         return jsonify({'message': 'Unauthorized access'}), 403
     
     user = User.query.filter_by(public_id=user_id).first()
@@ -81,17 +127,61 @@ def get_user_by_id(user_id):
 @user_bp.route('/all', methods=['GET'])
 @jwt_required()
 def get_all_users():
-    """Get all users (admin only)"""
-    current_user_id = get_jwt_identity()
-    current_user = User.query.filter_by(public_id=current_user_id).first()
-    
-    # Simple admin check - in a real app, you'd have proper role management
-    if not current_user or current_user.email != 'admin@example.com':
+    """
+    List users one keyset page at a time (admin only)
+
+    Query parameters: limit (default 100), cursor (next_cursor of the
+    previous page), active, has_xiaomi, created_from, created_to and
+    count ('exact', 'estimate' or 'none').
+    """
+    if not _is_admin(get_jwt_identity()):
         return jsonify({'message': 'Unauthorized access'}), 403
     
-    users = User.query.all()
+    try:
+        filters = _parse_user_filters(request.args)
+        limit = int(request.args.get('limit', 100))
+        after_id = user_directory.decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    if limit < 1 or limit > USER_LIST_MAX_PAGE_SIZE:
+        return jsonify({'message': f'limit must be between 1 and {USER_LIST_MAX_PAGE_SIZE}'}), 400
+    
+    count_mode = request.args.get('count', 'exact')
+    if count_mode not in user_directory.COUNT_MODES:
+        return jsonify({'message': f'Invalid count mode. Must be one of: {", ".join(user_directory.COUNT_MODES)}'}), 400
+    
+    users, next_cursor = user_directory.get_page(filters, limit, after_id)
+    
+    with timed('serialize'):
+        users = [user.to_dict() for user in users]
     
     return jsonify({
-        'count': len(users),
-        'users': [user.to_dict() for user in users]
-    }), 200 
\ No newline at end of file
+        'count': user_directory.count_users(db.session, filters, count_mode),
+        'count_mode': count_mode,
+        'users': users,
+        'next_cursor': next_cursor
+    }), 200
+
+@user_bp.route('/all/stream', methods=['GET'])
+@jwt_required()
+def stream_all_users():
+    """
+    Stream every matching user as newline-delimited JSON (admin only)
+
+    Accepts the same filters as /all. Users are read in keyset batches, so
+    memory use does not grow with the number of accounts.
+    """
+    if not _is_admin(get_jwt_identity()):
+        return jsonify({'message': 'Unauthorized access'}), 403
+    
+    try:
+        filters = _parse_user_filters(request.args)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    def generate():
+        for user in user_directory.iter_users(filters):
+            yield json.dumps(user.to_dict()) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson'), 200
@@ -4,9 +4,16 @@ from models import db
 from models.user import User
 from models.health_data import HealthData
 from services.xiaomi_service import XiaomiScaleService
+from services.streaming_anomaly import scorer
+from services.raw_archive import get_archive
+from services import cohorts
+from services.derived_metrics import derive_bmi, refresh_trends
+from datetime import datetime
+import logging
 import os
 
 xiaomi_bp = Blueprint('xiaomi', __name__)
+logger = logging.getLogger(__name__)
 
 @xiaomi_bp.route('/connect', methods=['POST'])
 @jwt_required()
@@ -79,6 +86,7 @@ def sync_data():
     new_entry = HealthData(
         user_id=user.id,
         source='xiaomi',
+        date=datetime.utcnow(),
         weight=scale_data.get('weight'),
         bmi=scale_data.get('bmi'),
         body_fat=scale_data.get('body_fat'),
@@ -90,10 +98,28 @@ def sync_data():
         protein=scale_data.get('protein')
     )
     
-    # Save to database
+    # Derive BMI from the user's height when the scale didn't report one
+    derive_bmi(new_entry, user.height)
+    
+    # Score against the user's streaming anomaly state
+    scorer.score_entries(db.session, user.id, [new_entry])
+    
+    # Feed the cohort percentile sketches
+    cohorts.record_entries(db.session, user, [new_entry])
+    
+    # Save to database, with the rolling trends this reading changes
     db.session.add(new_entry)
+    refresh_trends(db.session, user.id, [new_entry.date])
     db.session.commit()
     
+    # Keep the raw payload so readings can be reprocessed without MySQL
+    try:
+        archive = get_archive()
+        if archive and scale_data.get('raw') is not None:
+            archive.archive(user.id, scale_data['raw'], source='xiaomi')
+    except Exception as e:
+        logger.error(f"Failed to archive raw Xiaomi payload: {e}")
+    
     return jsonify({
         'message': 'Data synced successfully from Xiaomi device',
         'data': new_entry.to_dict()
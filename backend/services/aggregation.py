@@ -0,0 +1,174 @@
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from config import ARCHIVE_BACKEND
+from models.health_data import HealthData
+from models.health_data_archive import HealthDataArchive
+from services import tiered_storage
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = ['day', 'week', 'month']
+
+AGGREGATES = ['avg', 'min', 'max', 'count']
+
+# What each tier is reduced to per bucket; every aggregate derives from these
+STATS = ['count', 'sum', 'min', 'max']
+
+
+def date_bucket(column, bucket, dialect):
+    """
+    SQL expression truncating a datetime column to the start of its bucket
+
+    Weeks start on Monday.
+
+    Args:
+        column: SQLAlchemy datetime column
+        bucket (str): 'day', 'week' or 'month'
+        dialect (str): SQLAlchemy dialect name
+
+    Returns:
+        SQL expression
+    """
+    if dialect == 'mysql':
+        if bucket == 'day':
+            return func.date(column)
+        if bucket == 'week':
+            return func.date(func.subdate(column, func.weekday(column)))
+        return func.date_format(column, '%Y-%m-01')
+
+    if dialect == 'sqlite':
+        if bucket == 'day':
+            return func.date(column)
+        if bucket == 'week':
+            # Forward to Sunday (no-op on Sundays), then back to Monday
+            return func.date(column, 'weekday 0', '-6 days')
+        return func.date(column, 'start of month')
+
+    if dialect == 'postgresql':
+        return func.date(func.date_trunc(bucket, column))
+
+    raise ValueError(f'Date bucketing is not supported for the {dialect} dialect')
+
+
+def aggregate_health_data(session, user_id, bucket, metrics, aggregates, start_date=None, end_date=None):
+    """
+    Aggregate a user's health metrics per time bucket in the database
+
+    Ranges that reach the cold tier (services/tiered_storage.py) aggregate
+    the archive too; a bucket that straddles the tiers combines both.
+
+    Args:
+        session: SQLAlchemy session
+        user_id (int): Internal user id
+        bucket (str): 'day', 'week' or 'month'
+        metrics (list): HealthData metric column names
+        aggregates (list): Names from AGGREGATES
+        start_date (datetime): Inclusive lower bound
+        end_date (datetime): Inclusive upper bound
+
+    Returns:
+        list: [{'bucket': 'YYYY-MM-DD', metric: {agg: value}}] ordered by bucket
+    """
+    partials = _table_partials(session, HealthData, user_id, bucket, metrics, start_date, end_date)
+
+    if tiered_storage.needs_cold(session, user_id, start_date):
+        if ARCHIVE_BACKEND == 'table':
+            cold = _table_partials(session, HealthDataArchive, user_id, bucket, metrics, start_date, end_date)
+        else:
+            records = tiered_storage.read_cold(session, user_id, start_date, end_date, fields=metrics)
+            cold = _record_partials(records, bucket, metrics)
+        for key, point in cold.items():
+            merged = partials.setdefault(key, {})
+            for metric, stats in point.items():
+                merged[metric] = _merge_stats(merged.get(metric), stats)
+
+    result = []
+    for key in sorted(partials):
+        point = {'bucket': key}
+        for metric in metrics:
+            stats = partials[key].get(metric) or {'count': 0, 'sum': None, 'min': None, 'max': None}
+            point[metric] = {aggregate: _finish(stats, aggregate) for aggregate in aggregates}
+        result.append(point)
+    return result
+
+
+def _table_partials(session, model, user_id, bucket, metrics, start_date, end_date):
+    """
+    Per-bucket count, sum, min and max of each metric in one tier's table
+
+    Averages are rebuilt from sum and count, so buckets from both tiers combine.
+
+    Returns:
+        dict: {'YYYY-MM-DD': {metric: {'count', 'sum', 'min', 'max'}}}
+    """
+    dialect = session.bind.dialect.name
+    bucket_expr = date_bucket(model.date, bucket, dialect).label('bucket')
+
+    columns = [bucket_expr]
+    for metric in metrics:
+        column = getattr(model, metric)
+        columns += [
+            func.count(column).label(f'{metric}__count'),
+            func.sum(column).label(f'{metric}__sum'),
+            func.min(column).label(f'{metric}__min'),
+            func.max(column).label(f'{metric}__max'),
+        ]
+
+    query = session.query(*columns).filter(model.user_id == user_id)
+    if start_date:
+        query = query.filter(model.date >= start_date)
+    if end_date:
+        query = query.filter(model.date <= end_date)
+    rows = query.group_by(bucket_expr).all()
+
+    partials = {}
+    for row in rows:
+        values = row._asdict()
+        partials[str(values.pop('bucket'))] = {
+            metric: {stat: values[f'{metric}__{stat}'] for stat in STATS}
+            for metric in metrics
+        }
+    return partials
+
+
+def _record_partials(records, bucket, metrics):
+    """The same partials computed in Python over health data dictionaries (Parquet archive)"""
+    partials = {}
+    for record in records:
+        day = datetime.fromisoformat(record['date']).date()
+        if bucket == 'week':
+            day -= timedelta(days=day.weekday())
+        elif bucket == 'month':
+            day = day.replace(day=1)
+        point = partials.setdefault(day.isoformat(), {})
+        for metric in metrics:
+            value = record.get(metric)
+            if value is not None:
+                point[metric] = _merge_stats(point.get(metric), {'count': 1, 'sum': value, 'min': value, 'max': value})
+    return partials
+
+
+def _merge_stats(stats, other):
+    if not stats or not stats['count']:
+        return other
+    if not other['count']:
+        return stats
+    return {
+        'count': stats['count'] + other['count'],
+        'sum': stats['sum'] + other['sum'],
+        'min': min(stats['min'], other['min']),
+        'max': max(stats['max'], other['max']),
+    }
+
+
+def _finish(stats, aggregate):
+    if aggregate == 'count':
+        return stats['count']
+    if not stats['count']:
+        return None
+    if aggregate == 'avg':
+        return float(stats['sum']) / stats['count']
+    return float(stats[aggregate])
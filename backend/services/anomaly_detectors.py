@@ -0,0 +1,170 @@
+import logging
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from config import ANOMALY_MAD_WINDOW, ANOMALY_SCORE_THRESHOLD
+from services.streaming_anomaly import MAD_TO_STD, MIN_SPREAD
+
+logger = logging.getLogger(__name__)
+
+
+class AnomalyDetector:
+    """
+    Base class for batch anomaly detectors
+
+    Detectors score a whole 1-D series, oldest first, in one call. Scores are
+    on a robust z-score scale where the detector supports it, so a point is
+    flagged when its score reaches the threshold.
+    """
+
+    name = None
+
+    # Minimum number of observations the detector needs
+    min_points = 10
+
+    def detect(self, values, dates=None):
+        """
+        Score a series and flag anomalies
+
+        Args:
+            values (np.ndarray): Observations, oldest first
+            dates (pd.DatetimeIndex): Observation times, used by seasonal detectors
+
+        Returns:
+            tuple: (flags as a boolean array, scores as a float array)
+        """
+        raise NotImplementedError
+
+
+class IsolationForestDetector(AnomalyDetector):
+    """
+    scikit-learn IsolationForest on the raw values
+
+    Always flags about ``contamination`` of the points, and the 100 random
+    trees make it slow and nondeterministic on short series. Kept as the
+    reference the robust detectors are benchmarked against.
+    """
+
+    name = 'isolation_forest'
+
+    def __init__(self, contamination=0.05, random_state=None):
+        self.contamination = contamination
+        self.random_state = random_state
+        self.estimator = None
+
+    def detect(self, values, dates=None):
+        from sklearn.ensemble import IsolationForest
+
+        x = np.asarray(values, dtype=float).reshape(-1, 1)
+        self.estimator = IsolationForest(contamination=self.contamination, random_state=self.random_state)
+        flags = self.estimator.fit_predict(x) == -1
+        # score_samples is higher for normal points; flip so larger means more anomalous
+        return flags, -self.estimator.score_samples(x)
+
+
+def rolling_median(values, window):
+    """Centered rolling median with edge padding, as one vectorized call"""
+    half = window // 2
+    padded = np.pad(values, (half, window - half - 1), mode='edge')
+    return np.median(sliding_window_view(padded, window), axis=1)
+
+
+def robust_scores(residuals):
+    """Absolute residuals over their MAD, scaled to standard deviations"""
+    centered = residuals - np.median(residuals)
+    mad = np.median(np.abs(centered)) * MAD_TO_STD
+    return np.abs(centered) / max(mad, MIN_SPREAD)
+
+
+class MadDetector(AnomalyDetector):
+    """
+    Residuals from a centered rolling median, scored by their MAD
+
+    The rolling median follows slow trends (a diet, a bulk) without being
+    pulled by the spikes themselves, and the median absolute deviation of the
+    residuals sets the scale, so a few outliers can't hide each other. Only
+    points whose robust z-score reaches ``threshold`` are flagged; a clean
+    series flags nothing. ``python -m benchmarks.anomaly_benchmark`` at its
+    defaults (200 trials, seed 0) prints F1 0.786 at 14 points, 0.873 at 30,
+    0.959 at 56 and 0.987 at 120; seeds 1 and 2 give 0.866-0.902 at 30.
+    """
+
+    name = 'mad'
+    min_points = 5
+
+    def __init__(self, threshold=ANOMALY_SCORE_THRESHOLD, window=ANOMALY_MAD_WINDOW):
+        self.threshold = threshold
+        self.window = window
+
+    def detect(self, values, dates=None):
+        y = np.asarray(values, dtype=float)
+        window = min(self.window, len(y) - (1 - len(y) % 2))
+        scores = robust_scores(y - rolling_median(y, max(window, 1)))
+        return scores >= self.threshold, scores
+
+
+class SeasonalResidualDetector(AnomalyDetector):
+    """
+    Rolling-median trend plus a per-weekday (or per-position) seasonal median
+
+    Removes the trend as MadDetector does, then the median residual of each
+    season slot (day of week when dates are given, index modulo ``period``
+    otherwise), and scores what is left by its MAD. Suits metrics with a
+    weekly rhythm such as steps or calories, where a quiet Sunday is normal.
+
+    Each slot's median needs several weeks to settle. The benchmark at its
+    defaults (200 trials, seed 0) prints F1 0.513 at 14 points, 0.750 at 30
+    and 0.930 at 56 (0.910-0.937 over seeds 0-2), so the detector waits for
+    eight weeks; use mad for shorter series.
+    """
+
+    name = 'seasonal'
+    min_points = 56
+
+    def __init__(self, threshold=ANOMALY_SCORE_THRESHOLD, period=7, window=ANOMALY_MAD_WINDOW):
+        self.threshold = threshold
+        self.period = period
+        self.window = window
+
+    def detect(self, values, dates=None):
+        y = np.asarray(values, dtype=float)
+        window = min(self.window, len(y) - (1 - len(y) % 2))
+        detrended = y - rolling_median(y, max(window, 1))
+
+        if dates is not None:
+            slots = np.asarray(dates.dayofweek) % self.period
+        else:
+            slots = np.arange(len(y)) % self.period
+        seasonal = np.zeros(len(y))
+        for slot in np.unique(slots):
+            members = slots == slot
+            seasonal[members] = np.median(detrended[members])
+
+        scores = robust_scores(detrended - seasonal)
+        return scores >= self.threshold, scores
+
+
+# Detector name -> (class, default constructor arguments)
+DETECTORS = {
+    'isolation_forest': (IsolationForestDetector, {'contamination': 0.05}),
+    'mad': (MadDetector, {}),
+    'seasonal': (SeasonalResidualDetector, {}),
+}
+
+
+def get_detector(name, **kwargs):
+    """
+    Instantiate an anomaly detector by name
+
+    Args:
+        name (str): Detector name
+        **kwargs: Extra keyword arguments passed to the detector constructor
+
+    Returns:
+        AnomalyDetector: A detector
+    """
+    if name not in DETECTORS:
+        raise ValueError(f'Unknown anomaly detector: {name}')
+    detector_class, defaults = DETECTORS[name]
+    return detector_class(**dict(defaults, **kwargs))
@@ -0,0 +1,317 @@
+import itertools
+import json
+import logging
+import threading
+import warnings
+from datetime import datetime
+
+import numpy as np
+from flask import has_app_context
+from sqlalchemy import func
+
+from config import ARIMA_DEFAULT_ORDER, ARIMA_MAX_P, ARIMA_MAX_Q, ARIMA_TUNE_MIN_NEW_POINTS
+from models import db
+from models.health_data import HealthData
+from models.model_metadata import ModelMetadata
+from models.routing import on_primary
+from services.insight_jobs import job_queue
+
+logger = logging.getLogger(__name__)
+
+MODEL_TYPE = 'weight_arima'
+
+# Fitted parameters of the user's current ARIMA model (see HealthMLService.predict_weight)
+FIT_MODEL_TYPE = 'weight_arima_fit'
+
+# ARIMA needs a handful of points per parameter before AIC means anything
+MIN_TUNE_POINTS = 20
+
+
+def choose_differencing(values, max_d=2):
+    """
+    Choose the differencing order with repeated augmented Dickey-Fuller tests
+
+    Args:
+        values (np.ndarray): Observations, oldest first
+        max_d (int): Maximum differencing order
+
+    Returns:
+        int: Differencing order d
+    """
+    from statsmodels.tsa.stattools import adfuller
+
+    series = np.asarray(values, dtype=float)
+    for d in range(max_d):
+        try:
+            p_value = adfuller(series, autolag='AIC')[1]
+        except ValueError:
+            # Constant or too-short series: nothing left to difference
+            return d
+        if p_value < 0.05:
+            return d
+        series = np.diff(series)
+    return max_d
+
+
+def select_arima_order(values, max_p=ARIMA_MAX_P, max_q=ARIMA_MAX_Q):
+    """
+    Search ARIMA orders by AIC
+
+    The differencing order is fixed first (AIC is not comparable across d),
+    then every (p, q) combination up to the limits is fitted.
+
+    Args:
+        values (np.ndarray): Observations, oldest first
+        max_p (int): Maximum autoregressive order
+        max_q (int): Maximum moving-average order
+
+    Returns:
+        dict: {'order': [p, d, q], 'aic': float}
+    """
+    from statsmodels.tsa.arima.model import ARIMA
+
+    y = np.asarray(values, dtype=float)
+    d = choose_differencing(y)
+
+    best_order, best_aic = None, np.inf
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for p, q in itertools.product(range(max_p + 1), range(max_q + 1)):
+            if p == 0 and q == 0 and d == 0:
+                continue
+            try:
+                aic = ARIMA(y, order=(p, d, q)).fit().aic
+            except Exception as e:
+                logger.debug(f"ARIMA order ({p},{d},{q}) failed: {e}")
+                continue
+            if np.isfinite(aic) and aic < best_aic:
+                best_order, best_aic = (p, d, q), aic
+
+    if best_order is None:
+        best_order, best_aic = tuple(ARIMA_DEFAULT_ORDER), None
+    return {'order': list(best_order), 'aic': float(best_aic) if best_aic is not None else None}
+
+
+def needs_tuning(metadata, n_observations):
+    """Whether enough new data has arrived since the last tuning run"""
+    if n_observations < MIN_TUNE_POINTS:
+        return False
+    if metadata is None:
+        return True
+    return n_observations - (metadata.n_observations or 0) >= ARIMA_TUNE_MIN_NEW_POINTS
+
+
+def weight_count(user_id):
+    """Number of weigh-ins in a user's full history"""
+    return db.session.query(func.count(HealthData.id)).filter(
+        HealthData.user_id == user_id,
+        HealthData.weight.isnot(None)
+    ).scalar()
+
+
+def load_weights(user_id):
+    """A user's weigh-ins, oldest first"""
+    rows = db.session.query(HealthData.weight).filter(
+        HealthData.user_id == user_id,
+        HealthData.weight.isnot(None)
+    ).order_by(HealthData.date).all()
+    return np.array([row.weight for row in rows], dtype=float)
+
+
+def tune_user(user_id, force=False):
+    """
+    Run the order search for one user and store the result
+
+    Must be called inside an application context.
+
+    Args:
+        user_id (int): Internal user id
+        force (bool): Tune even if not enough new data has arrived
+
+    Returns:
+        dict: The stored parameters, or None if tuning was skipped
+    """
+    values = load_weights(user_id)
+
+    metadata = ModelMetadata.query.filter_by(user_id=user_id, model_type=MODEL_TYPE).first()
+    if not force and not needs_tuning(metadata, len(values)):
+        return None
+    if len(values) < MIN_TUNE_POINTS:
+        return None
+
+    params = select_arima_order(values)
+    save_metadata(user_id, MODEL_TYPE, params, len(values))
+    db.session.commit()
+
+    logger.info(f"Tuned ARIMA order for user {user_id}: {params}")
+    return params
+
+
+def load_fit_state(user_id, refit=False):
+    """
+    Get a user's stored ARIMA fit state
+
+    Args:
+        user_id (int): Internal user id
+        refit (bool): Mark the state so the next prediction runs a full (warm-started) fit
+
+    Returns:
+        dict: Fit state for HealthMLService.predict_weight, or None
+    """
+    metadata = ModelMetadata.query.filter_by(user_id=user_id, model_type=FIT_MODEL_TYPE).first()
+    if metadata is None:
+        return None
+    state = metadata.get_params()
+    if refit:
+        state['refit'] = True
+    return state
+
+
+def save_fit_state(user_id, state):
+    """
+    Store the fit state returned by a full-history prediction; the caller commits
+
+    Inside read_replica handlers, call it within models.routing.on_primary.
+
+    Args:
+        user_id (int): Internal user id
+        state (dict): The prediction's 'arima_state'
+    """
+    save_metadata(user_id, FIT_MODEL_TYPE, state, state['n_fit'])
+
+
+def save_metadata(user_id, model_type, params, n_observations):
+    """
+    Insert or replace a user's model metadata row; the caller commits
+
+    Written as a single upsert, so concurrent writers for the same user
+    can't both insert.
+
+    Args:
+        user_id (int): Internal user id
+        model_type (str): MODEL_TYPE or FIT_MODEL_TYPE
+        params (dict): Parameters to store as JSON
+        n_observations (int): Observations the parameters were derived from
+    """
+    table = ModelMetadata.__table__
+    now = datetime.utcnow()
+    values = {
+        'user_id': user_id,
+        'model_type': model_type,
+        'params': json.dumps(params),
+        'n_observations': n_observations,
+        'created_at': now,
+        'updated_at': now
+    }
+    updated = ('params', 'n_observations', 'updated_at')
+
+    dialect = db.session.get_bind(mapper=ModelMetadata.__mapper__).dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).values(**values)
+        statement = statement.on_duplicate_key_update({column: statement.inserted[column] for column in updated})
+    elif dialect in ('postgresql', 'sqlite'):
+        from sqlalchemy.dialects import postgresql, sqlite
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        statement = insert(table).values(**values)
+        statement = statement.on_conflict_do_update(
+            index_elements=['user_id', 'model_type'],
+            set_={column: statement.excluded[column] for column in updated}
+        )
+    else:
+        metadata = ModelMetadata.query.filter_by(user_id=user_id, model_type=model_type).first()
+        if metadata is None:
+            metadata = ModelMetadata(user_id=user_id, model_type=model_type)
+            db.session.add(metadata)
+        metadata.set_params(params)
+        metadata.n_observations = n_observations
+        return
+    db.session.execute(statement)
+
+
+class ArimaOrderTuner:
+    """
+    Queues per-user order searches on the insight process pool, off the request path
+
+    The web process only loads the weigh-ins and stores the chosen order
+    once the pool returns it; the model fits run in the pool's workers.
+    """
+
+    def __init__(self, queue=job_queue):
+        self._queue = queue
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def order_for_user(self, app, user_id):
+        """
+        Get a user's cached ARIMA order, queueing a re-tune if enough new data has arrived
+
+        Args:
+            app (Flask): Application used to store the result outside the request
+            user_id (int): Internal user id
+
+        Returns:
+            tuple: (p, d, q), or None if the user has not been tuned yet
+        """
+        metadata = ModelMetadata.query.filter_by(user_id=user_id, model_type=MODEL_TYPE).first()
+        if needs_tuning(metadata, weight_count(user_id)):
+            self.schedule(app, user_id)
+
+        order = metadata.get_params().get('order') if metadata else None
+        return tuple(order) if order else None
+
+    def schedule(self, app, user_id):
+        """
+        Queue a tuning run for a user unless one is already pending
+
+        Args:
+            app (Flask): Application used to store the result outside the request
+            user_id (int): Internal user id
+
+        Returns:
+            bool: True if a run was queued
+        """
+        with self._lock:
+            if user_id in self._pending:
+                return False
+            self._pending.add(user_id)
+
+        try:
+            values = load_weights(user_id)
+            job = self._queue.submit('arima_order_search', user_id, values)
+        except Exception as e:
+            # A full queue just postpones tuning to a later request or the nightly job
+            with self._lock:
+                self._pending.discard(user_id)
+            logger.warning(f"ARIMA order tuning not queued for user {user_id}: {e}")
+            return False
+
+        job.future.add_done_callback(lambda future: self._store(app, user_id, len(values), future))
+        return True
+
+    def _store(self, app, user_id, n_observations, future):
+        """Store a finished search; runs on the pool's result thread, or inline without workers"""
+        try:
+            if future.cancelled() or future.exception() is not None:
+                return
+            params, _ = future.result()
+            if has_app_context():
+                self._save(user_id, params, n_observations)
+            else:
+                with app.app_context():
+                    self._save(user_id, params, n_observations)
+            logger.info(f"Tuned ARIMA order for user {user_id}: {params}")
+        except Exception as e:
+            logger.error(f"Storing the ARIMA order for user {user_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(user_id)
+
+    @staticmethod
+    def _save(user_id, params, n_observations):
+        with on_primary():
+            save_metadata(user_id, MODEL_TYPE, params, n_observations)
+            db.session.commit()
+
+
+tuner = ArimaOrderTuner()
@@ -0,0 +1,138 @@
+import base64
+import json
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, event, or_
+
+from config import CHANGES_SETTLE_SECONDS, TOMBSTONE_RETENTION_DAYS
+from models.health_data import HealthData
+from models.health_data_tombstone import HealthDataTombstone
+
+logger = logging.getLogger(__name__)
+
+tombstones_table = HealthDataTombstone.__table__
+
+
+class SyncTokenExpired(Exception):
+    """Raised when a sync token predates the tombstone retention window"""
+
+
+def encode_token(updated, deleted):
+    """
+    Opaque sync token
+
+    Args:
+        updated (tuple): (updated_at, id) of the last change sent, or None
+        deleted (tuple): (deleted_at, id) of the last tombstone sent
+    """
+    data = {
+        'u': [updated[0].isoformat(), updated[1]] if updated else None,
+        'd': [deleted[0].isoformat(), deleted[1]]
+    }
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """
+    Decode a sync token
+
+    Returns:
+        tuple: (updated, deleted) watermarks as for encode_token
+
+    Raises:
+        ValueError: If the token is malformed
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        updated = (datetime.fromisoformat(data['u'][0]), int(data['u'][1])) if data['u'] else None
+        deleted = (datetime.fromisoformat(data['d'][0]), int(data['d'][1]))
+    except (ValueError, TypeError, KeyError, IndexError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid sync token') from e
+    return updated, deleted
+
+
+def _after(column, id_column, watermark):
+    """Keyset predicate: (column, id) > watermark"""
+    timestamp, last_id = watermark
+    return or_(column > timestamp, and_(column == timestamp, id_column > last_id))
+
+
+def changes_since(user_id, token=None, limit=1000, fields=None):
+    """
+    Health data changed or deleted since a sync token
+
+    Rows are read in (updated_at, id) order up to CHANGES_SETTLE_SECONDS ago,
+    so writes still in flight when a page is read are picked up by the next
+    sync rather than skipped. Without a token every row is returned (paged)
+    and earlier deletions are ignored.
+
+    Args:
+        user_id (int): Internal user id
+        token (str): Token from the previous response, or None for a full sync
+        limit (int): Maximum rows and maximum tombstones per page
+        fields (list): Projection, as for HealthData.to_dict
+
+    Returns:
+        dict: changes, deleted ids, next_token and has_more
+
+    Raises:
+        ValueError: If the token is malformed
+        SyncTokenExpired: If tombstones from the token's window were pruned
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+
+    if token:
+        updated, deleted = decode_token(token)
+        if deleted[0] < datetime.utcnow() - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+            raise SyncTokenExpired('Sync token expired; run a full sync without a token')
+    else:
+        updated, deleted = None, (cutoff, 0)
+
+    # Get rows changed since the watermark (ix_health_data_user_updated)
+    query = HealthData.query.filter(HealthData.user_id == user_id, HealthData.updated_at <= cutoff)
+    if updated:
+        query = query.filter(_after(HealthData.updated_at, HealthData.id, updated))
+    if fields is not None:
+        query = query.options(HealthData.load_only(list(fields) + ['updated_at']))
+    rows = query.order_by(HealthData.updated_at, HealthData.id).limit(limit + 1).all()
+
+    # Get deletions since the watermark
+    tombstones = HealthDataTombstone.query.filter(
+        HealthDataTombstone.user_id == user_id,
+        HealthDataTombstone.deleted_at <= cutoff,
+        _after(HealthDataTombstone.deleted_at, HealthDataTombstone.id, deleted)
+    ).order_by(HealthDataTombstone.deleted_at, HealthDataTombstone.id).limit(limit + 1).all()
+
+    tombstones_complete = len(tombstones) <= limit
+    has_more = len(rows) > limit or not tombstones_complete
+    rows, tombstones = rows[:limit], tombstones[:limit]
+
+    if rows:
+        updated = (rows[-1].updated_at, rows[-1].id)
+    if tombstones:
+        deleted = (tombstones[-1].deleted_at, tombstones[-1].id)
+    if tombstones_complete:
+        # Every deletion up to the cutoff has been sent; keeps idle tokens inside the retention window
+        deleted = max(deleted, (cutoff, 0))
+
+    return {
+        'changes': [row.to_dict(fields) for row in rows],
+        'deleted': [tombstone.id for tombstone in tombstones],
+        'next_token': encode_token(updated, deleted),
+        'has_more': has_more
+    }
+
+
+# Record a tombstone for every ORM delete of a HealthData row. Bulk deletes
+# (Query.delete, e.g. the cold-tier archive job) move data rather than delete
+# it and deliberately bypass this hook.
+@event.listens_for(HealthData, 'after_delete')
+def _after_delete(mapper, connection, entry):
+    connection.execute(tombstones_table.delete().where(tombstones_table.c.id == entry.id))
+    connection.execute(tombstones_table.insert(), {
+        'id': entry.id,
+        'user_id': entry.user_id,
+        'deleted_at': datetime.utcnow()
+    })
@@ -0,0 +1,178 @@
+import logging
+from datetime import date, timezone
+
+from config import COHORT_SKETCH_SHARDS
+from models.cohort_sketch import CohortMember, CohortSketch
+from services.quantile_sketch import BinnedCounts
+
+logger = logging.getLogger(__name__)
+
+# Scale metrics with cohort sketches
+COHORT_METRICS = [
+    'weight', 'bmi', 'body_fat', 'muscle_mass', 'water',
+    'visceral_fat', 'bone_mass', 'basal_metabolism', 'protein'
+]
+
+# Bin width of each metric's counts, at or below the scale's resolution
+BIN_WIDTHS = {metric: 0.1 for metric in COHORT_METRICS}
+BIN_WIDTHS.update({'bone_mass': 0.01, 'basal_metabolism': 1})
+
+# (lower bound, label); the last band is open-ended
+AGE_BANDS = [(0, '<18'), (18, '18-29'), (30, '30-39'), (40, '40-49'), (50, '50-59'), (60, '60-69'), (70, '70+')]
+
+UNKNOWN = 'unknown'
+
+REPORTED_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+
+def age_band(date_of_birth, on=None):
+    """Age band label for a date of birth, 'unknown' when it isn't set"""
+    if date_of_birth is None:
+        return UNKNOWN
+    on = on or date.today()
+    age = on.year - date_of_birth.year - ((on.month, on.day) < (date_of_birth.month, date_of_birth.day))
+    label = AGE_BANDS[0][1]
+    for lower, band in AGE_BANDS:
+        if age >= lower:
+            label = band
+    return label
+
+
+def cohort_of(user):
+    """(gender, age band) of a user"""
+    gender = (user.gender or '').strip().lower() or UNKNOWN
+    return gender[:10], age_band(user.date_of_birth)
+
+
+def shard_of(user_id):
+    return user_id % COHORT_SKETCH_SHARDS
+
+
+def _utc_naive(day):
+    """Client dates may carry a UTC offset; stored ones are naive UTC"""
+    return day.astimezone(timezone.utc).replace(tzinfo=None) if day.tzinfo else day
+
+
+def new_counts(metric):
+    """Empty binned counts for a metric"""
+    return BinnedCounts(BIN_WIDTHS[metric])
+
+
+def record_entries(session, user, entries):
+    """
+    Count new or edited HealthData readings in the user's cohort sketches
+
+    A cohort holds one value per user and metric, the latest reading: a
+    reading newer than the stored one replaces it, older ones are ignored.
+    Touches only the user's member rows and shard rows, each locked in one
+    query; the caller commits.
+
+    Args:
+        session: SQLAlchemy session
+        user: User instance
+        entries (list): HealthData instances
+    """
+    latest = {}
+    for entry in entries:
+        for metric in COHORT_METRICS:
+            value = getattr(entry, metric)
+            day = _utc_naive(entry.date)
+            if value is not None and (metric not in latest or day >= latest[metric][0]):
+                latest[metric] = (day, float(value))
+    if not latest:
+        return
+
+    members = {
+        member.metric: member
+        for member in session.query(CohortMember).with_for_update().filter(
+            CohortMember.user_id == user.id,
+            CohortMember.metric.in_(latest)
+        )
+    }
+
+    gender, band = cohort_of(user)
+    changes = []
+    for metric, (day, value) in latest.items():
+        member = members.get(metric)
+        if member is None:
+            member = CohortMember(user_id=user.id, metric=metric)
+            session.add(member)
+        elif day < member.date:
+            continue
+        elif (member.value, member.gender, member.age_band) == (value, gender, band):
+            member.date = day
+            continue
+        else:
+            changes.append((member.gender, member.age_band, metric, None, member.value))
+        changes.append((gender, band, metric, value, None))
+        member.gender, member.age_band, member.value, member.date = gender, band, value, day
+    if not changes:
+        return
+
+    shard = shard_of(user.id)
+    rows = {
+        (row.gender, row.age_band, row.metric): row
+        for row in session.query(CohortSketch).with_for_update().filter(
+            CohortSketch.shard == shard,
+            CohortSketch.gender.in_({change[0] for change in changes}),
+            CohortSketch.age_band.in_({change[1] for change in changes}),
+            CohortSketch.metric.in_({change[2] for change in changes})
+        )
+    }
+
+    sketches = {}
+    for cohort_gender, cohort_band, metric, added, removed in changes:
+        key = (cohort_gender, cohort_band, metric)
+        if key not in sketches:
+            row = rows.get(key)
+            if row is None:
+                row = CohortSketch(gender=cohort_gender, age_band=cohort_band, metric=metric, shard=shard)
+                session.add(row)
+                sketches[key] = (row, new_counts(metric))
+            else:
+                sketches[key] = (row, BinnedCounts.from_dict(row.get_sketch()))
+        _, counts = sketches[key]
+        if added is not None:
+            counts.add(added)
+        if removed is not None:
+            counts.remove(removed)
+
+    for row, counts in sketches.values():
+        row.set_sketch(counts.to_dict())
+        row.count = counts.n
+
+
+def load_cohort(session, gender, band, metric):
+    """
+    Merged distribution of one cohort and metric
+
+    Reads at most COHORT_SKETCH_SHARDS rows of bounded size, so the cost
+    doesn't depend on the number of users. Quantiles are exact up to the
+    metric's bin width.
+
+    Returns:
+        BinnedCounts: The merged distribution; n is the number of users
+    """
+    merged = new_counts(metric)
+    rows = session.query(CohortSketch).filter_by(gender=gender, age_band=band, metric=metric).all()
+    for row in rows:
+        merged.merge(BinnedCounts.from_dict(row.get_sketch()))
+    return merged
+
+
+def percentile_summary(sketch, value):
+    """
+    Position of a value in a cohort's distribution
+
+    Returns:
+        dict: percentile (0-100), cohort_size (users) and the cohort's deciles/quartiles
+    """
+    rank = sketch.rank(value)
+    return {
+        'percentile': round(rank * 100, 1) if rank is not None else None,
+        'cohort_size': sketch.n,
+        'quantiles': {
+            f'p{int(fraction * 100)}': quantile
+            for fraction, quantile in zip(REPORTED_QUANTILES, sketch.quantiles(REPORTED_QUANTILES))
+        }
+    }
@@ -0,0 +1,138 @@
+import logging
+from datetime import timedelta
+
+import numpy as np
+
+from config import TREND_WINDOWS_DAYS
+from models.health_data import HealthData
+from services.recommendations import compute_bmi
+
+logger = logging.getLogger(__name__)
+
+# Readings this far before a row can still be inside one of its windows
+LOOKBACK = timedelta(days=max(TREND_WINDOWS_DAYS))
+
+
+def derive_bmi(entry, height_cm, overwrite=False):
+    """
+    Fill in an entry's BMI from its weight and the user's height
+
+    Args:
+        entry (HealthData): Entry about to be written
+        height_cm (float): User height in cm, or None
+        overwrite (bool): Replace a BMI already on the entry, e.g. after its weight changed
+    """
+    # Scales report 0 when they couldn't compute one
+    if entry.weight is None or (entry.bmi and not overwrite):
+        return
+    bmi = float(compute_bmi(entry.weight, height_cm if height_cm else np.nan))
+    entry.bmi = None if np.isnan(bmi) else round(bmi, 2)
+
+
+def window_stats(times, values, targets, days):
+    """
+    Mean and least-squares slope of the readings in (target - days, target]
+
+    Uses prefix sums, so every target costs O(1) after one O(n) pass.
+
+    Args:
+        times (np.ndarray): Reading times in days, ascending
+        values (np.ndarray): Readings; NaN for missing
+        targets (np.ndarray): Times to evaluate at
+        days (int): Window length in days
+
+    Returns:
+        tuple: (means, slopes per day), NaN where a window has too few readings
+    """
+    present = ~np.isnan(values)
+    t, y = times[present], values[present]
+
+    def prefix(column):
+        return np.concatenate([[0.0], np.cumsum(column)])
+
+    sums = [prefix(column) for column in (np.ones_like(t), t, y, t * t, t * y)]
+    hi = np.searchsorted(t, targets, side='right')
+    lo = np.searchsorted(t, targets - days, side='right')
+    n, s_t, s_y, s_tt, s_ty = [s[hi] - s[lo] for s in sums]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(n > 0, s_y / n, np.nan)
+        spread = n * s_tt - s_t * s_t
+        slopes = np.where((n > 1) & (spread > 1e-9), (n * s_ty - s_t * s_y) / spread, np.nan)
+    return means, slopes
+
+
+def compute_trends(rows, targets):
+    """
+    Rolling statistics of every metric for the target rows
+
+    Args:
+        rows (list): HealthData rows of one user, oldest first, covering
+            LOOKBACK before the first target
+        targets (list): Rows (a subset of ``rows``) to compute trends for
+
+    Returns:
+        list: One {metric: {'mean_7d': ..., 'slope_7d': ..., ...}} per target
+    """
+    origin = rows[0].date
+    times = np.array([(row.date - origin).total_seconds() / 86400 for row in rows])
+    target_times = np.array([(row.date - origin).total_seconds() / 86400 for row in targets])
+
+    trends = [{} for _ in targets]
+    for metric in HealthData.METRICS:
+        values = np.array([getattr(row, metric) for row in rows], dtype=float)
+        if np.isnan(values).all():
+            continue
+        for days in TREND_WINDOWS_DAYS:
+            means, slopes = window_stats(times, values, target_times, days)
+            for trend, mean, slope in zip(trends, means, slopes):
+                if np.isnan(mean):
+                    continue
+                stats = trend.setdefault(metric, {})
+                stats[f'mean_{days}d'] = round(float(mean), 4)
+                stats[f'slope_{days}d'] = None if np.isnan(slope) else round(float(slope), 4) + 0.0  # no -0.0
+    return trends
+
+
+def recompute_trends(session, user_id, start, end):
+    """
+    Recompute the stored trends of one user's rows dated in [start, end]
+
+    The query autoflushes, so pending new and edited entries are included.
+
+    Returns:
+        int: Number of rows updated
+    """
+    rows = session.query(HealthData).filter(
+        HealthData.user_id == user_id,
+        HealthData.date >= start - LOOKBACK,
+        HealthData.date <= end
+    ).order_by(HealthData.date, HealthData.id).all()
+
+    targets = [row for row in rows if row.date >= start]
+    if not targets:
+        return 0
+    for row, trends in zip(targets, compute_trends(rows, targets)):
+        row.set_trends(trends)
+    return len(targets)
+
+
+def refresh_trends(session, user_id, dates):
+    """
+    Update the trends a write at the given dates can change; the caller commits
+
+    A reading is inside the windows of the rows up to LOOKBACK after it, so
+    only those rows are recomputed rather than the user's whole history.
+
+    Args:
+        session: SQLAlchemy session
+        user_id (int): Internal user id
+        dates (list): Dates of inserted, edited (old and new date) or deleted readings
+
+    Returns:
+        int: Number of rows updated
+    """
+    dates = [date for date in dates if date is not None]
+    if not dates:
+        return 0
+    return recompute_trends(session, user_id, min(dates), max(dates) + LOOKBACK)
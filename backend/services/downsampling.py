@@ -0,0 +1,140 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets point selection
+
+    The first and last points are always kept. The interior is split into
+    ``n_out - 2`` buckets and from each bucket the point forming the largest
+    triangle with the previously selected point and the next bucket's average
+    is chosen. Each bucket's areas are computed as one NumPy expression.
+
+    Args:
+        x (np.ndarray): Sorted x coordinates
+        y (np.ndarray): y coordinates
+        n_out (int): Number of points to keep
+
+    Returns:
+        np.ndarray: Sorted indices of the selected points
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # Bucket boundaries over the interior points 1..n-2
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        else:
+            next_start, next_end = n - 1, n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return selected
+
+
+def minmax_indices(x, y, n_out):
+    """
+    Min/max bucket point selection
+
+    Splits the series into ``n_out // 2`` equal-count buckets and keeps the
+    minimum and maximum of each, fully vectorized. Preserves every peak and
+    trough at the cost of less faithful shape than LTTB.
+
+    Args:
+        x (np.ndarray): Sorted x coordinates
+        y (np.ndarray): y coordinates
+        n_out (int): Number of points to keep
+
+    Returns:
+        np.ndarray: Sorted indices of the selected points
+    """
+    n = len(x)
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=float)
+    labels = np.repeat(np.arange(n_buckets), np.diff(np.linspace(0, n, n_buckets + 1).astype(int)))
+
+    # Sort by bucket then value: each bucket's first entry is its min, last its max
+    ranked = np.lexsort((y, labels))
+    starts = np.searchsorted(labels[ranked], np.arange(n_buckets), side='left')
+    ends = np.searchsorted(labels[ranked], np.arange(n_buckets), side='right') - 1
+    return np.unique(np.concatenate([ranked[starts], ranked[ends], [0, n - 1]]))
+
+
+METHODS = {
+    'lttb': lttb_indices,
+    'minmax': minmax_indices,
+}
+
+
+def downsample_records(records, max_points, metrics, method='lttb', keep=None):
+    """
+    Downsample health data records for charting
+
+    Each metric with data gets an equal share of ``max_points`` and is
+    downsampled over the records where it is present; the union of the
+    selected records is returned in the original order. Records flagged ``is_anomaly`` and records
+    whose index is in ``keep`` are always kept, so anomaly markers stay exact.
+
+    Args:
+        records (list): Health data dictionaries with an ISO 'date'
+        max_points (int): Target number of points
+        metrics (list): Metrics the client charts
+        method (str): 'lttb' or 'minmax'
+        keep (set): Extra record indices that must be kept
+
+    Returns:
+        list: The selected records
+    """
+    if max_points is None or len(records) <= max_points:
+        return records
+    if method not in METHODS:
+        raise ValueError(f'Unknown downsampling method: {method}')
+
+    select = METHODS[method]
+    timestamps = np.array([datetime.fromisoformat(record['date']).timestamp() for record in records])
+    order = np.argsort(timestamps, kind='stable')
+
+    selected = set(keep or ())
+    selected.update(i for i, record in enumerate(records) if record.get('is_anomaly'))
+
+    series = {}
+    for metric in metrics:
+        values = np.array([records[i].get(metric) for i in order], dtype=float)
+        if not np.isnan(values).all():
+            series[metric] = values
+
+    # Split the budget between the metrics that actually have data
+    per_metric = max(3, max_points // max(1, len(series)))
+    for values in series.values():
+        present = ~np.isnan(values)
+        chosen = select(timestamps[order[present]], values[present], per_metric)
+        selected.update(order[present][chosen].tolist())
+
+    return [records[i] for i in sorted(selected)]
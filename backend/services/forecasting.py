@@ -0,0 +1,260 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ForecastEngine:
+    """
+    Base class for forecasting engines
+
+    Engines work on a plain 1-D array of observations ordered oldest first and
+    treat every observation as one step, matching how the weight prediction
+    has always been produced.
+    """
+
+    name = None
+
+    # Rough cost model used by automatic engine selection: fixed overhead plus
+    # a per-observation term, both in milliseconds.
+    base_latency_ms = 0.0
+    per_point_latency_ms = 0.0
+
+    # Minimum number of observations the engine needs to fit
+    min_points = 2
+
+    def fit(self, values):
+        """
+        Fit the engine to a series
+
+        Args:
+            values (np.ndarray): Observations, oldest first
+
+        Returns:
+            ForecastEngine: The fitted engine
+        """
+        raise NotImplementedError
+
+    def forecast(self, steps):
+        """
+        Forecast future values
+
+        Args:
+            steps (int): Number of steps to forecast
+
+        Returns:
+            np.ndarray: Forecasted values
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def expected_latency_ms(cls, n):
+        return cls.base_latency_ms + cls.per_point_latency_ms * n
+
+
+class HoltEngine(ForecastEngine):
+    """
+    Holt's linear (additive trend) or exponential (multiplicative trend) smoothing
+
+    The smoothing parameters are chosen by minimising the one-step-ahead squared
+    error over a grid of (alpha, beta) pairs. The recursion runs once over the
+    series with every grid candidate updated together as a NumPy vector, so a
+    fit costs O(n) vector operations rather than O(n * grid) Python iterations.
+    """
+
+    name = 'holt'
+    base_latency_ms = 0.1
+    per_point_latency_ms = 0.01
+    min_points = 3
+
+    ALPHAS = np.linspace(0.05, 0.95, 19)
+    BETAS = np.array([0.0, 0.01, 0.05, 0.1, 0.2, 0.3, 0.5])
+
+    def __init__(self, trend='linear'):
+        if trend not in ('linear', 'exponential'):
+            raise ValueError(f'Unknown Holt trend type: {trend}')
+        self.trend = trend
+        self.alpha = None
+        self.beta = None
+        self.level = None
+        self.slope = None
+        self.sse = None
+
+    def fit(self, values):
+        y = np.asarray(values, dtype=float)
+        if len(y) < self.min_points:
+            raise ValueError(f'Holt smoothing needs at least {self.min_points} observations')
+
+        multiplicative = self.trend == 'exponential'
+        if multiplicative and np.any(y <= 0):
+            raise ValueError('Exponential trend requires strictly positive observations')
+
+        alpha, beta = np.meshgrid(self.ALPHAS, self.BETAS, indexing='ij')
+        alpha = alpha.ravel()
+        beta = beta.ravel()
+
+        level = np.full(alpha.shape, y[0])
+        if multiplicative:
+            slope = np.full(alpha.shape, y[1] / y[0])
+        else:
+            slope = np.full(alpha.shape, y[1] - y[0])
+        sse = np.zeros(alpha.shape)
+
+        for observation in y[1:]:
+            predicted = level * slope if multiplicative else level + slope
+            sse += (observation - predicted) ** 2
+            previous_level = level
+            level = alpha * observation + (1 - alpha) * predicted
+            if multiplicative:
+                slope = beta * (level / previous_level) + (1 - beta) * slope
+            else:
+                slope = beta * (level - previous_level) + (1 - beta) * slope
+
+        best = int(np.argmin(sse))
+        self.alpha = float(alpha[best])
+        self.beta = float(beta[best])
+        self.level = float(level[best])
+        self.slope = float(slope[best])
+        self.sse = float(sse[best])
+        return self
+
+    def forecast(self, steps):
+        horizon = np.arange(1, steps + 1, dtype=float)
+        if self.trend == 'exponential':
+            return self.level * self.slope ** horizon
+        return self.level + self.slope * horizon
+
+
+class RobustTrendEngine(ForecastEngine):
+    """
+    Theil-Sen linear trend: median of pairwise slopes, median intercept
+
+    Outlier weigh-ins (wrong person on the scale, clothes on) barely move the
+    fit. Only the most recent ``window`` observations are used so the pairwise
+    slope matrix stays small.
+    """
+
+    name = 'robust_trend'
+    base_latency_ms = 0.05
+    per_point_latency_ms = 0.001
+    min_points = 2
+
+    def __init__(self, window=90):
+        self.window = window
+        self.slope = None
+        self.intercept = None
+        self.n = None
+
+    def fit(self, values):
+        y = np.asarray(values, dtype=float)[-self.window:]
+        if len(y) < self.min_points:
+            raise ValueError(f'Robust trend needs at least {self.min_points} observations')
+
+        t = np.arange(len(y), dtype=float)
+        i, j = np.triu_indices(len(y), k=1)
+        self.slope = float(np.median((y[j] - y[i]) / (t[j] - t[i])))
+        self.intercept = float(np.median(y - self.slope * t))
+        self.n = len(y)
+        return self
+
+    def forecast(self, steps):
+        t = np.arange(self.n, self.n + steps, dtype=float)
+        return self.intercept + self.slope * t
+
+
+class ArimaEngine(ForecastEngine):
+    """
+    statsmodels ARIMA fitted by maximum likelihood
+
+    Given ``params`` from an earlier fit, the optimizer is skipped and the
+    Kalman filter is simply run over the series with those parameters, which
+    is what statsmodels' ``results.append(..., refit=False)`` does and costs
+    a fraction of a fit. ``start_params`` instead warm-starts a full fit.
+    """
+
+    name = 'arima'
+    # Fitted to the p95 of full fits in benchmarks/forecast_benchmark.py:
+    # ~37-42 ms at 30 points, 40-71 at 365, 79-89 at 730
+    base_latency_ms = 30.0
+    per_point_latency_ms = 0.07
+    min_points = 10
+
+    def __init__(self, order=(5, 1, 0), start_params=None, params=None):
+        self.order = tuple(order)
+        self.start_params = start_params
+        self.params = params
+        self.results = None
+        self.refitted = None
+
+    def fit(self, values):
+        # Imported lazily so the closed-form engines work without statsmodels loaded
+        from statsmodels.tsa.arima.model import ARIMA
+
+        y = np.asarray(values, dtype=float)
+        model = ARIMA(y, order=self.order)
+        if self.params is not None:
+            self.results = model.filter(np.asarray(self.params, dtype=float))
+            self.refitted = False
+        else:
+            start_params = np.asarray(self.start_params, dtype=float) if self.start_params is not None else None
+            self.results = model.fit(start_params=start_params)
+            self.refitted = True
+        return self
+
+    def forecast(self, steps):
+        return np.asarray(self.results.forecast(steps=steps))
+
+
+# Engine name -> (class, default constructor arguments)
+ENGINES = {
+    'holt': (HoltEngine, {'trend': 'linear'}),
+    'holt_exponential': (HoltEngine, {'trend': 'exponential'}),
+    'robust_trend': (RobustTrendEngine, {}),
+    'arima': (ArimaEngine, {}),
+}
+
+# Below this many observations ARIMA is no more accurate than the robust trend
+# on benchmarks/forecast_benchmark.py (seeds 0-3 split either way at 15 and 30
+# points) at ~200x the cost; from 60 points it ties or leads, by 0.02-0.035 kg
+# MAE averaged over those seeds at 60, 90, 180 and 365 points. Holt is never
+# selected automatically: the robust trend beats it at every length.
+ARIMA_MIN_POINTS = 60
+
+
+def select_engine(n, latency_budget_ms):
+    """
+    Choose an engine for a series of ``n`` observations
+
+    Args:
+        n (int): Number of observations
+        latency_budget_ms (float): Time the caller is willing to spend fitting
+
+    Returns:
+        str: Engine name
+    """
+    if n >= ARIMA_MIN_POINTS and ArimaEngine.expected_latency_ms(n) <= latency_budget_ms:
+        return 'arima'
+    return 'robust_trend'
+
+
+def get_engine(name, n=None, latency_budget_ms=None, **kwargs):
+    """
+    Instantiate a forecasting engine by name
+
+    Args:
+        name (str): Engine name or 'auto'
+        n (int): Series length, required for 'auto'
+        latency_budget_ms (float): Latency budget, required for 'auto'
+        **kwargs: Extra keyword arguments passed to the engine constructor
+
+    Returns:
+        ForecastEngine: An unfitted engine
+    """
+    if name == 'auto':
+        name = select_engine(n, latency_budget_ms)
+    if name not in ENGINES:
+        raise ValueError(f'Unknown forecasting engine: {name}')
+    engine_class, defaults = ENGINES[name]
+    return engine_class(**dict(defaults, **kwargs))
+
@@ -0,0 +1,294 @@
+import logging
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from config import (
+    INSIGHT_JOB_TTL_SECONDS, INSIGHT_POOL_START_METHOD, INSIGHT_POOL_WORKERS, INSIGHT_QUEUE_LIMIT
+)
+from services.metrics import collect_phases, record_phase
+
+logger = logging.getLogger(__name__)
+
+_ml_service = None
+
+
+def _init_worker():
+    # One service instance per worker process
+    global _ml_service
+    from services.ml_service import HealthMLService
+    _ml_service = HealthMLService()
+
+
+def _weight_prediction(health_data, days, engine, arima_order, arima_state=None, user_id=None):
+    return _ml_service.predict_weight(health_data, days, engine, arima_order, arima_state, user_id)
+
+
+def _anomaly_detection(health_data, metric, detector=None, user_id=None):
+    return _ml_service.detect_anomalies(health_data, metric, detector, user_id)
+
+
+def _recommendations(user_data, health_data):
+    return _ml_service.get_health_recommendations(user_data, health_data)
+
+
+def _dashboard(user_data, health_data, anomaly_metrics, prediction_args):
+    """Every model fit the dashboard needs, as one job"""
+    anomalies = {metric: _ml_service.detect_anomalies(health_data, metric) for metric in anomaly_metrics}
+    prediction = _ml_service.predict_weight(health_data, *prediction_args) if prediction_args else None
+    return {
+        'anomalies': anomalies,
+        'prediction': prediction,
+        'recommendations': _ml_service.get_health_recommendations(user_data, health_data)
+    }
+
+
+def _arima_order_search(values):
+    from services.arima_tuner import select_arima_order
+    return select_arima_order(values)
+
+
+# Job type -> function executed in a pool worker
+TASKS = {
+    'weight_prediction': _weight_prediction,
+    'anomaly_detection': _anomaly_detection,
+    'recommendations': _recommendations,
+    'dashboard': _dashboard,
+    'arima_order_search': _arima_order_search,
+}
+
+
+def _run_task(kind, args):
+    """Run a task; returns (result, phase timings), since a pool worker has no request to record them on"""
+    if _ml_service is None:
+        _init_worker()
+    with collect_phases() as phases:
+        result = TASKS[kind](*args)
+    return result, phases
+
+
+class QueueFullError(Exception):
+    """Raised when the insight pool already has INSIGHT_QUEUE_LIMIT unfinished jobs"""
+
+
+class InsightJobFailed(Exception):
+    """Raised by InsightJobQueue.run when the task raised or its worker process died"""
+
+
+class InsightJob:
+    def __init__(self, kind, user_id, future):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.user_id = user_id
+        self.future = future
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return 'running' if self.future.running() else 'queued'
+        if self.future.cancelled() or self.future.exception() is not None:
+            return 'failed'
+        return 'succeeded'
+
+    def to_dict(self):
+        status = self.status
+        data = {
+            'job_id': self.id,
+            'type': self.kind,
+            'status': status,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+        if status == 'succeeded':
+            data['result'] = self.future.result()[0]
+        elif status == 'failed':
+            data['error'] = self.error()
+        return data
+
+    def error(self):
+        if self.future.cancelled():
+            return 'Job cancelled'
+        exception = self.future.exception()
+        if isinstance(exception, BrokenProcessPool):
+            return 'Insight worker process died'
+        return str(exception)
+
+
+class _InlineFuture:
+    """Already-completed future, used when INSIGHT_POOL_WORKERS is 0"""
+
+    def __init__(self, fn, *args):
+        self._result = self._exception = None
+        try:
+            self._result = fn(*args)
+        except Exception as e:
+            self._exception = e
+
+    def done(self):
+        return True
+
+    def running(self):
+        return False
+
+    def cancelled(self):
+        return False
+
+    def exception(self, timeout=None):
+        return self._exception
+
+    def result(self, timeout=None):
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def add_done_callback(self, fn):
+        fn(self)
+
+
+class InsightJobQueue:
+    """
+    Runs CPU-bound insight computations on a dedicated process pool
+
+    The pool is separate from the web workers, so model fits can't starve
+    CRUD requests, and it admits at most ``queue_limit`` unfinished jobs.
+    Jobs are kept in an in-memory registry for ``job_ttl`` seconds after
+    they finish; the registry is per web process, so clients must poll the
+    process that accepted the job (e.g. with sticky sessions).
+    """
+
+    def __init__(self, workers=INSIGHT_POOL_WORKERS, queue_limit=INSIGHT_QUEUE_LIMIT,
+                 job_ttl=INSIGHT_JOB_TTL_SECONDS, start_method=INSIGHT_POOL_START_METHOD):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.job_ttl = job_ttl
+        self.start_method = start_method
+        self._executor = None
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(self.start_method),
+                initializer=_init_worker
+            )
+        return self._executor
+
+    def submit(self, kind, user_id, *args):
+        """
+        Enqueue a job
+
+        Args:
+            kind (str): Job type, a key of TASKS
+            user_id (int): Internal id of the user the job belongs to
+            *args: Arguments for the task; must be picklable
+
+        Returns:
+            InsightJob: The queued job
+
+        Raises:
+            QueueFullError: If the queue limit is reached
+        """
+        if kind not in TASKS:
+            raise ValueError(f'Unknown job type: {kind}')
+
+        with self._lock:
+            self._purge_expired()
+            if self._pending >= self.queue_limit:
+                raise QueueFullError(f'Insight queue is full ({self.queue_limit} jobs)')
+            self._pending += 1
+            executor = future = None
+            if self.workers > 0:
+                try:
+                    executor, future = self._submit_to_pool(kind, args)
+                except Exception:
+                    self._pending -= 1
+                    raise
+
+        if future is None:
+            future = _InlineFuture(_run_task, kind, args)
+        job = InsightJob(kind, user_id, future)
+        with self._lock:
+            self._jobs[job.id] = job
+        future.add_done_callback(lambda _: self._finished(job, executor))
+        return job
+
+    def _submit_to_pool(self, kind, args):
+        """Submit to the pool, replacing it once if a worker died since the last job; call with the lock held"""
+        try:
+            executor = self._get_executor()
+            return executor, executor.submit(_run_task, kind, args)
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            executor = self._get_executor()
+            return executor, executor.submit(_run_task, kind, args)
+
+    def _discard_executor(self, executor):
+        # A pool with a dead worker rejects every later job, so start a new one
+        if executor is not None and self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            logger.error('Insight pool broken by a dead worker; starting a new one')
+
+    def _finished(self, job, executor):
+        with self._lock:
+            job.finished_at = datetime.utcnow()
+            self._pending -= 1
+            if not job.future.cancelled() and isinstance(job.future.exception(), BrokenProcessPool):
+                self._discard_executor(executor)
+        if job.status == 'failed':
+            logger.error(f"Insight job {job.id} ({job.kind}) failed: {job.error()}")
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def run(self, kind, user_id, *args, timeout=None):
+        """
+        Enqueue a job and wait for its result
+
+        The task's phase timings are recorded on the current request.
+
+        Returns:
+            tuple: (InsightJob, result, timed_out); if the wait timed out the
+                result is None and the job keeps running and can be polled
+
+        Raises:
+            QueueFullError: If the queue limit is reached
+            InsightJobFailed: If the task raised or its worker died
+        """
+        job = self.submit(kind, user_id, *args)
+        try:
+            result, phases = job.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            return job, None, True
+        except Exception:
+            raise InsightJobFailed(job.error())
+
+        for phase, (duration, count) in phases.items():
+            record_phase(phase, duration, count)
+        return job, result, False
+
+    def _purge_expired(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.job_ttl)
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+job_queue = InsightJobQueue()
@@ -0,0 +1,173 @@
+import logging
+import threading
+
+from sqlalchemy import event, select
+from sqlalchemy.exc import IntegrityError
+
+from config import METRIC_STORE_ENABLED
+from models.health_data import HealthData
+from models.metric_series import Metric, MetricValue
+
+logger = logging.getLogger(__name__)
+
+# Units of the HealthData metric columns, registered on first use
+METRIC_UNITS = {
+    'weight': 'kg',
+    'bmi': None,
+    'body_fat': '%',
+    'muscle_mass': 'kg',
+    'water': '%',
+    'visceral_fat': None,
+    'bone_mass': 'kg',
+    'basal_metabolism': 'kcal',
+    'protein': '%',
+    'calories_consumed': 'kcal',
+    'calories_burned': 'kcal',
+    'steps': None,
+    'sleep_hours': 'h',
+    'water_intake': 'l',
+}
+
+_metric_ids = {}
+_metric_ids_lock = threading.Lock()
+
+metrics_table = Metric.__table__
+values_table = MetricValue.__table__
+
+
+def is_enabled():
+    return METRIC_STORE_ENABLED
+
+
+def register_metric(connection, name, unit=None):
+    """
+    Get a metric's id, adding it to the registry if it is new
+
+    Args:
+        connection: SQLAlchemy connection (or session)
+        name (str): Metric name
+        unit (str): Unit, stored only when the metric is created
+
+    Returns:
+        int: Metric id
+    """
+    with _metric_ids_lock:
+        if name in _metric_ids:
+            return _metric_ids[name]
+
+    metric_id = connection.execute(select(metrics_table.c.id).where(metrics_table.c.name == name)).scalar()
+    if metric_id is None:
+        try:
+            # Savepoint, so losing a registration race doesn't abort the caller's transaction
+            with connection.begin_nested():
+                connection.execute(metrics_table.insert().values(name=name, unit=unit))
+        except IntegrityError:
+            pass
+        metric_id = connection.execute(select(metrics_table.c.id).where(metrics_table.c.name == name)).scalar()
+
+    with _metric_ids_lock:
+        _metric_ids[name] = metric_id
+    return metric_id
+
+
+def metric_id_for(connection, name):
+    """Registry id of a HealthData metric column"""
+    return register_metric(connection, name, METRIC_UNITS.get(name))
+
+
+def rows_for_entry(connection, entry):
+    """Long-format rows for the non-null metrics of a HealthData entry"""
+    return [
+        {
+            'user_id': entry.user_id,
+            'metric_id': metric_id_for(connection, metric),
+            'ts': entry.date,
+            'health_data_id': entry.id,
+            'value': float(getattr(entry, metric))
+        }
+        for metric in HealthData.METRICS
+        if getattr(entry, metric) is not None
+    ]
+
+
+def sync_entry(connection, entry):
+    """Replace the long-format rows copied from one HealthData entry"""
+    connection.execute(values_table.delete().where(values_table.c.health_data_id == entry.id))
+    rows = rows_for_entry(connection, entry)
+    if rows:
+        connection.execute(values_table.insert(), rows)
+
+
+# Keep metric_values in sync with every ORM write to HealthData. Bulk
+# operations (Query.delete, bulk_insert_mappings) bypass these hooks; run
+# jobs/backfill_metric_values.py after using them.
+@event.listens_for(HealthData, 'after_insert')
+def _after_insert(mapper, connection, entry):
+    if is_enabled():
+        rows = rows_for_entry(connection, entry)
+        if rows:
+            connection.execute(values_table.insert(), rows)
+
+
+@event.listens_for(HealthData, 'after_update')
+def _after_update(mapper, connection, entry):
+    if is_enabled():
+        sync_entry(connection, entry)
+
+
+@event.listens_for(HealthData, 'after_delete')
+def _after_delete(mapper, connection, entry):
+    if is_enabled():
+        connection.execute(values_table.delete().where(values_table.c.health_data_id == entry.id))
+
+
+def read_series(session, user_id, metric, start=None, end=None, limit=None, newest_first=False):
+    """
+    Read one metric of one user as a primary-key range scan
+
+    Args:
+        session: SQLAlchemy session
+        user_id (int): Internal user id
+        metric (str): Metric name
+        start (datetime): Inclusive lower bound on ts
+        end (datetime): Inclusive upper bound on ts
+        limit (int): Maximum number of readings
+        newest_first (bool): Order by ts descending
+
+    Returns:
+        list: (health_data_id, ts, value) tuples
+    """
+    with _metric_ids_lock:
+        metric_id = _metric_ids.get(metric)
+    if metric_id is None:
+        metric_id = session.execute(select(metrics_table.c.id).where(metrics_table.c.name == metric)).scalar()
+        if metric_id is None:
+            return []
+
+    query = select(values_table.c.health_data_id, values_table.c.ts, values_table.c.value).where(
+        values_table.c.user_id == user_id,
+        values_table.c.metric_id == metric_id
+    )
+    if start is not None:
+        query = query.where(values_table.c.ts >= start)
+    if end is not None:
+        query = query.where(values_table.c.ts <= end)
+    query = query.order_by(values_table.c.ts.desc() if newest_first else values_table.c.ts)
+    if limit is not None:
+        query = query.limit(limit)
+    return session.execute(query).all()
+
+
+def series_records(session, user_id, metric, **kwargs):
+    """
+    read_series as health data dictionaries carrying only id, date and the metric
+
+    The result can be passed wherever to_dict() output is expected for that metric.
+    """
+    # Values are stored as floats; give integer columns (steps, kcal) back their type
+    column = HealthData.__table__.c.get(metric)
+    cast = int if column is not None and column.type.python_type is int else float
+    return [
+        {'id': health_data_id, 'date': ts.isoformat(), metric: cast(value)}
+        for health_data_id, ts, value in read_series(session, user_id, metric, **kwargs)
+    ]
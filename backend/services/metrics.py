@@ -0,0 +1,285 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import QUERY_BUDGET_ASSERT, QUERY_BUDGET_DEFAULT, SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+
+# Default Prometheus latency buckets (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+# Buckets for SQL statements per request
+STATEMENT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+# Longest statement text written to the slow query log
+SLOW_QUERY_LOG_CHARS = 1000
+
+
+class Histogram:
+    """Minimal thread-safe Prometheus histogram with labels"""
+
+    def __init__(self, name, description, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """
+        Record a single observation
+
+        Args:
+            value (float): Observed value, in seconds for latencies
+            **labels: Label values, one per label name
+        """
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            if index < len(self.buckets):
+                series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        """
+        Render the histogram in the Prometheus text exposition format
+
+        Returns:
+            list: Lines of the exposition output
+        """
+        lines = [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} histogram'
+        ]
+        with self._lock:
+            series = {key: dict(value, counts=list(value['counts'])) for key, value in self._series.items()}
+
+        for key, value in sorted(series.items()):
+            labels = ','.join(f'{name}="{_escape(val)}"' for name, val in zip(self.labelnames, key))
+            prefix = f'{labels},' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, value['counts']):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {value["count"]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {value["sum"]}')
+            lines.append(f'{self.name}_count{{{labels}}} {value["count"]}')
+        return lines
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Per-process registry. Under gunicorn every worker keeps its own histograms,
+# so scrape each worker (or aggregate in Prometheus) to get the full picture.
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'Request latency by endpoint',
+    ['endpoint', 'method', 'status']
+)
+PHASE_LATENCY = Histogram(
+    'http_request_phase_duration_seconds',
+    'Time spent per request phase (db, serialize, ml_*) by endpoint',
+    ['endpoint', 'phase']
+)
+DB_STATEMENTS = Histogram(
+    'http_request_db_statements',
+    'SQL statements executed per request by endpoint',
+    ['endpoint'],
+    buckets=STATEMENT_BUCKETS
+)
+REGISTRY = [REQUEST_LATENCY, PHASE_LATENCY, DB_STATEMENTS]
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in assertion mode when a request executes more statements than its budget"""
+
+
+# Phase timings captured by collect_phases on this thread, instead of the request's
+_collector = threading.local()
+
+
+def record_phase(phase, duration, count=1):
+    """
+    Add a duration to a named phase of the current request
+
+    Args:
+        phase (str): Phase name, used as the Server-Timing metric name
+        duration (float): Duration in seconds
+        count (int): Number of calls the duration covers
+    """
+    timings = getattr(_collector, 'timings', None)
+    if timings is None:
+        if not has_request_context():
+            return
+        timings = g.setdefault('server_timing', {})
+    total, calls = timings.get(phase, (0.0, 0))
+    timings[phase] = (total + duration, calls + count)
+
+
+@contextmanager
+def collect_phases():
+    """
+    Capture the phases recorded in a block instead of attributing them to a request
+
+    Used where work runs without the request's context, e.g. in an insight
+    pool worker; the caller replays them with record_phase.
+
+    Yields:
+        dict: {phase: (total seconds, calls)}, filled as the block runs
+    """
+    previous = getattr(_collector, 'timings', None)
+    _collector.timings = {}
+    try:
+        yield _collector.timings
+    finally:
+        _collector.timings = previous
+
+
+@contextmanager
+def timed(phase):
+    """Time a block of code and attribute it to a phase of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+
+def query_budget(limit):
+    """
+    Decorator that sets the most SQL statements a view may execute per request
+
+    Apply it below @jwt_required and the other view decorators; they copy the
+    budget onto their wrappers. Requests over budget are logged, or raise
+    QueryBudgetExceeded when QUERY_BUDGET_ASSERT is set.
+
+    Args:
+        limit (int): Statement budget
+    """
+    def decorator(func):
+        func.query_budget = limit
+        return func
+    return decorator
+
+
+def _route():
+    """Method and URL rule of the current request, for log lines"""
+    if not has_request_context():
+        return 'outside a request'
+    return f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+
+
+def instrumented(phase):
+    """Decorator that times every call of a function as a request phase"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('query_start_time')
+    if start_times:
+        duration = time.perf_counter() - start_times.pop()
+        record_phase('db', duration)
+        if duration * 1000 >= SLOW_QUERY_MS:
+            logger.warning(f"Slow query ({duration * 1000:.1f} ms) in {_route()}: {statement[:SLOW_QUERY_LOG_CHARS]}")
+
+
+def render_latest():
+    """
+    Render all registered metrics in the Prometheus text format
+
+    Returns:
+        str: Exposition body
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def _format_server_timing(timings, total):
+    entries = []
+    for phase, (duration, count) in timings.items():
+        entries.append(f'{phase};dur={duration * 1000:.2f};desc="{count} call{"s" if count != 1 else ""}"')
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+
+def _check_query_budget(statements):
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None) or current_app.config['QUERY_BUDGET_DEFAULT']
+    if not budget or statements <= budget:
+        return
+
+    message = f"{_route()} executed {statements} SQL statements, over its budget of {budget}"
+    if current_app.config['QUERY_BUDGET_ASSERT']:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+def init_app(app):
+    """
+    Register request hooks that emit Server-Timing headers, feed the histograms
+    and enforce per-endpoint query budgets
+
+    QUERY_BUDGET_DEFAULT and QUERY_BUDGET_ASSERT can be overridden in
+    app.config, e.g. by a test fixture.
+
+    Args:
+        app (Flask): The Flask application
+    """
+    app.config.setdefault('QUERY_BUDGET_DEFAULT', QUERY_BUDGET_DEFAULT)
+    app.config.setdefault('QUERY_BUDGET_ASSERT', QUERY_BUDGET_ASSERT)
+
+    @app.before_request
+    def _start_timer():
+        g.request_start_time = time.perf_counter()
+        g.server_timing = {}
+
+    @app.after_request
+    def _emit_timing(response):
+        start = g.get('request_start_time')
+        if start is None:
+            return response
+
+        total = time.perf_counter() - start
+        timings = g.get('server_timing', {})
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+
+        REQUEST_LATENCY.observe(total, endpoint=endpoint, method=request.method, status=response.status_code)
+        for phase, (duration, _) in timings.items():
+            PHASE_LATENCY.observe(duration, endpoint=endpoint, phase=phase)
+
+        # Statement count of this request, which lazy loads can quietly inflate
+        statements = timings.get('db', (0.0, 0))[1]
+        DB_STATEMENTS.observe(statements, endpoint=endpoint)
+
+        response.headers['Server-Timing'] = _format_server_timing(timings, total)
+        _check_query_budget(statements)
+        return response
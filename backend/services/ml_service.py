@@ -1,25 +1,60 @@
 import numpy as np
 import pandas as pd
-from statsmodels.tsa.arima.model import ARIMA
-from sklearn.ensemble import IsolationForest
-import pickle
+import hashlib
 import os
 import logging
 from datetime import datetime, timedelta
 
+from config import (
+    ANOMALY_DETECTION_MODEL, ANOMALY_DETECTOR, ARIMA_DEFAULT_ORDER, ARIMA_REFIT_MAX_AGE_DAYS,
+    ARIMA_REFIT_MIN_NEW_POINTS, FORECAST_LATENCY_BUDGET_MS, WEIGHT_PREDICTION_MODEL
+)
+from services.anomaly_detectors import IsolationForestDetector, get_detector
+from services.forecasting import get_engine, select_engine
+from services.metrics import instrumented
+from services.model_store import CompactArima, CompactIsolationForest
+from services.recommendations import (
+    FEATURES, evaluate_rules, features_from_records, rule_ids, to_recommendations, trend_name
+)
+
 logger = logging.getLogger(__name__)
 MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ml', 'models')
 os.makedirs(MODEL_DIR, exist_ok=True)
 
 class HealthMLService:
-    def __init__(self):
-        """Initialize the Health ML Service"""
-        self.weight_model_path = os.path.join(MODEL_DIR, 'weight_prediction.pkl')
-        self.anomaly_model_path = os.path.join(MODEL_DIR, 'anomaly_detection.pkl')
+    def __init__(self, persist_models=True):
+        """
+        Initialize the Health ML Service
+        
+        Args:
+            persist_models (bool): Save fitted models to MODEL_DIR; batch
+                workers fitting many users turn this off
+        """
+        self.persist_models = persist_models
+    
+    @staticmethod
+    def _model_path(user_id, name):
+        """A user's compact model file (see services/model_store.py), without extension"""
+        return os.path.join(MODEL_DIR, f'user_{user_id}', name)
+    
+    @staticmethod
+    def _series_fingerprint(df, metric):
+        """Identifies a series, so a model is only reused for the data it was fitted on"""
+        digest = hashlib.sha1(df.index.asi8.tobytes())
+        digest.update(df[metric].to_numpy(dtype=float).tobytes())
+        return digest.hexdigest()
+    
+    def load_models(self, user_id, metric='weight'):
+        """
+        Load a user's last saved models as memory-mapped arrays
         
-        # Initialize models to None - they'll be loaded or trained when needed
-        self.weight_model = None
-        self.anomaly_model = None
+        Returns:
+            tuple: (CompactArima or None, CompactIsolationForest or None)
+        """
+        return (
+            CompactArima.load(self._model_path(user_id, WEIGHT_PREDICTION_MODEL)),
+            CompactIsolationForest.load(self._model_path(user_id, f'{ANOMALY_DETECTION_MODEL}_{metric}'))
+        )
     
     def _prepare_time_series_data(self, health_data, metric='weight'):
         """
@@ -49,16 +84,56 @@ class HealthMLService:
             logger.warning(f"Metric {metric} not found in health data")
             return pd.DataFrame()
     
-    def predict_weight(self, health_data, days=30):
+    @staticmethod
+    def _arima_fit_plan(arima_state, order, n_observations):
+        """
+        Decide how to maintain a user's ARIMA fit
+        
+        Args:
+            arima_state (dict): Stored fit state (see predict_weight), or None
+            order (tuple): (p, d, q) order to fit
+            n_observations (int): Current number of weigh-ins
+            
+        Returns:
+            tuple: (start_params, params) for ArimaEngine; params set means
+                filter only, start_params set means a warm-started refit
+        """
+        if not arima_state or tuple(arima_state.get('order') or ()) != tuple(order):
+            return None, None
+        stored = arima_state['params']
+        if arima_state.get('refit'):
+            return stored, None
+        
+        new_points = n_observations - arima_state.get('n_fit', 0)
+        fitted_at = datetime.fromisoformat(arima_state['fitted_at'])
+        if 0 <= new_points < ARIMA_REFIT_MIN_NEW_POINTS and datetime.utcnow() - fitted_at < timedelta(days=ARIMA_REFIT_MAX_AGE_DAYS):
+            return None, stored
+        return stored, None
+    
+    @instrumented('ml_predict_weight')
+    def predict_weight(self, health_data, days=30, engine='auto', arima_order=None, arima_state=None, user_id=None):
         """
         Predict future weight based on historical data
         
         Args:
             health_data (list): List of health data records
             days (int): Number of days to predict
+            engine (str): Forecasting engine name, or 'auto' to choose one from
+                the series length and the configured latency budget
+            arima_order (tuple): Tuned (p, d, q) order for the ARIMA engine;
+                the configured default order is used when not provided
+            arima_state (dict): The user's last ARIMA fit, {'order', 'params',
+                'n_fit', 'fitted_at'}, plus 'refit': True to force a full fit.
+                New weigh-ins are filtered with the stored parameters until
+                ARIMA_REFIT_MIN_NEW_POINTS arrive or the fit is
+                ARIMA_REFIT_MAX_AGE_DAYS old; refits start from them.
+            user_id (int): Owner of a full-history series. An ARIMA forecast
+                then reuses the user's compact model when the series hasn't
+                changed since it was saved, and saves it after a fit.
             
         Returns:
-            dict: Prediction results
+            dict: Prediction results; ARIMA results carry the updated fit
+                state under 'arima_state' for the caller to store
         """
         # Prepare data
         df = self._prepare_time_series_data(health_data, 'weight')
@@ -69,34 +144,41 @@ class HealthMLService:
             }
         
         try:
-            # Train ARIMA model
-            model = ARIMA(df, order=(5,1,0))  # Parameters can be optimized
-            model_fit = model.fit()
+            values = df['weight'].to_numpy(dtype=float)
             
-            # Save the model
-            with open(self.weight_model_path, 'wb') as f:
-                pickle.dump(model_fit, f)
+            # Resolve and fit the forecasting engine
+            if engine == 'auto':
+                engine = select_engine(len(values), FORECAST_LATENCY_BUDGET_MS)
+            if engine == 'arima':
+                order = tuple(arima_order or ARIMA_DEFAULT_ORDER)
+                fingerprint = self._series_fingerprint(df, 'weight') if user_id is not None else None
+                model = CompactArima.load(self._model_path(user_id, WEIGHT_PREDICTION_MODEL)) if fingerprint else None
+                if model is not None and model.fitted_on == fingerprint and model.order == order:
+                    # Nothing changed since the last fit: forecast from the saved arrays
+                    return self._prediction_result(engine, values, model.forecast(days), arima_order=order)
+                start_params, params = self._arima_fit_plan(arima_state, order, len(values))
+                forecaster = get_engine(engine, order=order, start_params=start_params, params=params)
+            else:
+                forecaster = get_engine(engine)
+            forecaster.fit(values)
             
-            # Generate forecast
-            forecast = model_fit.forecast(steps=days)
+            # Save the model (coefficients and recursion state only)
+            if engine == 'arima' and fingerprint and self.persist_models:
+                model = CompactArima.from_results(forecaster.results, values, forecaster.order)
+                model.fitted_on = fingerprint
+                model.save(self._model_path(user_id, WEIGHT_PREDICTION_MODEL))
             
-            # Prepare result
-            dates = [datetime.now() + timedelta(days=i) for i in range(1, days+1)]
-            predictions = [
-                {
-                    'date': date.isoformat(),
-                    'weight': float(weight)
+            result = self._prediction_result(
+                engine, values, forecaster.forecast(days), arima_order=forecaster.order if engine == 'arima' else None
+            )
+            if engine == 'arima':
+                result['arima_state'] = {
+                    'order': list(forecaster.order),
+                    'params': [float(param) for param in forecaster.results.params],
+                    'n_fit': len(values) if forecaster.refitted else arima_state['n_fit'],
+                    'fitted_at': datetime.utcnow().isoformat() if forecaster.refitted else arima_state['fitted_at']
                 }
-                for date, weight in zip(dates, forecast)
-            ]
-            
-            return {
-                'success': True,
-                'predictions': predictions,
-                'current_weight': float(df['weight'].iloc[-1]),
-                'prediction_end_weight': float(forecast[-1]),
-                'weight_change': float(forecast[-1] - df['weight'].iloc[-1])
-            }
+            return result
         except Exception as e:
             logger.error(f"Error in weight prediction: {e}")
             return {
@@ -104,54 +186,95 @@ class HealthMLService:
                 'error': str(e)
             }
     
-    def detect_anomalies(self, health_data, metric='weight'):
+    @staticmethod
+    def _prediction_result(engine, values, forecast, arima_order=None):
+        """Prediction response for a forecast starting tomorrow"""
+        dates = [datetime.now() + timedelta(days=i) for i in range(1, len(forecast) + 1)]
+        predictions = [
+            {
+                'date': date.isoformat(),
+                'weight': float(weight)
+            }
+            for date, weight in zip(dates, forecast)
+        ]
+        
+        result = {
+            'success': True,
+            'engine': engine,
+            'predictions': predictions,
+            'current_weight': float(values[-1]),
+            'prediction_end_weight': float(forecast[-1]),
+            'weight_change': float(forecast[-1] - values[-1])
+        }
+        if arima_order is not None:
+            result['arima_order'] = list(arima_order)
+        return result
+    
+    @instrumented('ml_detect_anomalies')
+    def detect_anomalies(self, health_data, metric='weight', detector=None, user_id=None):
         """
         Detect anomalies in health metrics
         
         Args:
             health_data (list): List of health data records
             metric (str): The metric to analyze
+            detector (str): Detector name (see services/anomaly_detectors.py);
+                defaults to ANOMALY_DETECTOR
+            user_id (int): Owner of a full-history series. The isolation
+                forest then rescores with the user's compact forest when the
+                series hasn't changed since it was saved, and saves it after a fit.
             
         Returns:
             dict: Anomaly detection results
         """
+        detector = get_detector(detector or ANOMALY_DETECTOR)
+        
         # Prepare data
         df = self._prepare_time_series_data(health_data, metric)
-        if df.empty or len(df) < 10:
+        if df.empty or len(df) < detector.min_points:
             return {
                 'success': False,
                 'error': f'Insufficient data for {metric} anomaly detection'
             }
         
         try:
-            # Train isolation forest model
-            model = IsolationForest(contamination=0.05)  # Expect 5% anomalies
-            df['anomaly'] = model.fit_predict(df)
-            
-            # Save the model
-            with open(self.anomaly_model_path, 'wb') as f:
-                pickle.dump(model, f)
-            
-            # Find anomalies (marked as -1 by isolation forest)
-            anomalies = df[df['anomaly'] == -1]
+            values = df[metric].to_numpy(dtype=float)
+            forest = isinstance(detector, IsolationForestDetector) and user_id is not None
+            fingerprint = self._series_fingerprint(df, metric) if forest else None
+            model = CompactIsolationForest.load(self._model_path(user_id, f'{ANOMALY_DETECTION_MODEL}_{metric}')) if forest else None
+            if model is not None and model.fitted_on == fingerprint:
+                # Nothing changed since the last fit: score with the saved trees
+                x = values.reshape(-1, 1)
+                flags, scores = model.predict(x) == -1, -model.score_samples(x)
+            else:
+                flags, scores = detector.detect(values, df.index)
+                
+                # Save the model (tree arrays only)
+                if forest and self.persist_models:
+                    model = CompactIsolationForest.from_estimator(detector.estimator)
+                    model.fitted_on = fingerprint
+                    model.save(self._model_path(user_id, f'{ANOMALY_DETECTION_MODEL}_{metric}'))
             
             # Prepare result
+            mean, std = values.mean(), df[metric].std()
             anomaly_points = [
                 {
-                    'date': index.isoformat(),
-                    metric: float(row[metric]),
-                    'deviation': abs(float(row[metric] - df[metric].mean()) / df[metric].std())
+                    'date': df.index[i].isoformat(),
+                    metric: float(values[i]),
+                    'deviation': abs(float(values[i] - mean) / std),
+                    'score': float(scores[i])
                 }
-                for index, row in anomalies.iterrows()
+                for i in np.flatnonzero(flags)
             ]
             
             return {
                 'success': True,
+                'detector': detector.name,
                 'anomalies': anomaly_points,
                 'anomaly_count': len(anomaly_points),
                 'total_records': len(df),
-                'metric_mean': float(df[metric].mean()),
-                'metric_std': float(df[metric].std())
+                'metric_mean': float(mean),
+                'metric_std': float(std)
             }
         except Exception as e:
             logger.error(f"Error in anomaly detection: {e}")
@@ -160,6 +283,7 @@ class HealthMLService:
                 'error': str(e)
             }
     
+    @instrumented('ml_get_health_recommendations')
     def get_health_recommendations(self, user_data, health_data):
         """
         Generate personalized health recommendations
@@ -172,98 +296,24 @@ class HealthMLService:
             dict: Health recommendations
         """
         try:
-            # Prepare data
-            weight_df = self._prepare_time_series_data(health_data, 'weight')
-            if weight_df.empty:
+            # Need at least one weigh-in
+            if not any(record.get('weight') is not None for record in health_data):
                 return {
                     'success': False,
                     'error': 'Insufficient health data for recommendations'
                 }
             
-            # Get most recent metrics
-            recent_health = health_data[0] if health_data else {}
-            
-            # Calculate BMI if we have weight and height
-            bmi = None
-            if recent_health.get('weight') and user_data.get('height'):
-                height_m = user_data.get('height') / 100  # cm to m
-                bmi = recent_health.get('weight') / (height_m * height_m)
-            
-            # Weight trend analysis
-            weight_trend = None
-            if len(weight_df) >= 3:
-                recent_weights = weight_df['weight'].values[-3:]
-                if recent_weights[2] > recent_weights[0]:
-                    weight_trend = 'increasing'
-                elif recent_weights[2] < recent_weights[0]:
-                    weight_trend = 'decreasing'
-                else:
-                    weight_trend = 'stable'
-            
-            # Generate recommendations
-            recommendations = []
-            
-            # BMI-based recommendations
-            if bmi:
-                if bmi < 18.5:
-                    recommendations.append({
-                        'category': 'nutrition',
-                        'title': 'Increase Caloric Intake',
-                        'description': 'Your BMI is below the healthy range. Consider increasing your daily caloric intake with nutrient-dense foods.'
-                    })
-                elif bmi >= 25:
-                    recommendations.append({
-                        'category': 'exercise',
-                        'title': 'Increase Physical Activity',
-                        'description': 'Your BMI indicates you may benefit from increased physical activity. Aim for at least 150 minutes of moderate exercise per week.'
-                    })
-                    recommendations.append({
-                        'category': 'nutrition',
-                        'title': 'Monitor Caloric Intake',
-                        'description': 'Consider tracking your daily caloric intake to maintain a slight deficit for healthy weight loss.'
-                    })
-            
-            # Body composition recommendations
-            if recent_health.get('body_fat') and recent_health.get('body_fat') > 25:
-                recommendations.append({
-                    'category': 'exercise',
-                    'title': 'Strength Training',
-                    'description': 'Your body fat percentage may benefit from regular strength training. Aim for 2-3 sessions per week.'
-                })
-            
-            if recent_health.get('muscle_mass') and recent_health.get('muscle_mass') < 30:
-                recommendations.append({
-                    'category': 'nutrition',
-                    'title': 'Protein Intake',
-                    'description': 'Consider increasing your protein intake to support muscle development. Aim for 1.6-2.2g per kg of body weight.'
-                })
-            
-            # Weight trend recommendations
-            if weight_trend == 'increasing':
-                recommendations.append({
-                    'category': 'lifestyle',
-                    'title': 'Weight Management',
-                    'description': 'Your weight has been increasing. Consider reviewing your diet and activity levels.'
-                })
-            elif weight_trend == 'decreasing' and bmi and bmi < 20:
-                recommendations.append({
-                    'category': 'nutrition',
-                    'title': 'Healthy Weight Maintenance',
-                    'description': 'Your weight has been decreasing. Ensure you\'re maintaining adequate nutrition for your activity level.'
-                })
+            # Evaluate the rule table on this user's feature row
+            features = features_from_records(user_data, health_data)
+            fired = evaluate_rules(features)[0]
             
-            # Water intake
-            recommendations.append({
-                'category': 'hydration',
-                'title': 'Stay Hydrated',
-                'description': 'Remember to drink at least 2 liters of water daily for optimal health.'
-            })
+            bmi = features[0, FEATURES.index('bmi')]
             
             return {
                 'success': True,
-                'recommendations': recommendations,
-                'bmi': bmi,
-                'weight_trend': weight_trend
+                'recommendations': to_recommendations(rule_ids(fired)),
+                'bmi': None if np.isnan(bmi) else float(bmi),
+                'weight_trend': trend_name(features[0, FEATURES.index('weight_trend')])
             }
         except Exception as e:
             logger.error(f"Error generating health recommendations: {e}")
@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+EULER_GAMMA = 0.5772156649015329
+
+
+def save_model(path, kind, arrays, meta=None):
+    """
+    Atomically write a model as plain NumPy arrays plus a JSON manifest
+
+    Layout for ``path`` = 'ml/models/user_42/weight_prediction':
+
+        weight_prediction.json            manifest: kind, meta, array names, data directory
+        weight_prediction.<version>/      one .npy file per array
+
+    The arrays go to a fresh versioned directory, which is then published by
+    os.replace() of the manifest. Readers either see the previous version or
+    the new one, never a partial write; the previous directory is removed
+    afterwards (open memory maps of it stay valid on POSIX).
+
+    Args:
+        path (str): Model path without extension
+        kind (str): Model kind, checked on load
+        arrays (dict): Name -> np.ndarray
+        meta (dict): Small JSON-serializable metadata
+    """
+    directory, name = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+
+    version = uuid.uuid4().hex[:12]
+    data_dir = f'{name}.{version}'
+    staging = tempfile.mkdtemp(prefix=f'.{name}.', dir=directory)
+    try:
+        for array_name, array in arrays.items():
+            np.save(os.path.join(staging, f'{array_name}.npy'), np.ascontiguousarray(array))
+        os.rename(staging, os.path.join(directory, data_dir))
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    manifest_path = f'{path}.json'
+    previous = _read_manifest(manifest_path)
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'kind': kind,
+        'meta': meta or {},
+        'data_dir': data_dir,
+        'arrays': sorted(arrays)
+    }
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix='.json', dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+    if previous and previous.get('data_dir') != data_dir:
+        shutil.rmtree(os.path.join(directory, previous['data_dir']), ignore_errors=True)
+
+
+def load_model(path, kind, mmap=True):
+    """
+    Load a model written by save_model
+
+    Args:
+        path (str): Model path without extension
+        kind (str): Expected model kind
+        mmap (bool): Memory-map the arrays read-only instead of reading them
+
+    Returns:
+        tuple: (dict of arrays, meta dict), or (None, None) if no model is stored
+    """
+    manifest = _read_manifest(f'{path}.json')
+    if manifest is None:
+        return None, None
+    if manifest.get('kind') != kind or manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"{path} holds a {manifest.get('kind')} model (format {manifest.get('format_version')}), expected {kind}")
+
+    data_dir = os.path.join(os.path.dirname(path), manifest['data_dir'])
+    arrays = {
+        name: np.load(os.path.join(data_dir, f'{name}.npy'), mmap_mode='r' if mmap else None, allow_pickle=False)
+        for name in manifest['arrays']
+    }
+    return arrays, manifest['meta']
+
+
+def _read_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class CompactArima:
+    """
+    ARIMA(p, d, q) forecaster reduced to the arrays forecasting needs
+
+    Holds the AR and MA coefficients, the mean of the differenced series,
+    the last p differenced observations, the last q residuals and the last
+    value of each differencing level. Forecasting is the ARMA recursion
+    followed by re-integration, in NumPy, with no statsmodels objects.
+    """
+
+    KIND = 'arima'
+
+    def __init__(self, order, ar, ma, mean, last_diffed, last_resid, last_levels, fitted_on=None):
+        self.order = tuple(int(x) for x in order)
+        self.ar = np.asarray(ar, dtype=float)
+        self.ma = np.asarray(ma, dtype=float)
+        self.mean = float(mean)
+        self.last_diffed = np.asarray(last_diffed, dtype=float)
+        self.last_resid = np.asarray(last_resid, dtype=float)
+        self.last_levels = np.asarray(last_levels, dtype=float)
+        # Fingerprint of the series the model was fitted on, set by the caller
+        self.fitted_on = fitted_on
+
+    @classmethod
+    def from_results(cls, results, values, order):
+        """
+        Extract the state from fitted statsmodels ARIMA results
+
+        Args:
+            results: statsmodels ARIMAResults
+            values (np.ndarray): The series the model was fitted on
+            order (tuple): (p, d, q)
+        """
+        p, d, q = order
+        y = np.asarray(values, dtype=float)
+        params = dict(zip(results.param_names, np.asarray(results.params)))
+
+        # Last value of y, diff(y), ..., diff(y, d-1): the constants of integration
+        levels = []
+        diffed = y
+        for _ in range(d):
+            levels.append(diffed[-1])
+            diffed = np.diff(diffed)
+
+        resid = np.asarray(results.resid, dtype=float)
+        return cls(
+            order,
+            ar=np.asarray(results.arparams, dtype=float) if p else np.empty(0),
+            ma=np.asarray(results.maparams, dtype=float) if q else np.empty(0),
+            mean=params.get('const', 0.0),
+            last_diffed=diffed[-p:] if p else np.empty(0),
+            last_resid=resid[-q:] if q else np.empty(0),
+            last_levels=np.asarray(levels)
+        )
+
+    def forecast(self, steps):
+        p, d, q = self.order
+
+        # ARMA recursion on the differenced series, future shocks are zero
+        history = list(self.last_diffed - self.mean)
+        shocks = list(self.last_resid)
+        diffed = np.empty(steps)
+        for step in range(steps):
+            value = sum(self.ar[i] * history[-1 - i] for i in range(p))
+            value += sum(self.ma[j] * shocks[-1 - j] for j in range(q) if j < len(shocks))
+            history.append(value)
+            shocks.append(0.0)
+            diffed[step] = value + self.mean
+
+        # Undo the differencing, innermost level first
+        forecast = diffed
+        for level in reversed(self.last_levels):
+            forecast = level + np.cumsum(forecast)
+        return forecast
+
+    def save(self, path):
+        save_model(path, self.KIND, {
+            'ar': self.ar,
+            'ma': self.ma,
+            'last_diffed': self.last_diffed,
+            'last_resid': self.last_resid,
+            'last_levels': self.last_levels
+        }, meta={'order': list(self.order), 'mean': self.mean, 'fitted_on': self.fitted_on})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        arrays, meta = load_model(path, cls.KIND, mmap)
+        if arrays is None:
+            return None
+        return cls(meta['order'], mean=meta['mean'], fitted_on=meta.get('fitted_on'), **arrays)
+
+
+def average_path_length(n_samples):
+    """Expected path length of an unsuccessful BST search among n samples (vectorized)"""
+    n = np.asarray(n_samples, dtype=float)
+    result = np.zeros_like(n)
+    result[n == 2] = 1.0
+    large = n > 2
+    result[large] = 2.0 * (np.log(n[large] - 1.0) + EULER_GAMMA) - 2.0 * (n[large] - 1.0) / n[large]
+    return result
+
+
+class CompactIsolationForest:
+    """
+    A fitted IsolationForest stored as padded per-tree node arrays
+
+    Each tree's nodes are laid out as rows of (n_trees, max_nodes) arrays:
+    children, global feature index, threshold and training samples per
+    node. Scoring walks every sample down every tree at once, one tree level
+    per step, and matches IsolationForest.score_samples.
+    """
+
+    KIND = 'isolation_forest'
+
+    def __init__(self, children_left, children_right, feature, threshold, n_node_samples, max_samples, offset,
+                 fitted_on=None):
+        self.children_left = children_left
+        self.children_right = children_right
+        self.feature = feature
+        self.threshold = threshold
+        self.n_node_samples = n_node_samples
+        self.max_samples = int(max_samples)
+        self.offset = float(offset)
+        self.fitted_on = fitted_on
+
+    @classmethod
+    def from_estimator(cls, model):
+        """
+        Args:
+            model: A fitted sklearn.ensemble.IsolationForest
+        """
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        n_trees = len(trees)
+        max_nodes = max(tree.node_count for tree in trees)
+
+        # Padding nodes are leaves (-1 children) that are never reached
+        children_left = np.full((n_trees, max_nodes), -1, dtype=np.int32)
+        children_right = np.full((n_trees, max_nodes), -1, dtype=np.int32)
+        feature = np.zeros((n_trees, max_nodes), dtype=np.int32)
+        threshold = np.zeros((n_trees, max_nodes), dtype=np.float64)
+        n_node_samples = np.zeros((n_trees, max_nodes), dtype=np.float64)
+
+        for i, (tree, features) in enumerate(zip(trees, model.estimators_features_)):
+            count = tree.node_count
+            children_left[i, :count] = tree.children_left
+            children_right[i, :count] = tree.children_right
+            # Trees index the bootstrap feature subset; store the global column
+            tree_feature = np.asarray(tree.feature)
+            feature[i, :count] = np.where(tree_feature >= 0, np.asarray(features)[np.maximum(tree_feature, 0)], 0)
+            threshold[i, :count] = tree.threshold
+            n_node_samples[i, :count] = tree.n_node_samples
+
+        return cls(children_left, children_right, feature, threshold, n_node_samples,
+                   model.max_samples_, model.offset_)
+
+    def score_samples(self, X):
+        """Same scale as IsolationForest.score_samples: lower is more abnormal"""
+        X = np.asarray(X, dtype=float)
+        n_samples, n_trees = X.shape[0], self.children_left.shape[0]
+        trees = np.arange(n_trees)[np.newaxis, :]
+        rows = np.arange(n_samples)[:, np.newaxis]
+
+        node = np.zeros((n_samples, n_trees), dtype=np.int64)
+        depth = np.zeros((n_samples, n_trees))
+        active = self.children_left[trees, node] != -1
+        while active.any():
+            go_left = X[rows, self.feature[trees, node]] <= self.threshold[trees, node]
+            child = np.where(go_left, self.children_left[trees, node], self.children_right[trees, node])
+            node = np.where(active, child, node)
+            depth += active
+            active = self.children_left[trees, node] != -1
+
+        depth += average_path_length(self.n_node_samples[trees, node])
+        mean_depth = depth.mean(axis=1)
+        return -2.0 ** (-mean_depth / average_path_length([self.max_samples])[0])
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset
+
+    def predict(self, X):
+        """1 for inliers, -1 for outliers"""
+        return np.where(self.decision_function(X) < 0, -1, 1)
+
+    def save(self, path):
+        save_model(path, self.KIND, {
+            'children_left': self.children_left,
+            'children_right': self.children_right,
+            'feature': self.feature,
+            'threshold': self.threshold,
+            'n_node_samples': self.n_node_samples
+        }, meta={'max_samples': self.max_samples, 'offset': self.offset, 'fitted_on': self.fitted_on})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        arrays, meta = load_model(path, cls.KIND, mmap)
+        if arrays is None:
+            return None
+        return cls(max_samples=meta['max_samples'], offset=meta['offset'], fitted_on=meta.get('fitted_on'), **arrays)
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class BinnedCounts:
+    """
+    Counts of values rounded to fixed-width bins
+
+    A mergeable quantile summary that supports exact deletion: a stream that
+    replaces items (e.g. each user's latest reading) removes the old item's
+    count and adds the new one, so no error accumulates however many items
+    were replaced. Ranks and quantiles are exact up to the bin width. Size is
+    the number of occupied bins, which a metric's physical range bounds (a
+    few thousand for weight at 0.1 kg), not the number of items.
+    """
+
+    def __init__(self, width, counts=None):
+        self.width = width
+        self.counts = counts if counts is not None else {}  # bin index -> count
+        self.n = sum(self.counts.values())
+
+    def _bin(self, value):
+        return int(round(float(value) / self.width))
+
+    def add(self, value, count=1):
+        """Add ``count`` items of a value; a negative count removes them"""
+        index = self._bin(value)
+        total = self.counts.get(index, 0) + count
+        if total < 0:
+            raise ValueError(f'Cannot remove {value}: it was not counted')
+        if total:
+            self.counts[index] = total
+        else:
+            self.counts.pop(index, None)
+        self.n += count
+
+    def remove(self, value):
+        self.add(value, -1)
+
+    def merge(self, other):
+        """Fold another summary into this one; returns self"""
+        if other.width != self.width:
+            raise ValueError('Only summaries with the same bin width can be merged')
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.n += other.n
+        return self
+
+    def _items(self):
+        indexes = np.array(sorted(self.counts), dtype=np.int64)
+        counts = np.array([self.counts[index] for index in indexes], dtype=np.int64)
+        return indexes, counts
+
+    def rank(self, value):
+        """Fraction of items <= value"""
+        if self.n <= 0:
+            return None
+        indexes, counts = self._items()
+        below = counts[:np.searchsorted(indexes, self._bin(value), side='right')].sum()
+        return min(1.0, below / self.n)
+
+    def quantiles(self, fractions):
+        """Smallest bin value whose rank reaches each fraction in [0, 1]"""
+        if self.n <= 0:
+            return [None for _ in fractions]
+        indexes, counts = self._items()
+        positions = np.searchsorted(np.cumsum(counts), np.asarray(fractions, dtype=float) * self.n, side='left')
+        return [round(float(indexes[min(position, len(indexes) - 1)]) * self.width, 6) for position in positions]
+
+    def to_dict(self):
+        # JSON object keys are strings
+        return {'width': self.width, 'counts': {str(index): count for index, count in self.counts.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['width'], {int(index): count for index, count in data['counts'].items()})
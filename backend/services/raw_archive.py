@@ -0,0 +1,210 @@
+import copy
+import logging
+import time
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+from pymongo import ASCENDING, UpdateOne
+
+from config import RAW_ARCHIVE_BACKEND, RAW_ARCHIVE_RETRY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_NAME = 'raw_readings'
+
+
+class RawReadingArchive:
+    """
+    Archive of raw device payloads in time-bucketed MongoDB documents
+
+    Each document holds one user's readings for one UTC day:
+
+        {'user_id': 1, 'day': '2024-01-31', 'count': 2,
+         'readings': [{'received_at': datetime, 'source': 'xiaomi', 'payload': {...}}, ...]}
+
+    Writes are batched into unordered bulk upserts that append to the day's
+    bucket, so a day of readings costs one document and one index entry.
+    """
+
+    def __init__(self, collection, update_one=UpdateOne):
+        """
+        Args:
+            collection: A pymongo Collection, or anything implementing the
+                same create_index/bulk_write/find subset (see InMemoryCollection)
+            update_one: Constructor for the bulk upsert operations the
+                collection accepts (InMemoryUpdate for InMemoryCollection)
+        """
+        self.collection = collection
+        self.update_one = update_one
+
+    def ensure_indexes(self):
+        self.collection.create_index([('user_id', ASCENDING), ('day', ASCENDING)], unique=True)
+
+    def archive(self, user_id, payload, source='xiaomi', received_at=None):
+        """Archive a single payload"""
+        return self.archive_many([(user_id, payload, source, received_at)])
+
+    def archive_many(self, readings):
+        """
+        Archive many payloads with one unordered bulk write
+
+        Args:
+            readings (list): (user_id, payload, source, received_at) tuples;
+                received_at defaults to now
+
+        Returns:
+            int: Number of readings written
+        """
+        buckets = defaultdict(list)
+        for user_id, payload, source, received_at in readings:
+            received_at = received_at or datetime.utcnow()
+            buckets[(user_id, received_at.strftime('%Y-%m-%d'))].append({
+                'received_at': received_at,
+                'source': source,
+                'payload': payload
+            })
+
+        if not buckets:
+            return 0
+
+        operations = [
+            self.update_one(
+                {'user_id': user_id, 'day': day},
+                {
+                    '$push': {'readings': {'$each': items}},
+                    '$inc': {'count': len(items)},
+                    '$setOnInsert': {'user_id': user_id, 'day': day}
+                },
+                upsert=True
+            )
+            for (user_id, day), items in buckets.items()
+        ]
+        self.collection.bulk_write(operations, ordered=False)
+        return sum(len(items) for items in buckets.values())
+
+    def iter_readings(self, user_id, start_day=None, end_day=None):
+        """
+        Yield a user's archived readings oldest first
+
+        Args:
+            user_id (int): Internal user id
+            start_day (str): Inclusive 'YYYY-MM-DD' lower bound
+            end_day (str): Inclusive 'YYYY-MM-DD' upper bound
+
+        Yields:
+            dict: {'received_at', 'source', 'payload'}
+        """
+        query = {'user_id': user_id}
+        day_range = {}
+        if start_day:
+            day_range['$gte'] = start_day
+        if end_day:
+            day_range['$lte'] = end_day
+        if day_range:
+            query['day'] = day_range
+
+        for document in self.collection.find(query).sort('day', ASCENDING):
+            yield from document.get('readings', [])
+
+
+# Bulk upsert accepted by InMemoryCollection; same arguments as pymongo.UpdateOne
+InMemoryUpdate = namedtuple('InMemoryUpdate', ['filter', 'update', 'upsert'])
+InMemoryUpdate.__new__.__defaults__ = (False,)
+
+
+class InMemoryCollection:
+    """
+    Minimal in-process stand-in for a pymongo Collection
+
+    Supports exactly what RawReadingArchive uses, so the archive can run in
+    development and tests without a mongod. bulk_write takes InMemoryUpdate
+    operations rather than pymongo's, whose fields are private.
+    """
+
+    def __init__(self):
+        self.documents = {}
+
+    def create_index(self, keys, unique=False):
+        return '_'.join(f'{key}_{direction}' for key, direction in keys)
+
+    def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            if not isinstance(operation, InMemoryUpdate):
+                raise TypeError(f'InMemoryCollection only accepts InMemoryUpdate operations, not {type(operation).__name__}')
+            document = operation.update
+            key = (operation.filter['user_id'], operation.filter['day'])
+            existing = self.documents.get(key)
+            if existing is None:
+                if not operation.upsert:
+                    continue
+                existing = self.documents[key] = dict(copy.deepcopy(document.get('$setOnInsert', {})))
+            for field, value in document.get('$push', {}).items():
+                existing.setdefault(field, []).extend(copy.deepcopy(value['$each']))
+            for field, value in document.get('$inc', {}).items():
+                existing[field] = existing.get(field, 0) + value
+
+    def find(self, query):
+        return _InMemoryCursor([
+            copy.deepcopy(document) for document in self.documents.values()
+            if _matches(document, query)
+        ])
+
+
+class _InMemoryCursor(list):
+    def sort(self, key, direction=ASCENDING):
+        super().sort(key=lambda document: document.get(key), reverse=direction != ASCENDING)
+        return self
+
+
+def _matches(document, query):
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if '$gte' in condition and not value >= condition['$gte']:
+                return False
+            if '$lte' in condition and not value <= condition['$lte']:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+_archive = None
+_failed_at = None
+
+
+def get_archive():
+    """
+    Get the process-wide archive for the configured backend
+
+    A failed connection is remembered for RAW_ARCHIVE_RETRY_SECONDS, so an
+    unreachable mongod costs one server-selection timeout per interval
+    instead of one per sync.
+
+    Returns:
+        RawReadingArchive: The archive, or None when archiving is disabled
+            or the backend was unreachable on the last attempt
+    """
+    global _archive, _failed_at
+    if _archive is not None:
+        return _archive
+    if _failed_at is not None and time.monotonic() - _failed_at < RAW_ARCHIVE_RETRY_SECONDS:
+        return None
+
+    if RAW_ARCHIVE_BACKEND == 'mongo':
+        from models import mongo_db
+        archive = RawReadingArchive(mongo_db[COLLECTION_NAME])
+    elif RAW_ARCHIVE_BACKEND == 'memory':
+        archive = RawReadingArchive(InMemoryCollection(), update_one=InMemoryUpdate)
+    else:
+        return None
+
+    try:
+        archive.ensure_indexes()
+    except Exception as e:
+        _failed_at = time.monotonic()
+        logger.error(f"Raw archive unavailable, retrying in {RAW_ARCHIVE_RETRY_SECONDS:.0f}s: {e}")
+        return None
+    _failed_at = None
+    _archive = archive
+    return _archive
@@ -0,0 +1,216 @@
+import logging
+import operator
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Columns of the feature matrix, one row per user
+FEATURES = ['bmi', 'body_fat', 'muscle_mass', 'weight_trend']
+
+# Scales report 0 for body composition they couldn't measure
+ZERO_IS_MISSING = ['body_fat', 'muscle_mass']
+
+# weight_trend encoding
+TREND_DECREASING, TREND_STABLE, TREND_INCREASING = -1.0, 0.0, 1.0
+TREND_NAMES = {TREND_DECREASING: 'decreasing', TREND_STABLE: 'stable', TREND_INCREASING: 'increasing'}
+
+OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+}
+
+# Declarative rule table. A rule fires when all of its conditions hold; a
+# condition on a missing (NaN) feature never holds. Rules are reported in
+# table order, and ids are stable so stored results stay meaningful.
+RULES = [
+    {
+        'id': 1,
+        'conditions': [('bmi', '<', 18.5)],
+        'category': 'nutrition',
+        'title': 'Increase Caloric Intake',
+        'description': 'Your BMI is below the healthy range. Consider increasing your daily caloric intake with nutrient-dense foods.'
+    },
+    {
+        'id': 2,
+        'conditions': [('bmi', '>=', 25)],
+        'category': 'exercise',
+        'title': 'Increase Physical Activity',
+        'description': 'Your BMI indicates you may benefit from increased physical activity. Aim for at least 150 minutes of moderate exercise per week.'
+    },
+    {
+        'id': 3,
+        'conditions': [('bmi', '>=', 25)],
+        'category': 'nutrition',
+        'title': 'Monitor Caloric Intake',
+        'description': 'Consider tracking your daily caloric intake to maintain a slight deficit for healthy weight loss.'
+    },
+    {
+        'id': 4,
+        'conditions': [('body_fat', '>', 25)],
+        'category': 'exercise',
+        'title': 'Strength Training',
+        'description': 'Your body fat percentage may benefit from regular strength training. Aim for 2-3 sessions per week.'
+    },
+    {
+        'id': 5,
+        'conditions': [('muscle_mass', '<', 30)],
+        'category': 'nutrition',
+        'title': 'Protein Intake',
+        'description': 'Consider increasing your protein intake to support muscle development. Aim for 1.6-2.2g per kg of body weight.'
+    },
+    {
+        'id': 6,
+        'conditions': [('weight_trend', '==', TREND_INCREASING)],
+        'category': 'lifestyle',
+        'title': 'Weight Management',
+        'description': 'Your weight has been increasing. Consider reviewing your diet and activity levels.'
+    },
+    {
+        'id': 7,
+        'conditions': [('weight_trend', '==', TREND_DECREASING), ('bmi', '<', 20)],
+        'category': 'nutrition',
+        'title': 'Healthy Weight Maintenance',
+        'description': 'Your weight has been decreasing. Ensure you\'re maintaining adequate nutrition for your activity level.'
+    },
+    {
+        'id': 8,
+        'conditions': [],
+        'category': 'hydration',
+        'title': 'Stay Hydrated',
+        'description': 'Remember to drink at least 2 liters of water daily for optimal health.'
+    },
+]
+
+RULES_BY_ID = {rule['id']: rule for rule in RULES}
+
+
+def evaluate_rules(features, rules=RULES):
+    """
+    Evaluate the rule table against a feature matrix
+
+    Args:
+        features (np.ndarray): Shape (n_users, len(FEATURES)), NaN for missing
+        rules (list): Rule table
+
+    Returns:
+        np.ndarray: Boolean matrix of shape (n_users, len(rules))
+    """
+    features = np.asarray(features, dtype=float)
+    fired = np.ones((features.shape[0], len(rules)), dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for column, rule in enumerate(rules):
+            for feature, op, value in rule['conditions']:
+                # NaN compares False under every operator, so missing data never fires
+                fired[:, column] &= OPERATORS[op](features[:, FEATURES.index(feature)], value)
+    return fired
+
+
+def rule_ids(fired_row, rules=RULES):
+    """Ids of the rules that fired for one user"""
+    return [rule['id'] for rule, fired in zip(rules, fired_row) if fired]
+
+
+def to_recommendations(ids):
+    """Expand rule ids into recommendation dictionaries"""
+    return [
+        {key: RULES_BY_ID[rule_id][key] for key in ('category', 'title', 'description')}
+        for rule_id in ids
+    ]
+
+
+def compute_bmi(weight, height_cm):
+    """BMI from weight in kg and height in cm; vectorizes over arrays, NaN when unknown"""
+    height_m = np.asarray(height_cm, dtype=float) / 100
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bmi = np.asarray(weight, dtype=float) / (height_m * height_m)
+    return np.where(np.isfinite(bmi) & (bmi > 0), bmi, np.nan)
+
+
+def encode_trend(latest, oldest):
+    """Weight trend across the last three weigh-ins, vectorized; NaN when fewer than three"""
+    latest = np.asarray(latest, dtype=float)
+    oldest = np.asarray(oldest, dtype=float)
+    trend = np.sign(latest - oldest)
+    return np.where(np.isnan(oldest) | np.isnan(latest), np.nan, trend)
+
+
+def features_from_records(user_data, health_data):
+    """
+    Build the feature row for one user from health data dictionaries
+
+    Uses the latest non-null value of each metric and the last three weigh-ins.
+
+    Args:
+        user_data (dict): User profile information
+        health_data (list): Health data records in any order
+
+    Returns:
+        np.ndarray: Shape (1, len(FEATURES))
+    """
+    records = sorted(health_data, key=lambda record: record['date'], reverse=True)
+
+    def latest(metric):
+        present = (record[metric] for record in records if record.get(metric) is not None)
+        if metric in ZERO_IS_MISSING:
+            present = (value for value in present if value != 0)
+        return next(present, np.nan)
+
+    weigh_ins = [record for record in records if record.get('weight') is not None][:3]
+    weights = [record['weight'] for record in weigh_ins]
+
+    # BMI is derived at write time; only rows written before that need the height
+    bmi = weigh_ins[0].get('bmi') if weigh_ins else None
+    if not bmi:
+        bmi = compute_bmi(weights[0] if weights else np.nan, user_data.get('height') or np.nan)
+    trend = encode_trend(weights[0], weights[2]) if len(weights) == 3 else np.nan
+
+    return np.array([[float(bmi), latest('body_fat'), latest('muscle_mass'), float(trend)]], dtype=float)
+
+
+def features_from_frame(df, heights):
+    """
+    Build the feature matrix for many users from a DataFrame of recent rows
+
+    Args:
+        df (pd.DataFrame): Columns user_id, date, weight, bmi, body_fat, muscle_mass
+        heights (pd.Series): Height in cm indexed by user_id
+
+    Returns:
+        tuple: (np.ndarray user ids, np.ndarray features)
+    """
+    df = df.sort_values(['user_id', 'date'], ascending=[True, False])
+    df[ZERO_IS_MISSING] = df[ZERO_IS_MISSING].replace(0, np.nan)
+    grouped = df.groupby('user_id', sort=True)
+
+    # GroupBy.first skips nulls, i.e. the latest non-null value per user
+    latest = grouped[['weight', 'body_fat', 'muscle_mass']].first()
+    user_ids = latest.index.to_numpy()
+
+    weights = df[df['weight'].notna()]
+    rank = weights.groupby('user_id').cumcount()
+    third = weights[rank == 2].set_index('user_id')['weight'].reindex(user_ids)
+
+    # BMI stored on the latest weigh-in, as in features_from_records; the height only for older rows
+    stored_bmi = weights[rank == 0].set_index('user_id')['bmi'].reindex(user_ids).to_numpy(dtype=float)
+    bmi = np.where(
+        np.isnan(stored_bmi) | (stored_bmi == 0),
+        compute_bmi(latest['weight'].to_numpy(), heights.reindex(user_ids).to_numpy()),
+        stored_bmi
+    )
+
+    features = np.column_stack([
+        bmi,
+        latest['body_fat'].to_numpy(dtype=float),
+        latest['muscle_mass'].to_numpy(dtype=float),
+        encode_trend(latest['weight'].to_numpy(), third.to_numpy(dtype=float))
+    ])
+    return user_ids, features
+
+
+def trend_name(value):
+    return None if np.isnan(value) else TREND_NAMES[float(value)]
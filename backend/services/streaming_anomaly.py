@@ -0,0 +1,196 @@
+import json
+import logging
+import math
+
+import numpy as np
+
+from config import ANOMALY_EWMA_ALPHA, ANOMALY_MAD_WINDOW, ANOMALY_SCORE_THRESHOLD, ANOMALY_WARMUP
+from models.anomaly_state import AnomalyState
+
+logger = logging.getLogger(__name__)
+
+# Scale metrics scored at ingest time (same set /anomaly-detection accepts)
+SCORED_METRICS = [
+    'weight', 'bmi', 'body_fat', 'muscle_mass', 'water',
+    'visceral_fat', 'bone_mass', 'basal_metabolism', 'protein'
+]
+
+# Scales the MAD to a standard deviation for normally distributed data
+MAD_TO_STD = 1.4826
+
+# Floor on the spread so a run of identical readings can't make every change infinite
+MIN_SPREAD = 1e-6
+
+
+class EwmaDetector:
+    """
+    Exponentially weighted mean and variance
+
+    State is three numbers regardless of history length. The score is the
+    absolute z-score of the new value against the state before the update.
+    """
+
+    def __init__(self, alpha=ANOMALY_EWMA_ALPHA):
+        self.alpha = alpha
+
+    def score(self, state, value):
+        if state.get('n', 0) < 2:
+            return 0.0
+        std = max(math.sqrt(state['var']), MIN_SPREAD)
+        return abs(value - state['mean']) / std
+
+    def update(self, state, value, threshold=None):
+        n = state.get('n', 0)
+        if n == 0:
+            state.update(mean=value, var=0.0, n=1)
+            return state
+
+        # Clip the value fed into the state so one outlier can't drag the baseline
+        if threshold is not None and n >= 2:
+            std = max(math.sqrt(state['var']), MIN_SPREAD)
+            value = min(max(value, state['mean'] - threshold * std), state['mean'] + threshold * std)
+
+        # Use a plain running average until the window is warm, then EWMA
+        alpha = max(self.alpha, 1.0 / (n + 1))
+        delta = value - state['mean']
+        state['mean'] += alpha * delta
+        state['var'] = (1 - alpha) * (state['var'] + alpha * delta * delta)
+        state['n'] = n + 1
+        return state
+
+
+class RollingMadDetector:
+    """
+    Median and median absolute deviation over the last ``window`` readings
+
+    State is the bounded window itself, so an update costs O(window)
+    independent of how much history the user has.
+    """
+
+    def __init__(self, window=ANOMALY_MAD_WINDOW):
+        self.window = window
+
+    def score(self, state, value):
+        values = state.get('window', [])
+        if len(values) < 3:
+            return 0.0
+        values = np.asarray(values, dtype=float)
+        median = np.median(values)
+        mad = np.median(np.abs(values - median)) * MAD_TO_STD
+        return float(abs(value - median) / max(mad, MIN_SPREAD))
+
+    def update(self, state, value):
+        window = state.setdefault('window', [])
+        window.append(value)
+        del window[:-self.window]
+        return state
+
+
+class StreamingAnomalyScorer:
+    """
+    Scores each incoming reading against compact per-user, per-metric state
+
+    A reading is flagged when both the EWMA z-score and the rolling MAD score
+    exceed the threshold: EWMA reacts to sudden jumps, MAD keeps a single
+    earlier outlier from masking the next one.
+    """
+
+    def __init__(self, threshold=ANOMALY_SCORE_THRESHOLD, warmup=ANOMALY_WARMUP):
+        self.threshold = threshold
+        self.warmup = warmup
+        self.ewma = EwmaDetector()
+        self.mad = RollingMadDetector()
+
+    def score_and_update(self, state, value):
+        """
+        Score a value, then fold it into the state
+
+        Args:
+            state (dict): Detector state, updated in place
+            value (float): New reading
+
+        Returns:
+            float: Anomaly score (0 during warm-up)
+        """
+        ewma_state = state.setdefault('ewma', {})
+        mad_state = state.setdefault('mad', {})
+
+        score = 0.0
+        if ewma_state.get('n', 0) >= self.warmup:
+            score = min(self.ewma.score(ewma_state, value), self.mad.score(mad_state, value))
+
+        self.ewma.update(ewma_state, value, threshold=self.threshold)
+        self.mad.update(mad_state, value)
+        return score
+
+    def score_entries(self, session, user_id, entries):
+        """
+        Score new HealthData entries for one user and store the flags on them
+
+        Entries must be passed oldest first. State rows are loaded (and row
+        locked, so concurrent writers for a user serialize) with one query and
+        written back through the session; the caller commits.
+
+        Args:
+            session: SQLAlchemy session
+            user_id (int): Internal user id
+            entries (list): HealthData instances about to be committed
+        """
+        metrics = {
+            metric for entry in entries for metric in SCORED_METRICS
+            if getattr(entry, metric) is not None
+        }
+        if not metrics:
+            return
+
+        states = {
+            state.metric: state
+            for state in session.query(AnomalyState).with_for_update().filter(
+                AnomalyState.user_id == user_id,
+                AnomalyState.metric.in_(metrics)
+            )
+        }
+
+        loaded = {metric: state.get_state() for metric, state in states.items()}
+        for entry in entries:
+            scores = {}
+            for metric in SCORED_METRICS:
+                value = getattr(entry, metric)
+                if value is None:
+                    continue
+                scores[metric] = self.score_and_update(loaded.setdefault(metric, {}), float(value))
+
+            flagged = {metric: round(score, 4) for metric, score in scores.items() if score >= self.threshold}
+            entry.anomaly_score = max(scores.values()) if scores else None
+            entry.is_anomaly = bool(flagged)
+            entry.anomaly_scores = json.dumps(flagged) if flagged else None
+
+        for metric, state in loaded.items():
+            row = states.get(metric)
+            if row is None:
+                row = AnomalyState(user_id=user_id, metric=metric)
+                session.add(row)
+            row.set_state(state)
+
+    def discard_scores(self, entry, metrics):
+        """
+        Drop the stored flags of edited metrics; they scored the old values
+
+        The new values are not folded into the state, which already holds the
+        old ones, so an edited reading stays unflagged until
+        jobs.backfill_anomaly_scores replays the user's history.
+
+        Args:
+            entry (HealthData): Entry being updated
+            metrics (list): Metrics whose values changed
+        """
+        scores = json.loads(entry.anomaly_scores) if entry.anomaly_scores else {}
+        kept = {metric: score for metric, score in scores.items() if metric not in metrics}
+        if kept == scores:
+            return
+        entry.anomaly_scores = json.dumps(kept) if kept else None
+        entry.anomaly_score = max(kept.values()) if kept else None
+        entry.is_anomaly = bool(kept)
+
+
+scorer = StreamingAnomalyScorer()
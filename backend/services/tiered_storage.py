@@ -0,0 +1,187 @@
+import glob
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BACKEND, ARCHIVE_PARQUET_DIR
+from models.health_data import HealthData
+from models.health_data_archive import HealthDataArchive
+
+logger = logging.getLogger(__name__)
+
+
+def hot_cutoff():
+    """Rows dated before this are eligible for the cold tier"""
+    return datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def parquet_path(parquet_dir, year, month):
+    """Directory holding one month of archived rows (hive-style partitioning)"""
+    return os.path.join(parquet_dir, f'year={year:04d}', f'month={month:02d}')
+
+
+def parquet_index_path(parquet_dir):
+    """Per-user (user_id, first_date, last_date) index of the Parquet archive"""
+    return os.path.join(parquet_dir, 'user_dates.parquet')
+
+
+def parquet_index_marker(parquet_dir):
+    """Present while jobs/archive_health_data.py is moving rows the index doesn't cover yet"""
+    return os.path.join(parquet_dir, 'user_dates.stale')
+
+
+def parquet_index_stale(parquet_dir):
+    """Whether archived files may hold rows the index doesn't cover"""
+    if os.path.exists(parquet_index_marker(parquet_dir)):
+        return True
+    # Archives written before the index existed
+    return not os.path.exists(parquet_index_path(parquet_dir)) and bool(glob.glob(os.path.join(parquet_dir, 'year=*')))
+
+
+def _parquet_user_range(user_id):
+    """
+    (first, last) archived date of a user from the index, or None if nothing is archived
+
+    One filtered read of a small file. While the index is stale any month
+    may hold the user's rows, so the range is then unbounded below and ends
+    at the hot cutoff (rows are archived oldest first).
+    """
+    import pandas as pd
+
+    if parquet_index_stale(ARCHIVE_PARQUET_DIR):
+        return None, hot_cutoff()
+    path = parquet_index_path(ARCHIVE_PARQUET_DIR)
+    if not os.path.exists(path):
+        return None
+    index = pd.read_parquet(path, filters=[('user_id', '=', user_id)])
+    if index.empty:
+        return None
+    return index['first_date'].min().to_pydatetime(), index['last_date'].max().to_pydatetime()
+
+
+def _cold_latest_date(session, user_id):
+    """Newest archived date for a user (one index probe), or None"""
+    if ARCHIVE_BACKEND == 'table':
+        return session.query(func.max(HealthDataArchive.date)).filter(HealthDataArchive.user_id == user_id).scalar()
+    if ARCHIVE_BACKEND == 'parquet':
+        user_range = _parquet_user_range(user_id)
+        return user_range[1] if user_range else None
+    return None
+
+
+def needs_cold(session, user_id, start=None):
+    """
+    Whether a read starting at ``start`` (None for all history) reaches the cold tier
+    """
+    if ARCHIVE_BACKEND not in ('table', 'parquet'):
+        return False
+    if start is not None and start > hot_cutoff():
+        # Cheap exit for the common 30-365 day windows
+        return False
+    latest = _cold_latest_date(session, user_id)
+    return latest is not None and (start is None or start <= latest)
+
+
+def read_cold(session, user_id, start=None, end=None, metric=None, fields=None, limit=None):
+    """
+    Archived rows for a user, newest first, as health data dictionaries
+
+    Args:
+        session: SQLAlchemy session
+        user_id (int): Internal user id
+        start (datetime): Inclusive lower bound on date
+        end (datetime): Inclusive upper bound on date
+        metric (str): Only rows where this metric is present
+        fields (list): Projection, as for HealthData.to_dict
+        limit (int): Maximum number of rows
+
+    Returns:
+        list: Dictionaries shaped like HealthData.to_dict(fields)
+    """
+    if ARCHIVE_BACKEND == 'table':
+        query = HealthDataArchive.query.filter(HealthDataArchive.user_id == user_id)
+        if start is not None:
+            query = query.filter(HealthDataArchive.date >= start)
+        if end is not None:
+            query = query.filter(HealthDataArchive.date <= end)
+        if metric:
+            query = query.filter(getattr(HealthDataArchive, metric).isnot(None))
+        if fields is not None:
+            query = query.options(HealthDataArchive.load_only(fields))
+        query = query.order_by(HealthDataArchive.date.desc())
+        if limit is not None:
+            query = query.limit(limit)
+        return [row.to_dict(fields) for row in query]
+
+    if ARCHIVE_BACKEND == 'parquet':
+        return _read_parquet(user_id, start, end, metric, fields, limit)
+
+    return []
+
+
+def _read_parquet(user_id, start, end, metric, fields, limit):
+    import pandas as pd
+
+    user_range = _parquet_user_range(user_id)
+    if user_range is None:
+        return []
+    # Skip whole months outside both the requested range and the user's archived range
+    first, last = user_range
+    bounds = [bound for bound in (start, first) if bound is not None]
+    lower = max(bounds) if bounds else None
+    upper = min(end, last) if end is not None else last
+
+    files = sorted(glob.glob(os.path.join(ARCHIVE_PARQUET_DIR, 'year=*', 'month=*', '*.parquet')))
+    if lower is not None:
+        files = [path for path in files if _file_month(path) >= (lower.year, lower.month)]
+    files = [path for path in files if _file_month(path) <= (upper.year, upper.month)]
+    if not files:
+        return []
+
+    columns = None if fields is None else ['id', 'user_id', 'date'] + list(fields)
+    frames = [
+        pd.read_parquet(path, columns=columns, filters=[('user_id', '=', user_id)])
+        for path in files
+    ]
+    df = pd.concat(frames, ignore_index=True)
+    if start is not None:
+        df = df[df['date'] >= start]
+    if end is not None:
+        df = df[df['date'] <= end]
+    if metric:
+        df = df[df[metric].notna()]
+    df = df.sort_values('date', ascending=False)
+    if limit is not None:
+        df = df.head(limit)
+
+    return [_parquet_record(row, fields) for row in df.to_dict('records')]
+
+
+def _file_month(path):
+    month_dir = os.path.dirname(path)
+    year = int(os.path.basename(os.path.dirname(month_dir)).split('=')[1])
+    month = int(os.path.basename(month_dir).split('=')[1])
+    return year, month
+
+
+def _parquet_record(row, fields):
+    import pandas as pd
+
+    record = {'id': int(row['id']), 'date': row['date'].isoformat()}
+    for field in fields if fields is not None else HealthData.SELECTABLE_FIELDS:
+        value = row.get(field)
+        if value is not None and pd.isna(value):
+            value = None
+        if field in ('created_at', 'updated_at') and value is not None:
+            value = value.isoformat()
+        elif field == 'is_anomaly':
+            value = bool(value)
+        elif field == 'trends':
+            value = json.loads(value) if value else {}
+        elif hasattr(value, 'item'):
+            value = value.item()
+        record[field] = value
+    return record
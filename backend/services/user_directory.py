@@ -0,0 +1,189 @@
+import base64
+import logging
+import threading
+import time
+
+from sqlalchemy import and_, func, or_, text
+
+from config import USER_COUNT_CACHE_SECONDS
+from models.user import User
+
+logger = logging.getLogger(__name__)
+
+COUNT_MODES = ['exact', 'estimate', 'none']
+
+
+def encode_cursor(user_id):
+    """Opaque page cursor for the last internal user id of a page"""
+    return base64.urlsafe_b64encode(str(user_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a page cursor
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def has_xiaomi_clause():
+    return and_(
+        User.xiaomi_token.isnot(None), User.xiaomi_token != '',
+        User.xiaomi_device_id.isnot(None), User.xiaomi_device_id != ''
+    )
+
+
+def apply_filters(query, filters):
+    """
+    Apply listing filters to a User query
+
+    Args:
+        query: SQLAlchemy query over User (or User columns)
+        filters (dict): Any of is_active (bool), has_xiaomi (bool),
+            created_from / created_to (datetime, inclusive / exclusive)
+
+    Returns:
+        The filtered query
+    """
+    if filters.get('is_active') is not None:
+        if filters['is_active']:
+            query = query.filter(User.is_active.is_(True))
+        else:
+            query = query.filter(or_(User.is_active.is_(False), User.is_active.is_(None)))
+    if filters.get('has_xiaomi') is not None:
+        clause = has_xiaomi_clause()
+        query = query.filter(clause if filters['has_xiaomi'] else ~clause)
+    if filters.get('created_from') is not None:
+        query = query.filter(User.created_at >= filters['created_from'])
+    if filters.get('created_to') is not None:
+        query = query.filter(User.created_at < filters['created_to'])
+    return query
+
+
+def get_page(filters, limit, after_id=None):
+    """
+    One keyset page of users ordered by internal id
+
+    Fetches ``limit + 1`` rows to learn whether another page exists without
+    a count or OFFSET.
+
+    Args:
+        filters (dict): See apply_filters
+        limit (int): Page size
+        after_id (int): Internal id of the last user on the previous page
+
+    Returns:
+        tuple: (list of User, next cursor or None)
+    """
+    query = apply_filters(User.query, filters)
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
+    users = query.order_by(User.id).limit(limit + 1).all()
+
+    if len(users) > limit:
+        users = users[:limit]
+        return users, encode_cursor(users[-1].id)
+    return users, None
+
+
+def iter_users(filters, batch_size=1000):
+    """
+    Yield every matching user, loading keyset batches of ``batch_size``
+
+    Each batch is expunged from the session once yielded, so memory stays
+    bounded by one batch however many users match.
+    """
+    last_id = None
+    while True:
+        users, cursor = get_page(filters, batch_size, last_id)
+        for user in users:
+            yield user
+        if cursor is None:
+            return
+        last_id = users[-1].id
+        # Drop the batch from the identity map before loading the next one
+        User.query.session.expunge_all()
+
+
+class CountCache:
+    """Small TTL cache for COUNT results, keyed by the filter set"""
+
+    def __init__(self, ttl=USER_COUNT_CACHE_SECONDS):
+        self.ttl = ttl
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + self.ttl)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+count_cache = CountCache()
+
+
+def _cache_key(filters):
+    return tuple(sorted((key, str(value)) for key, value in filters.items() if value is not None))
+
+
+def exact_count(session, filters):
+    """SELECT COUNT(*) over the filtered users, cached for USER_COUNT_CACHE_SECONDS"""
+    key = _cache_key(filters)
+    count = count_cache.get(key)
+    if count is None:
+        count = apply_filters(session.query(func.count(User.id)), filters).scalar()
+        count_cache.set(key, count)
+    return count
+
+
+def estimated_count(session, filters):
+    """
+    Row count estimate for the users table
+
+    On MySQL an unfiltered count is read from InnoDB's table statistics,
+    which is constant time but approximate. Anything else falls back to the
+    cached exact count.
+    """
+    if not any(value is not None for value in filters.values()) and session.bind.dialect.name == 'mysql':
+        estimate = session.execute(text(
+            'SELECT TABLE_ROWS FROM information_schema.TABLES '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table'
+        ), {'table': User.__tablename__}).scalar()
+        if estimate is not None:
+            return int(estimate)
+    return exact_count(session, filters)
+
+
+def count_users(session, filters, mode='exact'):
+    """
+    Count matching users
+
+    Args:
+        session: SQLAlchemy session
+        filters (dict): See apply_filters
+        mode (str): 'exact', 'estimate' or 'none'
+
+    Returns:
+        int: The count, or None when mode is 'none'
+    """
+    if mode == 'none':
+        return None
+    if mode == 'estimate':
+        return estimated_count(session, filters)
+    return exact_count(session, filters)
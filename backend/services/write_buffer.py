@@ -0,0 +1,387 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+from datetime import date, datetime, time, timezone
+
+from config import (
+    WRITE_BUFFER_ENABLED, WRITE_BUFFER_FLUSH_SECONDS, WRITE_BUFFER_FSYNC, WRITE_BUFFER_LOG_DIR,
+    WRITE_BUFFER_MAX_PENDING, WRITE_BUFFER_METRICS
+)
+from models import db
+from models.health_data import HealthData
+from services.derived_metrics import refresh_trends
+
+logger = logging.getLogger(__name__)
+
+# Manual metrics clients report as running daily values; scale metrics are never buffered
+BUFFERABLE_METRICS = ['calories_consumed', 'calories_burned', 'steps', 'sleep_hours', 'water_intake']
+
+
+class WriteBehindBuffer:
+    """
+    Write-behind ingest buffer for high-frequency manual metrics
+
+    Updates are coalesced in memory per (user, day, metric), last value
+    wins, and written as one health_data row per user and day (dated at
+    midnight) in a single transaction when WRITE_BUFFER_MAX_PENDING
+    (user, day) entries are pending or every WRITE_BUFFER_FLUSH_SECONDS.
+
+    Every web worker buffers on its own, so each value carries the time it
+    was received and a flush only applies values newer than the ones the
+    row already holds; a worker flushing late can't overwrite a newer value
+    with its older one. The row is created with an upsert against a unique
+    (user_id, buffer_day) index, so concurrent flushes share one row per day.
+
+    Each update is appended to a per-process log before it is acknowledged.
+    Log names carry the pid and a random per-start id, so a restarted
+    process that reuses a pid never appends to its predecessor's log. A
+    flush seals the current log and starts a new one; sealed logs are
+    deleted once their batch has committed. Logs left behind by a process
+    that died are claimed by renaming them, so only one starting worker
+    replays each, and since values are applied by received time it is safe
+    to apply a log twice.
+
+    Buffered values become visible to reads once flushed.
+    """
+
+    def __init__(self, log_dir=WRITE_BUFFER_LOG_DIR, metrics=WRITE_BUFFER_METRICS,
+                 max_pending=WRITE_BUFFER_MAX_PENDING, flush_seconds=WRITE_BUFFER_FLUSH_SECONDS,
+                 fsync=WRITE_BUFFER_FSYNC):
+        self.log_dir = log_dir
+        self.metrics = set(metrics) & set(BUFFERABLE_METRICS)
+        self.max_pending = max_pending
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.app = None
+
+        # (user_id, day) -> {'source': str, 'values': {metric: value}, 'received': {metric: epoch seconds}}
+        self.pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pid = None
+        self._instance = None
+        self._log = None
+        self._sealed = []
+        self._sequence = 0
+
+    def init_app(self, app):
+        """
+        Enable the buffer for an application
+
+        The log and flush thread are started lazily by the first write in
+        each process, so this is safe to call before a server forks workers.
+        """
+        self.app = app
+        atexit.register(self.close)
+
+    @property
+    def enabled(self):
+        return self.app is not None
+
+    def accepts(self, data):
+        """Whether a POST /api/health/ body only carries buffered metrics"""
+        if not self.enabled:
+            return False
+        present = [metric for metric in HealthData.METRICS if metric in data]
+        return bool(present) and all(metric in self.metrics for metric in present)
+
+    def add(self, user_id, day, values, source='manual'):
+        """
+        Buffer metric values for a user and day
+
+        Returns once the update is in the log, so an acknowledged write
+        survives a crash.
+
+        Args:
+            user_id (int): Internal user id
+            day (date): Day the values belong to
+            values (dict): {metric: value} of buffered metrics
+            source (str): Source recorded on the row
+        """
+        self._ensure_started()
+        received_at = datetime.now(timezone.utc).timestamp()
+        record = {
+            'user_id': user_id, 'day': day.isoformat(), 'source': source,
+            'values': values, 'received': {metric: received_at for metric in values}
+        }
+        with self._lock:
+            self._append(record)
+            self._apply_record(record)
+            full = len(self.pending) >= self.max_pending
+        if full:
+            self.flush()
+
+    def flush(self):
+        """
+        Write pending updates in one transaction
+
+        Returns:
+            int: Number of (user, day) rows written; 0 if nothing was pending
+                or the commit failed (the batch then stays pending)
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self.pending:
+                    return 0
+                try:
+                    self._seal()
+                except OSError as e:
+                    # Nothing was taken from pending; rewrite it into a fresh log so it stays durable
+                    logger.error(f"Write buffer could not seal its log, keeping {len(self.pending)} entries: {e}")
+                    self._reopen_log()
+                    return 0
+                batch, self.pending = self.pending, {}
+                sealed = list(self._sealed)
+
+            with self.app.app_context():
+                try:
+                    self._write(db.session, batch)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Write buffer flush failed, keeping {len(batch)} entries: {e}")
+                    with self._lock:
+                        # Updates that arrived during the flush are newer and win
+                        for key, entry in batch.items():
+                            self._merge(key, entry['source'], entry['values'], entry['received'])
+                    return 0
+
+            for path in sealed:
+                os.remove(path)
+            with self._lock:
+                self._sealed = [path for path in self._sealed if path not in sealed]
+            return len(batch)
+
+    def close(self):
+        """Flush what is pending and stop the flush thread"""
+        self._stop.set()
+        if self._pid == os.getpid():
+            self.flush()
+            with self._lock:
+                if self._log:
+                    self._log.close()
+                    self._log = None
+
+    def _write(self, session, batch):
+        day_starts = {key: datetime.combine(date.fromisoformat(key[1]), time.min) for key in batch}
+        self._insert_rows(session, batch, day_starts)
+
+        rows = {
+            (row.user_id, row.buffer_day.isoformat()): row
+            for row in session.query(HealthData).with_for_update().filter(
+                HealthData.user_id.in_({user_id for user_id, _ in batch}),
+                HealthData.buffer_day.in_({date.fromisoformat(day) for _, day in batch})
+            )
+        }
+        for key, entry in batch.items():
+            row = rows[key]
+            applied = row.get_buffered_at()
+            for metric, value in entry['values'].items():
+                received_at = entry['received'].get(metric, 0)
+                # Another worker may already have written a newer value
+                if received_at >= applied.get(metric, 0):
+                    setattr(row, metric, value)
+                    applied[metric] = received_at
+            row.set_buffered_at(applied)
+
+        for user_id in {user_id for user_id, _ in batch}:
+            refresh_trends(session, user_id, [start for key, start in day_starts.items() if key[0] == user_id])
+
+    def _insert_rows(self, session, batch, day_starts):
+        """Create the (user, day) rows that don't exist yet, in one upsert that leaves existing ones alone"""
+        table = HealthData.__table__
+        now = datetime.utcnow()
+        values = [
+            {
+                'user_id': user_id, 'date': day_starts[(user_id, day)], 'buffer_day': date.fromisoformat(day),
+                'source': entry['source'], 'is_anomaly': False, 'created_at': now, 'updated_at': now
+            }
+            for (user_id, day), entry in batch.items()
+        ]
+
+        dialect = session.get_bind(mapper=HealthData.__mapper__).dialect.name
+        if dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+            statement = insert(table).values(values)
+            statement = statement.on_duplicate_key_update({'buffer_day': statement.inserted.buffer_day})
+        elif dialect in ('postgresql', 'sqlite'):
+            from sqlalchemy.dialects import postgresql, sqlite
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            statement = insert(table).values(values).on_conflict_do_nothing(
+                index_elements=['user_id', 'buffer_day', 'date']
+            )
+        else:
+            existing = {
+                (row.user_id, row.buffer_day.isoformat())
+                for row in session.query(HealthData.user_id, HealthData.buffer_day).filter(
+                    HealthData.user_id.in_({user_id for user_id, _ in batch}),
+                    HealthData.buffer_day.in_({date.fromisoformat(day) for _, day in batch})
+                )
+            }
+            session.add_all([
+                HealthData(**row) for row in values
+                if (row['user_id'], row['buffer_day'].isoformat()) not in existing
+            ])
+            session.flush()
+            return
+        session.execute(statement)
+
+    def _apply_record(self, record):
+        # Logs written before received times were recorded lose to any stored value
+        received = record.get('received', {})
+        self._merge((record['user_id'], record['day']), record['source'], record['values'],
+                    {metric: received.get(metric, 0) for metric in record['values']})
+
+    def _merge(self, key, source, values, received):
+        """Fold values into pending, keeping the most recently received value of each metric"""
+        entry = self.pending.setdefault(key, {'source': source, 'values': {}, 'received': {}})
+        entry['source'] = source
+        for metric, value in values.items():
+            if received[metric] >= entry['received'].get(metric, 0):
+                entry['values'][metric] = value
+                entry['received'][metric] = received[metric]
+
+    def _log_path(self, suffix):
+        return os.path.join(self.log_dir, f'wal-{os.getpid()}-{self._instance}-{suffix}')
+
+    def _open_log(self):
+        self._log = open(self._log_path('active.log'), 'a', encoding='utf-8')
+
+    def _append(self, record):
+        self._log.write(json.dumps(record) + '\n')
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+
+    def _seal(self):
+        self._log.close()
+        self._sequence += 1
+        sealed = self._log_path(f'{self._sequence:08d}.sealed')
+        os.replace(self._log_path('active.log'), sealed)
+        self._sealed.append(sealed)
+        self._open_log()
+
+    def _reopen_log(self):
+        """Start a new active log holding everything pending, after the old one was lost"""
+        if self._log and not self._log.closed:
+            self._log.close()
+        self._open_log()
+        self._append_pending()
+
+    def _append_pending(self):
+        for (user_id, day), entry in self.pending.items():
+            self._append({
+                'user_id': user_id, 'day': day, 'source': entry['source'],
+                'values': entry['values'], 'received': entry['received']
+            })
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked worker starts with its own state and log
+            self.pending, self._sealed, self._sequence = {}, [], 0
+            self._stop = threading.Event()
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._instance = uuid.uuid4().hex[:12]
+            self._recover(self._claim(self._orphaned_logs()))
+            # Only now is the log open; if recovery raised, the next write retries it
+            self._pid = os.getpid()
+            threading.Thread(target=self._flush_periodically, name='write-buffer-flush', daemon=True).start()
+
+    def _orphaned_logs(self):
+        """
+        Logs whose process is gone, oldest first
+
+        Logs with this pid but another start id are from a previous process
+        that had the same pid (e.g. after a container restart), or from a
+        start of this process whose recovery failed.
+        """
+        orphans = []
+        for path in glob.glob(os.path.join(self.log_dir, 'wal-*')):
+            parts = os.path.basename(path).split('-')
+            pid = int(parts[1])
+            if pid == os.getpid():
+                if len(parts) > 3 and parts[2] == self._instance:
+                    continue
+            elif _process_alive(pid):
+                continue
+            try:
+                orphans.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                # Claimed by another worker since the glob
+                continue
+        return [path for _, path in sorted(orphans)]
+
+    def _claim(self, orphans):
+        """
+        Rename orphaned logs into this process's namespace
+
+        The rename is atomic, so when several workers start together each
+        log is claimed, and replayed, by exactly one of them; the others
+        skip it. A claimed log that isn't replayed stays an orphan of this
+        process and is picked up later.
+        """
+        claimed = []
+        for path in orphans:
+            self._sequence += 1
+            target = self._log_path(f'{self._sequence:08d}.claimed')
+            try:
+                os.rename(path, target)
+            except FileNotFoundError:
+                continue
+            claimed.append(target)
+        return claimed
+
+    def _recover(self, orphans):
+        """Replay claimed logs into pending, then open this process's log holding their state"""
+        for path in orphans:
+            with open(path, encoding='utf-8') as log:
+                for line in log:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn last line of a crashed write, never acknowledged
+                        continue
+                    self._apply_record(record)
+        # Carry the replayed state over into this process's log before dropping the old ones
+        self._open_log()
+        self._append_pending()
+        if not orphans:
+            return
+        for path in orphans:
+            os.remove(path)
+        logger.info(f"Write buffer: recovered {len(self.pending)} entries from {len(orphans)} log(s)")
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Write buffer flush failed: {e}")
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+write_buffer = WriteBehindBuffer()
+
+
+def init_app(app):
+    """Enable the write-behind buffer when WRITE_BUFFER_ENABLED is set"""
+    if WRITE_BUFFER_ENABLED:
+        write_buffer.init_app(app)
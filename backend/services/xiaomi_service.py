@@ -1,6 +1,6 @@
 import logging
 from miio import Device
-from miio.device import DeviceException
+from miio import DeviceException
 import time
 from datetime import datetime
 import os
@@ -57,26 +57,40 @@ class XiaomiScaleService:
             # correct method for your specific device model
             data = self.device.send("get_weight_data")
             
-            # Process and format the data
-            processed_data = {
-                'weight': data.get('weight', 0) / 1000,  # Convert g to kg
-                'bmi': data.get('bmi', 0) / 10,  # Scale factor
-                'body_fat': data.get('bodyfat', 0) / 10,  # Percentage
-                'muscle_mass': data.get('muscle', 0) / 1000,  # Convert g to kg
-                'water': data.get('water', 0) / 10,  # Percentage
-                'visceral_fat': data.get('visceral', 0),
-                'bone_mass': data.get('bone', 0) / 1000,  # Convert g to kg
-                'basal_metabolism': data.get('basal', 0),  # kcal
-                'protein': data.get('protein', 0) / 10,  # Percentage
-                'timestamp': datetime.utcnow().isoformat(),
-                'source': 'xiaomi'
-            }
+            # Process and format the data, keeping the raw payload for the archive
+            processed_data = self.process_payload(data)
+            processed_data['raw'] = data
             
             return processed_data
         except DeviceException as e:
             logger.error(f"Error retrieving data from Xiaomi device: {e}")
             return None
     
+    @staticmethod
+    def process_payload(data):
+        """
+        Map a raw scale payload to health data fields.
+        
+        Args:
+            data (dict): Payload returned by the get_weight_data command
+            
+        Returns:
+            dict: The scale data including weight, body fat, etc.
+        """
+        return {
+            'weight': data.get('weight', 0) / 1000,  # Convert g to kg
+            'bmi': data.get('bmi', 0) / 10,  # Scale factor
+            'body_fat': data.get('bodyfat', 0) / 10,  # Percentage
+            'muscle_mass': data.get('muscle', 0) / 1000,  # Convert g to kg
+            'water': data.get('water', 0) / 10,  # Percentage
+            'visceral_fat': data.get('visceral', 0),
+            'bone_mass': data.get('bone', 0) / 1000,  # Convert g to kg
+            'basal_metabolism': data.get('basal', 0),  # kcal
+            'protein': data.get('protein', 0) / 10,  # Percentage
+            'timestamp': datetime.utcnow().isoformat(),
+            'source': 'xiaomi'
+        }
+    
     def discover_devices(self):
         """
         Discover Xiaomi devices on the network.
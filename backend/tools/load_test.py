@@ -0,0 +1,384 @@
+"""
+End-to-end HTTP load test
+
+Logs in (registering on first use) a pool of synthetic users, seeds each
+with a history of scale readings, then drives a running deployment with a
+weighted mix of dashboard loads, list queries, writes and syncs from many
+concurrent clients. Reports throughput and latency percentiles per scenario,
+and can compare them against a saved baseline to gate regressions.
+
+Everything runs locally: start the app against SQLite or a local MySQL
+container, e.g.
+
+    gunicorn -w 4 -b 127.0.0.1:5000 app:app
+    python -m tools.miio_simulator --devices 500 --manifest sim_devices.json   # only for the 'sync' scenario
+
+Run from the backend directory:
+    python -m tools.load_test --url http://127.0.0.1:5000 --users 200 --concurrency 32 --duration 60 \\
+        [--mix dashboard=10,list=40,write=30,changes=10,summary=10] [--devices sim_devices.json] \\
+        [--out results.json] [--baseline baseline.json --tolerance 0.2] [--max-error-rate 0.01]
+
+Exits with status 1 if a regression gate fails.
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+DEFAULT_MIX = 'dashboard=10,list=40,write=30,changes=10,summary=10'
+PASSWORD = 'load-test-password'
+
+
+class Client:
+    """One keep-alive HTTP connection with JSON helpers"""
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, body=None, token=None):
+        """
+        Returns:
+            tuple: (status, parsed JSON body or None)
+        """
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        payload = json.dumps(body) if body is not None else None
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = self.connection_class(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body=payload, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed an idle keep-alive connection; reconnect once
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class SyntheticUser:
+    def __init__(self, index):
+        self.index = index
+        self.email = f'loadtest-{index}@example.com'
+        self.token = None
+        self.device = None
+        self.sync_token = None
+
+    def login(self, client):
+        status, body = client.request('POST', '/api/auth/login', {'email': self.email, 'password': PASSWORD})
+        if status == 401:
+            rng = random.Random(self.index)
+            client.request('POST', '/api/auth/register', {
+                'email': self.email,
+                'username': f'loadtest{self.index}',
+                'password': PASSWORD,
+                'gender': rng.choice(['male', 'female']),
+                'date_of_birth': f'{rng.randint(1950, 2004)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+                'height': round(rng.uniform(155, 195), 1)
+            })
+            status, body = client.request('POST', '/api/auth/login', {'email': self.email, 'password': PASSWORD})
+        if status != 200:
+            raise RuntimeError(f'Login failed for {self.email}: {status} {body}')
+        self.token = body['access_token']
+
+
+def reading(rng, date, weight):
+    return {
+        'date': date.isoformat(),
+        'weight': round(weight, 2),
+        'body_fat': round(rng.uniform(15, 30), 1),
+        'muscle_mass': round(rng.uniform(45, 65), 1),
+        'steps': rng.randint(2000, 15000),
+        'water_intake': round(rng.uniform(1, 3), 1),
+        'source': 'load_test'
+    }
+
+
+def seed_history(client, user, days):
+    """Give a new user `days` of daily readings, so reads and models see realistic volumes"""
+    status, body = client.request('GET', '/api/health/?limit=1', token=user.token)
+    if status == 200 and body:
+        return
+    rng = random.Random(user.index)
+    weight = rng.uniform(55, 100)
+    start = datetime.utcnow() - timedelta(days=days)
+    entries = []
+    for day in range(days):
+        weight += rng.gauss(0, 0.3)
+        entries.append(reading(rng, start + timedelta(days=day), weight))
+    for offset in range(0, len(entries), 1000):
+        client.request('POST', '/api/health/batch', {'entries': entries[offset:offset + 1000]}, token=user.token)
+
+
+# Scenario name -> function(client, user, rng) returning (endpoint label, status)
+def scenario_dashboard(client, user, rng):
+    status, _ = client.request('GET', '/api/insights/dashboard-data', token=user.token)
+    return status
+
+
+def scenario_list(client, user, rng):
+    query = urlencode({'limit': rng.choice([30, 90, 365]), 'max_points': 120})
+    status, _ = client.request('GET', f'/api/health/?{query}', token=user.token)
+    return status
+
+
+def scenario_write(client, user, rng):
+    status, _ = client.request('POST', '/api/health/', reading(rng, datetime.utcnow(), rng.uniform(55, 100)), token=user.token)
+    return status
+
+
+def scenario_changes(client, user, rng):
+    path = '/api/health/changes?limit=200'
+    if user.sync_token:
+        path += '&' + urlencode({'since': user.sync_token})
+    status, body = client.request('GET', path, token=user.token)
+    if status == 200 and body:
+        user.sync_token = body['next_token']
+    return status
+
+
+def scenario_summary(client, user, rng):
+    status, _ = client.request('GET', '/api/health/summary', token=user.token)
+    return status
+
+
+def scenario_sync(client, user, rng):
+    status, _ = client.request('POST', '/api/xiaomi/sync', token=user.token)
+    return status
+
+
+# Scenario name -> (endpoint label in reports, function returning the HTTP status)
+SCENARIOS = {
+    'dashboard': ('GET /api/insights/dashboard-data', scenario_dashboard),
+    'list': ('GET /api/health/', scenario_list),
+    'write': ('POST /api/health/', scenario_write),
+    'changes': ('GET /api/health/changes', scenario_changes),
+    'summary': ('GET /api/health/summary', scenario_summary),
+    'sync': ('POST /api/xiaomi/sync', scenario_sync),
+}
+
+
+def parse_mix(value):
+    """'dashboard=10,list=40' -> {'dashboard': 10.0, 'list': 40.0}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f'Unknown scenario {name}. Must be among: {", ".join(SCENARIOS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def prepare_users(base_url, count, history_days, devices, concurrency):
+    users = [SyntheticUser(index) for index in range(count)]
+    specs = None
+    if devices:
+        with open(devices) as manifest:
+            specs = json.load(manifest)
+
+    def prepare(chunk):
+        client = Client(base_url)
+        for user in chunk:
+            try:
+                user.login(client)
+                seed_history(client, user, history_days)
+                if specs:
+                    user.device = specs[user.index % len(specs)]
+                    client.request('POST', '/api/xiaomi/connect', {'token': user.device['token'], 'ip': user.device['ip']}, token=user.token)
+            except Exception as e:
+                print(f"Skipping {user.email}: {e}", file=sys.stderr)
+                user.token = None
+                client.close()
+
+    chunks = [users[offset::concurrency] for offset in range(concurrency)]
+    threads = [threading.Thread(target=prepare, args=(chunk,)) for chunk in chunks if chunk]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ready = [user for user in users if user.token]
+    if not ready:
+        raise SystemExit('No load-test user could log in')
+    return ready
+
+
+def run(base_url, users, mix, concurrency, duration, seed):
+    """
+    Closed-loop load: each worker sends its next request as soon as the last one returns
+
+    Returns:
+        tuple: ({endpoint: [(latency_seconds, status)]}, elapsed seconds)
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = defaultdict(list)
+    samples_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_id):
+        rng = random.Random(seed * 1000 + worker_id)
+        client = Client(base_url)
+        local = defaultdict(list)
+        while time.perf_counter() < deadline:
+            user = rng.choice(users)
+            endpoint, scenario = SCENARIOS[rng.choices(names, weights)[0]]
+            start = time.perf_counter()
+            try:
+                status = scenario(client, user, rng)
+            except Exception:
+                # Connection failures and unexpected responses are errors, not the end of the worker
+                status = 0
+                client.close()
+            local[endpoint].append((time.perf_counter() - start, status))
+            if status == 401:
+                # Access tokens last an hour; log in again and carry on
+                try:
+                    user.login(client)
+                except Exception:
+                    client.close()  # the next request for this user retries
+        with samples_lock:
+            for endpoint, values in local.items():
+                samples[endpoint].extend(values)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(worker_id,)) for worker_id in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed):
+    """Throughput, error rate (any non-2xx status or failed request) and latency percentiles per endpoint"""
+    report = {'elapsed_s': round(elapsed, 2), 'endpoints': {}}
+    total, total_errors = 0, 0
+    for endpoint, values in sorted(samples.items()):
+        latencies = np.array([latency for latency, _ in values]) * 1000
+        # 202 (queued insight job / buffered write) is a success
+        errors = sum(1 for _, status in values if not 200 <= status < 300)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        report['endpoints'][endpoint] = {
+            'requests': len(values),
+            'rps': round(len(values) / elapsed, 2),
+            'error_rate': round(errors / len(values), 4),
+            'p50_ms': round(float(p50), 1),
+            'p95_ms': round(float(p95), 1),
+            'p99_ms': round(float(p99), 1),
+            'max_ms': round(float(latencies.max()), 1)
+        }
+        total += len(values)
+        total_errors += errors
+    report['total'] = {
+        'requests': total,
+        'rps': round(total / elapsed, 2) if elapsed else 0,
+        'error_rate': round(total_errors / total, 4) if total else 0
+    }
+    return report
+
+
+def print_report(report):
+    print(f"{'endpoint':<36} {'reqs':>7} {'rps':>8} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for endpoint, stats in report['endpoints'].items():
+        print(f"{endpoint:<36} {stats['requests']:>7} {stats['rps']:>8.1f} {stats['error_rate'] * 100:>6.2f} "
+              f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['max_ms']:>8.1f}")
+    total = report['total']
+    print(f"{'total':<36} {total['requests']:>7} {total['rps']:>8.1f} {total['error_rate'] * 100:>6.2f}")
+
+
+def check_regressions(report, baseline, tolerance, max_error_rate):
+    """
+    Compare a run with a baseline report
+
+    An endpoint regresses when its p95 latency grows, or its throughput
+    drops, by more than `tolerance` (a fraction), or when its error rate
+    exceeds `max_error_rate`.
+
+    Returns:
+        list: Human-readable failures; empty if the run passes
+    """
+    failures = []
+    for endpoint, stats in report['endpoints'].items():
+        if stats['error_rate'] > max_error_rate:
+            failures.append(f"{endpoint}: error rate {stats['error_rate']:.2%} > {max_error_rate:.2%}")
+        reference = (baseline or {}).get('endpoints', {}).get(endpoint)
+        if not reference:
+            continue
+        if stats['p95_ms'] > reference['p95_ms'] * (1 + tolerance):
+            failures.append(f"{endpoint}: p95 {stats['p95_ms']}ms vs baseline {reference['p95_ms']}ms")
+        if stats['rps'] < reference['rps'] * (1 - tolerance):
+            failures.append(f"{endpoint}: {stats['rps']} rps vs baseline {reference['rps']} rps")
+    if baseline and report['total']['rps'] < baseline['total']['rps'] * (1 - tolerance):
+        failures.append(f"total: {report['total']['rps']} rps vs baseline {baseline['total']['rps']} rps")
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load-test a running deployment with a realistic traffic mix')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--history-days', type=int, default=180, help='Readings seeded for each new user')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load after setup')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Scenario weights, among: {", ".join(SCENARIOS)}')
+    parser.add_argument('--devices', help='miio_simulator manifest; connects users to simulated scales for "sync"')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='Write the report as JSON (usable as a later --baseline)')
+    parser.add_argument('--baseline', help='Report of a previous run to gate against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95/throughput regression vs baseline')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    if 'sync' in mix and not args.devices:
+        parser.error('the sync scenario needs --devices (a tools.miio_simulator manifest)')
+
+    setup_start = time.perf_counter()
+    users = prepare_users(args.url, args.users, args.history_days, args.devices, args.concurrency)
+    print(f"Prepared {len(users)} users in {time.perf_counter() - setup_start:.1f}s; "
+          f"running {args.concurrency} clients for {args.duration:.0f}s")
+
+    samples, elapsed = run(args.url, users, mix, args.concurrency, args.duration, args.seed)
+    report = summarize(samples, elapsed)
+    report['config'] = {'users': args.users, 'concurrency': args.concurrency, 'mix': mix}
+    print_report(report)
+
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(report, out, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    failures = check_regressions(report, baseline, args.tolerance, args.max_error_rate)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,282 @@
+"""
+Local miIO scale simulator
+
+Runs many virtual Xiaomi scales on loopback addresses (127.10.0.1,
+127.10.0.2, ...), each listening on the miIO port 54321 like a real device.
+They answer the hello handshake and the encrypted miIO.info and
+get_weight_data commands closely enough for python-miio, so
+XiaomiScaleService.connect/get_scale_data and the /api/xiaomi/sync and
+/api/xiaomi/status routes can be load-tested without hardware.
+
+Latency, packet loss, command failures and offline devices can be injected
+to exercise timeout and retry behavior. A manifest (JSON list of ip, token
+and device id per scale) is written for load tests to register users with.
+
+Linux routes all of 127.0.0.0/8 to the loopback interface, so no setup is
+needed there; on macOS each address needs an lo0 alias first. Broadcast
+discovery does not reach loopback, but unicast handshakes do.
+
+Run from the backend directory:
+    python -m tools.miio_simulator --devices 2000 --manifest sim_devices.json [--latency-ms 20 --jitter-ms 10 --loss 0.01 --error-rate 0.01 --offline 0.005]
+    python -m tools.miio_simulator --bench sim_devices.json [--concurrency 64 --requests 2000]
+"""
+import argparse
+import asyncio
+import hashlib
+import ipaddress
+import json
+import logging
+import random
+import resource
+import struct
+import time
+
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+logger = logging.getLogger(__name__)
+
+MIIO_PORT = 54321
+MAGIC = 0x2131
+HEADER = struct.Struct('>HHI4sI')  # magic, length, unknown, device id, timestamp
+FIRST_ADDRESS = ipaddress.ip_address('127.10.0.1')
+MODEL = 'xiaomi.scales.sim1'
+
+# Error payload of a simulated failure; python-miio raises DeviceError for it
+FAILURE = {'code': -5001, 'message': 'simulated device failure'}
+
+
+def md5(data):
+    return hashlib.md5(data).digest()
+
+
+def encrypt(plaintext, token):
+    key = md5(token)
+    iv = md5(key + token)
+    padder = padding.PKCS7(128).padder()
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    return encryptor.update(padder.update(plaintext) + padder.finalize()) + encryptor.finalize()
+
+
+def decrypt(ciphertext, token):
+    key = md5(token)
+    iv = md5(key + token)
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    unpadder = padding.PKCS7(128).unpadder()
+    padded = decryptor.update(ciphertext) + decryptor.finalize()
+    return unpadder.update(padded) + unpadder.finalize()
+
+
+def device_spec(index, seed):
+    """Address, token and device id of the index-th simulated scale (deterministic per seed)"""
+    return {
+        'ip': str(FIRST_ADDRESS + index),
+        'token': hashlib.md5(f'{seed}:{index}'.encode()).hexdigest(),
+        'device_id': 0x5C000000 + index
+    }
+
+
+class VirtualScale(asyncio.DatagramProtocol):
+    """One simulated scale; owns the UDP socket bound to its address"""
+
+    def __init__(self, spec, options, rng):
+        self.ip = spec['ip']
+        self.token = bytes.fromhex(spec['token'])
+        self.device_id = spec['device_id'].to_bytes(4, 'big')
+        self.options = options
+        self.rng = rng
+        self.offline = rng.random() < options.offline
+        self.started = time.time()
+        self.transport = None
+
+        # Body composition baseline this scale reports around
+        self.weight = rng.uniform(50.0, 110.0)
+        self.body_fat = rng.uniform(12.0, 35.0)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if self.offline or self.rng.random() < self.options.loss:
+            return
+        response = self.handle(data)
+        if response is None:
+            return
+        delay = max(0.0, self.rng.gauss(self.options.latency_ms, self.options.jitter_ms)) / 1000
+        if delay:
+            asyncio.get_running_loop().call_later(delay, self.transport.sendto, response, addr)
+        else:
+            self.transport.sendto(response, addr)
+
+    def _timestamp(self):
+        # Devices report seconds since boot
+        return int(time.time() - self.started) + 1
+
+    def handle(self, data):
+        if len(data) < 32:
+            return None
+        magic, length, _, _, _ = HEADER.unpack_from(data)
+        if magic != MAGIC or length != len(data):
+            return None
+
+        if length == 32:
+            # Hello: reply with our device id and clock; provisioned devices hide the token
+            return HEADER.pack(MAGIC, 32, 0, self.device_id, self._timestamp()) + b'\xff' * 16
+
+        header, checksum, ciphertext = data[:16], data[16:32], data[32:]
+        if md5(header + self.token + ciphertext) != checksum:
+            # Wrong token: real devices stay silent
+            return None
+        try:
+            request = json.loads(decrypt(ciphertext, self.token).rstrip(b'\x00'))
+        except ValueError:
+            return None
+
+        if self.rng.random() < self.options.error_rate:
+            payload = {'id': request.get('id'), 'error': FAILURE}
+        else:
+            payload = self.dispatch(request)
+        return self.pack(payload)
+
+    def dispatch(self, request):
+        method = request.get('method')
+        if method == 'miIO.info':
+            result = self.info()
+        elif method == 'get_weight_data':
+            result = self.weight_data()
+        else:
+            return {'id': request.get('id'), 'error': {'code': -32601, 'message': 'Method not found'}}
+        return {'id': request.get('id'), 'result': result}
+
+    def pack(self, payload):
+        ciphertext = encrypt(json.dumps(payload).encode() + b'\x00', self.token)
+        header = HEADER.pack(MAGIC, 32 + len(ciphertext), 0, self.device_id, self._timestamp())
+        return header + md5(header + self.token + ciphertext) + ciphertext
+
+    def info(self):
+        return {
+            'model': MODEL,
+            'fw_ver': '1.0.0_sim',
+            'hw_ver': 'SIM',
+            'mac': ':'.join(f'{byte:02X}' for byte in b'\x02\x00' + self.device_id),
+            'token': self.token.hex(),
+            'life': self._timestamp(),
+            'ap': {'ssid': 'simulator', 'bssid': '00:00:00:00:00:00', 'rssi': -40},
+            'netif': {'localIp': self.ip, 'mask': '255.0.0.0', 'gw': '127.0.0.1'}
+        }
+
+    def weight_data(self):
+        """A reading in the scale's raw units (see XiaomiScaleService.process_payload)"""
+        self.weight += self.rng.gauss(0, 0.2)
+        self.body_fat += self.rng.gauss(0, 0.1)
+        weight = self.weight
+        muscle = weight * (1 - self.body_fat / 100) * 0.75
+        return {
+            'weight': int(weight * 1000),
+            'bmi': int(weight / 1.75 ** 2 * 10),
+            'bodyfat': int(self.body_fat * 10),
+            'muscle': int(muscle * 1000),
+            'water': int((100 - self.body_fat) * 0.73 * 10),
+            'visceral': max(1, int(self.body_fat / 3)),
+            'bone': int(weight * 0.04 * 1000),
+            'basal': int(370 + 21.6 * weight * (1 - self.body_fat / 100)),
+            'protein': int((100 - self.body_fat) * 0.22 * 10),
+            'timestamp': int(time.time())
+        }
+
+
+def raise_file_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        target = needed if hard == resource.RLIM_INFINITY else min(hard, needed)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        if target < needed:
+            logger.warning(f"File descriptor limit {hard} is below the {needed} the simulator needs")
+
+
+async def serve(options):
+    rng = random.Random(options.seed)
+    specs = [device_spec(index, options.seed) for index in range(options.devices)]
+    raise_file_limit(options.devices + 256)
+
+    loop = asyncio.get_running_loop()
+    for spec in specs:
+        await loop.create_datagram_endpoint(
+            lambda spec=spec: VirtualScale(spec, options, random.Random(rng.random())),
+            local_addr=(spec['ip'], options.port)
+        )
+
+    if options.manifest:
+        with open(options.manifest, 'w') as manifest:
+            json.dump(specs, manifest, indent=1)
+    print(f"Simulating {len(specs)} scales on {specs[0]['ip']}-{specs[-1]['ip']} port {options.port}"
+          + (f", manifest in {options.manifest}" if options.manifest else ''))
+
+    await asyncio.Event().wait()
+
+
+def bench(manifest_path, concurrency, requests):
+    """
+    Drive XiaomiScaleService against simulated scales and report sync throughput
+
+    Each request is a fresh service (handshake, miIO.info, get_weight_data),
+    as in POST /api/xiaomi/sync, with python-miio's default timeouts.
+    """
+    import os
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
+    import numpy as np
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from services.xiaomi_service import XiaomiScaleService
+    # One 'Connected' line per sync would drown the summary
+    logging.getLogger('services.xiaomi_service').setLevel(logging.WARNING)
+
+    with open(manifest_path) as manifest:
+        specs = json.load(manifest)
+
+    def sync_one(index):
+        spec = specs[index % len(specs)]
+        service = XiaomiScaleService(token=spec['token'], ip=spec['ip'])
+        start = time.perf_counter()
+        ok = service.connect() and service.get_scale_data() is not None
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(sync_one, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, ok in results if ok]) * 1000
+    failures = sum(1 for _, ok in results if not ok)
+    print(f"{requests} syncs in {elapsed:.1f}s: {requests / elapsed:.1f}/s, {failures} failed")
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(f"latency ms: p50 {p50:.1f}  p95 {p95:.1f}  p99 {p99:.1f}  max {latencies.max():.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate Xiaomi scales speaking miIO on loopback')
+    parser.add_argument('--devices', type=int, default=100)
+    parser.add_argument('--port', type=int, default=MIIO_PORT)
+    parser.add_argument('--seed', type=int, default=0, help='Tokens and readings are deterministic per seed')
+    parser.add_argument('--manifest', help='Write ip/token/device_id of every scale to this JSON file')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Mean response delay')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Standard deviation of the delay')
+    parser.add_argument('--loss', type=float, default=0.0, help='Probability a packet is dropped')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability a command returns an error')
+    parser.add_argument('--offline', type=float, default=0.0, help='Fraction of scales that never answer')
+    parser.add_argument('--bench', metavar='MANIFEST', help='Benchmark syncs against running scales instead of serving')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.bench:
+        bench(args.bench, args.concurrency, args.requests)
+    else:
+        try:
+            asyncio.run(serve(args))
+        except KeyboardInterrupt:
+            pass